@@ -1,18 +1,51 @@
-from datetime import datetime, timedelta
+import asyncio
+import itertools
+import json
+import time
+from datetime import datetime, timedelta, timezone
 import dateutil.parser
-from astroplan import Observer
-from astropy.coordinates import EarthLocation
-from astropy.time import Time, TimeDelta
-import astropy.units as u
-from django.conf import settings
-from django.db.models import F
-from django.http import JsonResponse, HttpResponseNotFound
+from astropy.time import Time
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    JsonResponse,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotFound,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.utils.http import parse_etags
 import numpy as np
 
-from pyobs_weather.settings import INFLUXDB_MEASUREMENT_AVERAGE
+from pyobs_weather.settings import (
+    API_MAX_AGE,
+    GOOD_WEATHER_MAX_HOURS,
+    GOOD_WEATHER_MAX_POINTS,
+    HISTORY_MAX_POINTS,
+    INFLUXDB_MEASUREMENT_AVERAGE,
+    STREAM_KEEPALIVE,
+    STREAM_POLL_INTERVAL,
+    STREAM_RETRY,
+)
 from pyobs_weather.weather.models import Station, Sensor, SensorType, GoodWeather
-from pyobs_weather.weather.tasks import create_evaluator
-from pyobs_weather.weather.influx import read_sensor_values, read_sensor_value
+from pyobs_weather.weather.downsample import OVERSAMPLE, choose_window, downsample
+from pyobs_weather.weather.ephemeris import night_events, sun_altitude
+from pyobs_weather.weather.evaluation import create_evaluator
+from pyobs_weather.weather.export import (
+    ARROW_MISSING,
+    arrow_stream,
+    csv_lines,
+    export_rows,
+    export_types,
+    has_arrow,
+    ndjson_lines,
+)
+from pyobs_weather.weather.events import get_events, last_event_id
+from pyobs_weather.weather.influx import read_sensor_value, read_latest_values, read_sensor_history
+from pyobs_weather.weather.rollup import choose_resolution
+from pyobs_weather.weather.snapshot import get_snapshot
 
 
 def stations_list(request):
@@ -27,12 +60,11 @@ def station_detail(request, station_code):
     if station is None:
         return HttpResponseNotFound("Station not found.")
 
-    # get list of sensors
+    # get list of sensors and their latest values
     sensors = []
-    for sensor in Sensor.objects.filter(station=station, active=True):
-        # get latest value
-        value = read_sensor_value(sensor)
-
+    qs = Sensor.objects.filter(station=station, active=True).select_related("station", "type")
+    values = read_latest_values(qs)
+    for sensor, value in values.items():
         # append
         sensors.append(
             {
@@ -73,46 +105,167 @@ def sensor_detail(request, station_code, sensor_code):
     )
 
 
+def _snapshot_response(request, name):
+    # get snapshot
+    snapshot = get_snapshot(name)
+    if snapshot is None:
+        return None
+    body, etag = snapshot
+
+    # client has it already?
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+
+    # set headers
+    response["ETag"] = etag
+    response["Cache-Control"] = "max-age=%d" % API_MAX_AGE
+    return response
+
+
 def current(request):
-    # get average station
-    station = Station.objects.get(code=INFLUXDB_MEASUREMENT_AVERAGE)
-    if station is None:
+    # get snapshot of current weather
+    response = _snapshot_response(request, "current")
+    if response is None:
         return HttpResponseNotFound("Could not access current weather.")
+    return response
 
-    # loop all sensors
-    sensors = {}
-    time = None
-    for sensor in Sensor.objects.filter(active=True, station__active=True):
-        # create, if necessary
-        if sensor.type.code not in sensors:
-            sensors[sensor.type.code] = {"good": None, "value": None}
-
-        # set it
-        if sensor.good is not None:
-            # if current value is None, set it with new one, otherwise and it
-            if sensors[sensor.type.code]["good"] is None:
-                sensors[sensor.type.code]["good"] = sensor.good
-            else:
-                sensors[sensor.type.code]["good"] = sensor.good and sensors[sensor.type.code]["good"]
-
-        # is average sensor?
-        if sensor.station == station:
-            # get latest value
-            value = read_sensor_value(sensor)
-
-            # set it
-            sensors[sensor.type.code]["value"] = None if value is None else value["value"]
-            if value is not None and "time" in value:
-                time = value["time"]
-
-    # totally good?
-    good = True
-    for sensor in sensors.values():
-        if sensor["good"] is not None:
-            good = good and sensor["good"]
 
-    # return all
-    return JsonResponse({"time": time, "good": good, "sensors": sensors})
+# content type and file extension for all export formats
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+}
+
+
+def _format_event(event_id, name, data):
+    return "id: %d\nevent: %s\ndata: %s\n\n" % (event_id, name, data)
+
+
+def _stream_header(after, send_id, held):
+    # tell client when to reconnect, where to continue if it has no ID yet, and whether the connection is held open
+    # or when to expect the next response, so that it can stop polling while the stream works
+    header = "retry: %d\n" % STREAM_RETRY
+    if send_id:
+        header += "id: %d\n" % after
+    return header + "event: stream\ndata: %s\n\n" % json.dumps({"held": held, "retry": STREAM_RETRY})
+
+
+async def _stream_events(after, send_id):
+    # poll for new events until client disconnects
+    yield _stream_header(after, send_id, True)
+    keepalive = time.monotonic()
+    while True:
+        events = await sync_to_async(get_events, thread_sensitive=False)(after)
+        for event in events:
+            yield _format_event(*event)
+            after = event[0]
+
+        # send comment every now and then to keep connection open
+        if len(events) > 0:
+            keepalive = time.monotonic()
+        elif time.monotonic() - keepalive > STREAM_KEEPALIVE:
+            yield ": keepalive\n\n"
+            keepalive = time.monotonic()
+
+        # wait
+        await asyncio.sleep(STREAM_POLL_INTERVAL)
+
+
+def _pending_events(after, send_id):
+    # send pending events, client reconnects and continues after the last ID it got
+    yield _stream_header(after, send_id, False)
+    for event in get_events(after):
+        yield _format_event(*event)
+
+
+async def stream(request):
+    # continue after last event seen by client, or with next new one
+    last_id = request.headers.get("Last-Event-ID", "")
+    send_id = not last_id.isdigit()
+    after = await sync_to_async(last_event_id, thread_sensitive=False)() if send_id else int(last_id)
+
+    # keep connection open under ASGI, otherwise return pending events and let client reconnect
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(_stream_events(after, send_id), content_type="text/event-stream")
+    else:
+        response = StreamingHttpResponse(_pending_events(after, send_id), content_type="text/event-stream")
+
+    # don't cache or buffer
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def _async_chunks(iterator):
+    # consume synchronous iterator in the thread used for database access, one chunk at a time
+    done = object()
+    while True:
+        chunk = await sync_to_async(next)(iterator, done)
+        if chunk is done:
+            break
+        yield chunk
+
+
+def _join_chunks(lines, size=1000):
+    # join lines to larger chunks
+    while True:
+        chunk = "".join(itertools.islice(lines, size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def export(request):
+    # get format
+    fmt = request.GET.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponseBadRequest("Unknown format.")
+    if fmt == "arrow" and not has_arrow():
+        return HttpResponse(ARROW_MISSING, status=501, content_type="text/plain")
+
+    # time range, defaults to last day
+    try:
+        end = dateutil.parser.parse(request.GET["end"]) if "end" in request.GET else datetime.now(timezone.utc)
+        start = dateutil.parser.parse(request.GET["start"]) if "start" in request.GET else end - timedelta(days=1)
+    except (ValueError, OverflowError):
+        return HttpResponseBadRequest("Invalid start or end.")
+    start = start.replace(tzinfo=timezone.utc) if start.tzinfo is None else start.astimezone(timezone.utc)
+    end = end.replace(tzinfo=timezone.utc) if end.tzinfo is None else end.astimezone(timezone.utc)
+
+    # stations and types, only allow existing ones
+    stations = request.GET.get("stations", INFLUXDB_MEASUREMENT_AVERAGE).split(",")
+    if Station.objects.filter(code__in=stations, active=True).count() != len(set(stations)):
+        return HttpResponseNotFound("Station not found.")
+    types = request.GET["types"].split(",") if "types" in request.GET else export_types(stations)
+    if SensorType.objects.filter(code__in=types).count() != len(set(types)):
+        return HttpResponseNotFound("Sensor type not found.")
+
+    # get rows
+    try:
+        rows = export_rows(stations, types, start, end, every=request.GET.get("every"))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    # format them
+    content_type, extension = EXPORT_FORMATS[fmt]
+    if fmt == "csv":
+        chunks = _join_chunks(csv_lines(types, rows))
+    elif fmt == "ndjson":
+        chunks = _join_chunks(ndjson_lines(types, rows))
+    else:
+        chunks = arrow_stream(types, rows)
+
+    # under ASGI, stream must be asynchronous to not be collected in memory
+    if isinstance(request, ASGIRequest):
+        chunks = _async_chunks(chunks)
+
+    # stream it
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response["Content-Disposition"] = 'attachment; filename="weather.%s"' % extension
+    return response
 
 
 def history_types(request):
@@ -140,25 +293,31 @@ def history(request, sensor_type):
         end = datetime.utcnow()
         start = end - timedelta(days=1)
 
+    # maximum number of points per station
+    try:
+        max_points = int(request.GET.get("max_points", HISTORY_MAX_POINTS))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid max_points.")
+    if max_points < 3:
+        return HttpResponseBadRequest("max_points must be at least 3.")
+
+    # for long ranges, read from coarser rollups and let Influx aggregate to larger windows
+    bucket, resolution = choose_resolution(start, end, max_points)
+    window = choose_window((end - start).total_seconds(), resolution, max_points * OVERSAMPLE)
+
+    # fetch mean/min/max for all sensors of that type at once
+    sensors = Sensor.objects.filter(type=st, active=True, station__history=True, station__active=True)
+    values = read_sensor_history(
+        sensors.select_related("station", "type"), start=start, end=end, every=window, bucket=bucket
+    )
+
     # loop all sensors of that type
     stations = []
     areas = []
-    for sensor in Sensor.objects.filter(type=st, active=True, station__history=True, station__active=True):
-        # get data
-        values = read_sensor_values(sensor=sensor, start=start, end=end, agg_type="mean")
-        values_min = read_sensor_values(sensor=sensor, start=start, end=end, agg_type="min")
-        values_max = read_sensor_values(sensor=sensor, start=start, end=end, agg_type="max")
-
-        # combine
-        data = [
-            {
-                "time": v["time"],
-                "value": v["value"],
-                "min": vmin["value"],
-                "max": vmax["value"],
-            }
-            for v, vmin, vmax in zip(values, values_min, values_max)
-        ]
+    for sensor, rows in values.items():
+        # downsample and combine
+        rows = downsample(rows, max_points)
+        data = [{"time": r["time"], "value": r["mean"], "min": r["min"], "max": r["max"]} for r in rows]
 
         # got average sensor?
         if sensor.station.code == INFLUXDB_MEASUREMENT_AVERAGE:
@@ -186,71 +345,55 @@ def history(request, sensor_type):
 
 
 def sensors(request):
-    # get all sensors
-    data = Sensor.objects.filter(station__active=True, active=True)
-
-    # add station and type
-    data = data.annotate(station_code=F("station__code"), station_name=F("station__name"))
-    data = data.annotate(type_code=F("type__code"), type_name=F("type__name"), unit=F("type__unit"))
-
-    # order
-    data = data.order_by("station_name", "type_name")
+    # get snapshot of all sensors
+    return _snapshot_response(request, "sensors")
 
-    # get values
-    values = list(data.values())
 
-    # add latest value
-    for i, sensor in enumerate(data):
-        val = read_sensor_value(sensor)
-        values[i]["value"] = None if val is None else val["value"]
-
-    # return all
-    return JsonResponse(values, safe=False)
+def _isot(timestamps):
+    # convert UNIX timestamp(s) to ISO strings
+    return Time(timestamps, format="unix").isot
 
 
 def timeline(request):
-    # get location
-    location = EarthLocation(
-        lon=settings.OBSERVER_LOCATION["longitude"] * u.deg,
-        lat=settings.OBSERVER_LOCATION["latitude"] * u.deg,
-        height=settings.OBSERVER_LOCATION["elevation"] * u.m,
-    )
-
-    # get observer and now
+    # get now and events of current night from ephemeris
     now = Time.now()
-    observer = Observer(location=location)
+    night = night_events(now.unix)
 
-    # night or day?
-    is_day = observer.sun_altaz(now).alt.degree > 0.0
+    # list of events, null for those that don't happen, e.g. during polar day
+    events = [None if night[e] is None else _isot(night[e]) for e in ("sunset", "dusk", "dawn", "sunrise")]
 
-    # get sunset to start with
-    sunset = observer.sun_set_time(now, which="next" if is_day else "previous")
+    # return all
+    return JsonResponse({"time": now.isot, "events": events})
 
-    # list of events
-    events = []
-    events.append(sunset.isot)
 
-    # twilight at sunset
-    sunset_twilight = observer.sun_set_time(sunset, which="next", horizon=-12.0 * u.deg)
-    events.append(sunset_twilight.isot)
+def _sun_series(hours, points):
+    # time grid is aligned to buckets of one step, so that all requests within a bucket share it
+    step = hours * 3600.0 / (points - 1)
+    end = np.floor(Time.now().unix / step) * step
+    key = "sunalt:%g:%d:%d" % (hours, points, end)
 
-    # twilight at sunrise
-    sunrise_twilight = observer.sun_rise_time(sunset_twilight, which="next", horizon=-12.0 * u.deg)
-    events.append(sunrise_twilight.isot)
+    def compute():
+        # calculate all times and altitudes at once
+        times = end - np.linspace(hours * 3600.0, 0.0, points)
+        return {"time": list(_isot(times)), "alt": sun_altitude(times).tolist()}
 
-    # sunrise
-    sunrise = observer.sun_rise_time(sunset_twilight, which="next")
-    events.append(sunrise.isot)
-
-    # return all
-    return JsonResponse({"time": now.isot, "events": events})
+    return cache.get_or_set(key, compute, timeout=max(1, int(step)))
 
 
 def good_weather(request):
-    # get changes in status from last 24 hours
+    # get time window and number of points for sun
+    try:
+        hours = float(request.GET.get("hours", 24))
+        points = int(request.GET.get("points", 100))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid hours or points.")
+    if not 0 < hours <= GOOD_WEATHER_MAX_HOURS or not 2 <= points <= GOOD_WEATHER_MAX_POINTS:
+        return HttpResponseBadRequest("Hours or points out of range.")
+
+    # get changes in status from time window
     changes = [
         {"time": g.time, "good": g.good}
-        for g in GoodWeather.objects.filter(time__gt=datetime.utcnow() - timedelta(days=1)).all()
+        for g in GoodWeather.objects.filter(time__gt=datetime.utcnow() - timedelta(hours=hours)).all()
     ]
 
     # if None, return last one
@@ -259,20 +402,8 @@ def good_weather(request):
         if last is not None:
             changes = [{"time": last.time, "good": last.good}]
 
-    # get location
-    location = EarthLocation(
-        lon=settings.OBSERVER_LOCATION["longitude"] * u.deg,
-        lat=settings.OBSERVER_LOCATION["latitude"] * u.deg,
-        height=settings.OBSERVER_LOCATION["elevation"] * u.m,
-    )
-
-    # get observer and now
-    now = Time.now()
-    observer = Observer(location=location)
-
-    # get solar elevation for last 12 hours
-    times = [now - TimeDelta((1.0 - x) * u.day) for x in np.linspace(0, 1, 100)]
-    sun = [s.alt.degree for s in observer.sun_altaz(times)]
+    # get solar elevation for time window
+    sun = _sun_series(hours, points)
 
     # return all
-    return JsonResponse({"changes": changes, "sun": {"time": [t.isot for t in times], "alt": sun}})
+    return JsonResponse({"changes": changes, "sun": sun})
@@ -180,62 +180,130 @@ function update_plots(plots) {
     setTimeout(update_plots.bind(null, plots), 60000);
 }
 
-function update_values() {
-    // do AJAX request
-    $.ajax({
-        url: rootURL + 'api/current/',
-        dataType: 'json',
-    }).done(function (results) {
-        // loop all fields on page
-        $(".sensorValue").each(function (index) {
-            // get type
-            let value_field = $(this);
-            let type = value_field.attr('data-sensor-type');
-
-            // got a value?
-            if (results.hasOwnProperty('sensors') && results.sensors.hasOwnProperty(type) &&
-                results.sensors[type].value !== null) {
-                value_field.html(results.sensors[type].value.toFixed(1));
-            } else {
-                value_field.html('N/A');
-            }
-
-            // good?
-            let color = 'black';
-            if (results.hasOwnProperty('sensors') && results.sensors.hasOwnProperty(type)) {
-                if (results.sensors[type].good === true) {
-                    color = 'green';
-                }
-                if (results.sensors[type].good === false) {
-                    color = 'red';
-                }
-            }
-            value_field.css('color', color);
-        });
+function show_value(value_field, value) {
+    // show value or N/A
+    if (value !== null && typeof value !== 'undefined') {
+        value_field.html(value.toFixed(1));
+    } else {
+        value_field.html('N/A');
+    }
+}
 
-        // set time
-        if (results.hasOwnProperty('time')) {
-            $('#time').html(moment.utc(results.time).format('HH:mm:ss'));
+function show_current(results) {
+    // loop all fields on page
+    $(".sensorValue").each(function (index) {
+        // get type
+        let value_field = $(this);
+        let type = value_field.attr('data-sensor-type');
+
+        // got a value?
+        if (results.hasOwnProperty('sensors') && results.sensors.hasOwnProperty(type)) {
+            show_value(value_field, results.sensors[type].value);
+        } else {
+            show_value(value_field, null);
         }
 
-        // set goodd
-        if (results.hasOwnProperty('good')) {
-            let p = $('#good');
-            if (results.good === null) {
-                p.html('N/A');
-                p.css('color', 'black');
-            } else {
-                p.html(results.good ? 'GOOD' : 'BAD');
-                p.css('color', results.good ? 'green' : 'red');
+        // good?
+        let color = 'black';
+        if (results.hasOwnProperty('sensors') && results.sensors.hasOwnProperty(type)) {
+            if (results.sensors[type].good === true) {
+                color = 'green';
+            }
+            if (results.sensors[type].good === false) {
+                color = 'red';
             }
         }
+        value_field.css('color', color);
+    });
+
+    // set time
+    if (results.hasOwnProperty('time')) {
+        $('#time').html(moment.utc(results.time).format('HH:mm:ss'));
+    }
+
+    // set goodd
+    if (results.hasOwnProperty('good')) {
+        let p = $('#good');
+        if (results.good === null) {
+            p.html('N/A');
+            p.css('color', 'black');
+        } else {
+            p.html(results.good ? 'GOOD' : 'BAD');
+            p.css('color', results.good ? 'green' : 'red');
+        }
+    }
+}
 
+function show_values(results) {
+    // only average values are shown
+    if (results.station !== 'average')
+        return;
+
+    // update fields for all received values
+    $(".sensorValue").each(function (index) {
+        let value_field = $(this);
+        let type = value_field.attr('data-sensor-type');
+        if (results.values.hasOwnProperty(type)) {
+            show_value(value_field, results.values[type]);
+        }
     });
 
+    // set time
+    $('#time').html(moment.utc(results.time).format('HH:mm:ss'));
+}
+
+function fetch_values() {
+    // do AJAX request
+    $.ajax({
+        url: rootURL + 'api/current/',
+        dataType: 'json',
+    }).done(show_current);
+}
+
+// time of last response from event stream, and for how long after that updates are pushed, which is forever, if
+// the server holds the stream open, and until after the next reconnect otherwise
+let stream_seen = 0;
+let stream_valid = 0;
+
+function update_values() {
+    // only poll, if updates are not pushed
+    if (Date.now() - stream_seen > stream_valid) {
+        fetch_values();
+    }
+
     // schedule next run
     setTimeout(update_values, 10000);
 }
 
+function stream_updates(good) {
+    // listen for changes, browser reconnects automatically
+    let source = new EventSource(rootURL + 'api/stream/');
+    source.addEventListener('stream', function (e) {
+        let data = JSON.parse(e.data);
+        stream_seen = Date.now();
+        stream_valid = data['held'] ? Infinity : 2 * data['retry'];
+    });
+    source.addEventListener('error', function (e) {
+        // without a held connection, the server closes it after each response, so just wait for the next one
+        if (stream_valid === Infinity) {
+            stream_valid = 0;
+        }
+    });
+    source.addEventListener('current', function (e) {
+        show_current(JSON.parse(e.data));
+    });
+    source.addEventListener('values', function (e) {
+        show_values(JSON.parse(e.data));
+    });
+    source.addEventListener('goodweather', function (e) {
+        plot_good_history(good);
+    });
+    source.addEventListener('reset', function (e) {
+        fetch_values();
+        plot_good_history(good);
+    });
+}
+
 function draw_timeline() {
     // get container and canvas
     let container = $('#timeline');
@@ -252,12 +320,21 @@ function draw_timeline() {
         url: rootURL + 'api/timeline/',
         dataType: 'json',
     }).done(function (results) {
-        // get times
+        // no night at all, e.g. during polar day or night?
+        let events = results['events'];
+        if (events[0] === null || events[3] === null) {
+            ctx.clearRect(0, 0, canvas.width, 20);
+            $('#sunset, #sunrise, #sunset_twilight, #sunrise_twilight').text('');
+            return;
+        }
+
+        // get times, without astronomical night both twilights end in the middle of the night
         let now = moment(results['time'])
-        let sunset = moment(results['events'][0]);
-        let sunset_twilight = moment(results['events'][1]);
-        let sunrise_twilight = moment(results['events'][2]);
-        let sunrise = moment(results['events'][3]);
+        let sunset = moment(events[0]);
+        let sunrise = moment(events[3]);
+        let middle = moment((sunset.valueOf() + sunrise.valueOf()) / 2);
+        let sunset_twilight = events[1] === null ? middle : moment(events[1]);
+        let sunrise_twilight = events[2] === null ? middle : moment(events[2]);
 
         // total length
         let total = sunrise.unix() - sunset.unix();
@@ -297,8 +374,8 @@ function draw_timeline() {
         // text
         $('#sunset').text('Sunset: ' + sunset.format('HH:mm') + ' UT')
         $('#sunrise').text('Sunrise: ' + sunrise.format('HH:mm') + ' UT')
-        $('#sunset_twilight').text('Dusk: ' + sunset_twilight.format('HH:mm') + ' UT')
-        $('#sunrise_twilight').text('Dawn: ' + sunrise_twilight.format('HH:mm') + ' UT')
+        $('#sunset_twilight').text('Dusk: ' + (events[1] === null ? '-' : sunset_twilight.format('HH:mm') + ' UT'))
+        $('#sunrise_twilight').text('Dawn: ' + (events[2] === null ? '-' : sunrise_twilight.format('HH:mm') + ' UT'))
 
         // text positions
         $('#twilight').css("paddingLeft", px_sunset_twilight - $('#sunset_twilight').width() / 2);
@@ -432,9 +509,9 @@ function plot_good_history(chart) {
     });
 }
 
-function update_good_history(chart) {
+function update_good_history(chart, interval) {
     plot_good_history(chart);
-    setTimeout(update_good_history.bind(0, chart), 60000);
+    setTimeout(update_good_history.bind(0, chart, interval), interval);
 }
 
 $(function () {
@@ -445,6 +522,13 @@ $(function () {
     let plots = create_plots();
     update_plots(plots);
     let good = create_good_history();
-    update_good_history(good);
+
+    // push updates, if supported, and poll unless the server holds the stream open
+    if (typeof EventSource !== 'undefined') {
+        update_good_history(good, 300000);
+        stream_updates(good);
+    } else {
+        update_good_history(good, 60000);
+    }
     update_values();
 });
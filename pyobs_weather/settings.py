@@ -3,6 +3,7 @@ Django settings for pyobs_weather project.
 """
 
 import os
+import tempfile
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -32,6 +33,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "pyobs_weather.weather.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -76,6 +78,17 @@ DATABASES = {
 }
 
 
+# Cache, must be shared between web and Celery processes, since it holds locks, snapshots and events, so use the
+# database (after running createcachetable) or e.g. django.core.cache.backends.redis.RedisCache
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.db.DatabaseCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", "weather_cache"),
+    }
+}
+
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -119,6 +132,36 @@ STATIC_ROOT = os.environ.get("STATIC_ROOT", "/static/")
 BROKER_URL = os.environ.get("CELERY_BROKER_URL", "amqp://")
 CELERY_RESULT_BACKEND = os.environ.get("CELERY_RESULT_BACKEND", "rpc://")
 
+# Tasks hold a lock in the cache while running, so that no two runs for the same station overlap. Locks expire
+# after TASK_LOCK_TIMEOUT seconds in case a worker dies. Queued periodic tasks expire after their interval.
+
+TASK_LOCK_TIMEOUT = int(os.environ.get("TASK_LOCK_TIMEOUT", "300"))
+
+
+# Evaluation, either only every EVALUATE_SWEEP_INTERVAL seconds, or also for every station that got new data
+
+EVALUATE_ON_INGEST = os.environ.get("EVALUATE_ON_INGEST", "0") == "1"
+EVALUATE_DEBOUNCE = int(os.environ.get("EVALUATE_DEBOUNCE", "2"))
+EVALUATE_SWEEP_INTERVAL = int(os.environ.get("EVALUATE_SWEEP_INTERVAL", "60" if EVALUATE_ON_INGEST else "10"))
+
+
+# Snapshots of current weather and sensors for the API, refreshed after each evaluation and expiring after
+# API_SNAPSHOT_TTL seconds, at most one evaluation interval by default. They are only cached with a shared cache
+# backend, otherwise built for every request. Clients may use a response for API_MAX_AGE seconds before revalidating.
+
+API_SNAPSHOT_TTL = int(os.environ.get("API_SNAPSHOT_TTL", str(EVALUATE_SWEEP_INTERVAL)))
+API_MAX_AGE = int(os.environ.get("API_MAX_AGE", "5"))
+
+
+# Server-sent events, kept in a ring buffer of EVENTS_BUFFER events in the cache. Under ASGI, streams poll the buffer
+# every STREAM_POLL_INTERVAL seconds and send a keep-alive every STREAM_KEEPALIVE seconds. Under WSGI, each request
+# returns pending events only and clients reconnect after STREAM_RETRY milliseconds.
+
+EVENTS_BUFFER = int(os.environ.get("EVENTS_BUFFER", "1000"))
+STREAM_POLL_INTERVAL = float(os.environ.get("STREAM_POLL_INTERVAL", "1.0"))
+STREAM_KEEPALIVE = float(os.environ.get("STREAM_KEEPALIVE", "15.0"))
+STREAM_RETRY = int(os.environ.get("STREAM_RETRY", "5000"))
+
 
 # Weather sensors
 
@@ -130,6 +173,17 @@ WEATHER_PLOTS = os.environ.get(
 ).split(",")
 
 
+# HTTP requests of weather stations, timeout as "connect,read" in seconds
+
+STATION_HTTP_TIMEOUT = tuple(float(t) for t in os.environ.get("STATION_HTTP_TIMEOUT", "5,30").split(","))
+STATION_HTTP_POOL_SIZE = int(os.environ.get("STATION_HTTP_POOL_SIZE", "10"))
+
+# Instances of stations are kept between updates in each worker, and checked for changes in the database every
+# STATION_REGISTRY_TTL seconds. Saving a station in the admin invalidates them immediately with a shared cache.
+
+STATION_REGISTRY_TTL = int(os.environ.get("STATION_REGISTRY_TTL", "60"))
+
+
 # Observer
 
 OBSERVER_NAME = os.environ.get("OBSERVER_NAME", "MONET/N @ McDonald Observatory")
@@ -139,6 +193,21 @@ OBSERVER_LOCATION = {
     "elevation": float(os.environ.get("OBSERVER_ELEVATION", "2075.0")),
 }
 
+# Solar ephemeris, computed for EPHEMERIS_DAYS days on a grid with EPHEMERIS_STEP seconds, cached in EPHEMERIS_FILE
+
+EPHEMERIS_DAYS = float(os.environ.get("EPHEMERIS_DAYS", "3"))
+EPHEMERIS_STEP = float(os.environ.get("EPHEMERIS_STEP", "60"))
+EPHEMERIS_FILE = os.environ.get("EPHEMERIS_FILE", os.path.join(tempfile.gettempdir(), "pyobs-weather-ephemeris.npz"))
+
+# Default for maximum number of points per station in history plots
+
+HISTORY_MAX_POINTS = int(os.environ.get("HISTORY_MAX_POINTS", "1000"))
+
+# Limits for time window and number of points of sun altitude in history of good weather
+
+GOOD_WEATHER_MAX_HOURS = float(os.environ.get("GOOD_WEATHER_MAX_HOURS", "168"))
+GOOD_WEATHER_MAX_POINTS = int(os.environ.get("GOOD_WEATHER_MAX_POINTS", "5000"))
+
 WINDOW_TITLE = os.environ.get("WINDOW_TITLE", "Weather at " + OBSERVER_NAME)
 
 
@@ -150,8 +219,35 @@ INFLUXDB_TOKEN = os.environ.get("INFLUXDB_TOKEN", "")
 INFLUXDB_ORG = os.environ.get("INFLUXDB_ORG", "")
 INFLUXDB_BUCKET = os.environ.get("INFLUXDB_BUCKET", "weather")
 INFLUXDB_BUCKET_5MIN = os.environ.get("INFLUXDB_BUCKET_5MIN", "weather_average")
+INFLUXDB_BUCKET_1H = os.environ.get("INFLUXDB_BUCKET_1H", "weather_1h")
+INFLUXDB_BUCKET_1D = os.environ.get("INFLUXDB_BUCKET_1D", "weather_1d")
 INFLUXDB_MEASUREMENT_AVERAGE = os.environ.get("INFLUXDB_MEASUREMENT_AVERAGE", "average")
 
+# "synchronous" to block until every write is finished, "batching" to write in background, which is faster, but
+# drops points with only a log message, if Influx is unavailable for longer than all retries
+INFLUXDB_WRITE_MODE = os.environ.get("INFLUXDB_WRITE_MODE", "synchronous")
+INFLUXDB_BATCH_SIZE = int(os.environ.get("INFLUXDB_BATCH_SIZE", "500"))
+INFLUXDB_FLUSH_INTERVAL = float(os.environ.get("INFLUXDB_FLUSH_INTERVAL", "1.0"))
+INFLUXDB_QUEUE_SIZE = int(os.environ.get("INFLUXDB_QUEUE_SIZE", "10000"))
+INFLUXDB_MAX_RETRIES = int(os.environ.get("INFLUXDB_MAX_RETRIES", "5"))
+INFLUXDB_RETRY_INTERVAL = float(os.environ.get("INFLUXDB_RETRY_INTERVAL", "1.0"))
+
+# Rollups of raw data to 5 minutes, 1 hour and 1 day, run every ROLLUP_INTERVAL seconds for all windows that ended
+# more than ROLLUP_DELAY seconds ago, starting ROLLUP_BACKFILL days in the past on first run. Disabled by default,
+# since they write into INFLUXDB_BUCKET_5MIN, which might be filled by a task in InfluxDB already
+ROLLUP = os.environ.get("ROLLUP", "0") == "1"
+ROLLUP_INTERVAL = int(os.environ.get("ROLLUP_INTERVAL", "300"))
+ROLLUP_DELAY = int(os.environ.get("ROLLUP_DELAY", "600"))
+ROLLUP_BACKFILL = float(os.environ.get("ROLLUP_BACKFILL", "7"))
+
+
+# Latest values, "local" for a process-local store (single worker process only), "django" for the Django cache
+# configured above, or empty to always read from InfluxDB
+
+LATEST_VALUE_CACHE = os.environ.get("LATEST_VALUE_CACHE", "")
+LATEST_VALUE_CACHE_ALIAS = os.environ.get("LATEST_VALUE_CACHE_ALIAS", "default")
+LATEST_VALUE_CACHE_TTL = int(os.environ.get("LATEST_VALUE_CACHE_TTL", "300"))
+
 
 # try to import a local_settings.py
 try:
@@ -17,6 +17,8 @@ from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
+from pyobs_weather.weather.metrics import metrics
+
 # get root url
 root_url = settings.ROOT_URL
 if root_url.startswith('/'):
@@ -27,4 +29,5 @@ urlpatterns = [
     path(root_url, include('pyobs_weather.frontend.urls')),
     path(root_url + 'admin/', admin.site.urls),
     path(root_url + 'api/', include('pyobs_weather.api.urls')),
+    path(root_url + 'metrics', metrics, name='metrics'),
 ]
@@ -1,8 +1,9 @@
 from django.contrib import admin
 
-from pyobs_weather.weather.models import Station, SensorType, Sensor, Evaluator
+from pyobs_weather.weather.models import Station, SensorType, Sensor, Evaluator, RollupWatermark
 
 admin.site.register(Station)
 admin.site.register(SensorType)
 admin.site.register(Sensor)
 admin.site.register(Evaluator)
+admin.site.register(RollupWatermark)
@@ -5,7 +5,21 @@ class MainConfig(AppConfig):
     name = 'pyobs_weather.weather'
 
     def ready(self):
-        from pyobs_weather.settings import USE_INFLUX
+        from pyobs_weather.settings import USE_INFLUX, EVALUATE_ON_INGEST
         if USE_INFLUX:
             from . import influx
-            influx.get_client()
\ No newline at end of file
+            influx.get_client()
+
+        # check configuration
+        from . import checks
+
+        # rebuild instances of stations when they change
+        from . import registry
+
+        # push new values to clients
+        from . import events, signals
+        signals.sensors_updated.connect(events.publish_values)
+
+        if EVALUATE_ON_INGEST:
+            from . import tasks
+            signals.sensors_updated.connect(tasks.schedule_evaluation)
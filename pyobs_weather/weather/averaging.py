@@ -0,0 +1,98 @@
+from typing import List
+
+import numpy as np
+
+AVERAGE_MODES = [
+    ("mean", "Weighted mean"),
+    ("median", "Weighted median"),
+    ("sigmaclip", "Sigma-clipped weighted mean"),
+    ("circular", "Weighted circular mean, for angles in degrees"),
+]
+
+
+def weighted_median(values: np.ndarray, weights: np.ndarray) -> float:
+    """Calculates the weighted median of the given values.
+
+    Args:
+        values: Values to calculate median for.
+        weights: Weights for values.
+
+    Returns:
+        Weighted median.
+    """
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    return float(values[order][np.searchsorted(cumulative, 0.5 * cumulative[-1])])
+
+
+def sigma_clipped_mean(values: np.ndarray, weights: np.ndarray, sigma: float = 3.0, iterations: int = 5) -> float:
+    """Calculates the weighted mean after iteratively rejecting outliers around the weighted median.
+
+    Args:
+        values: Values to calculate mean for.
+        weights: Weights for values.
+        sigma: Values further away from the median than this number of standard deviations are rejected.
+        iterations: Maximum number of iterations.
+
+    Returns:
+        Sigma-clipped weighted mean.
+    """
+    mask = np.ones(len(values), dtype=bool)
+    for _ in range(iterations):
+        center = weighted_median(values[mask], weights[mask])
+        std = np.sqrt(np.average((values[mask] - center) ** 2, weights=weights[mask]))
+        new_mask = np.abs(values - center) <= sigma * std
+        if np.array_equal(new_mask, mask) or not np.any(new_mask):
+            break
+        mask = new_mask
+    return float(np.average(values[mask], weights=weights[mask]))
+
+
+def aggregate(groups: np.ndarray, values: np.ndarray, weights: np.ndarray, modes: List[str]) -> np.ndarray:
+    """Calculates averages for many groups of values at once.
+
+    Means and circular means of all groups are calculated together, medians and sigma-clipped means per group.
+
+    Args:
+        groups: Index of group for each value.
+        values: Values to average.
+        weights: Weight for each value, values with non-positive weights are ignored.
+        modes: Average mode for each group, one of those in AVERAGE_MODES.
+
+    Returns:
+        Average for each group, NaN if a group has no values.
+    """
+
+    # ignore values without weight
+    valid = (weights > 0) & ~np.isnan(values)
+    groups, values, weights = groups[valid], values[valid], weights[valid]
+    n = len(modes)
+    modes_arr = np.array(modes)
+
+    # sum of weights for each group
+    total = np.bincount(groups, weights=weights, minlength=n)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # weighted mean for all groups
+        result = np.bincount(groups, weights=weights * values, minlength=n) / total
+
+        # circular mean for all groups
+        rad = np.radians(values)
+        sin = np.bincount(groups, weights=weights * np.sin(rad), minlength=n)
+        cos = np.bincount(groups, weights=weights * np.cos(rad), minlength=n)
+        circular = np.degrees(np.arctan2(sin, cos)) % 360.0
+        result = np.where(modes_arr == "circular", circular, result)
+
+    # groups without values
+    result[total == 0] = np.nan
+
+    # medians and sigma-clipped means
+    for i, mode in enumerate(modes):
+        if mode in ("median", "sigmaclip") and total[i] > 0:
+            idx = groups == i
+            func = weighted_median if mode == "median" else sigma_clipped_mean
+            result[i] = func(values[idx], weights[idx])
+    return result
+
+
+__all__ = ["AVERAGE_MODES", "aggregate", "weighted_median", "sigma_clipped_mean"]
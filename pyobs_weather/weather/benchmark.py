@@ -0,0 +1,351 @@
+import contextlib
+import io
+import logging
+import math
+import os
+import platform
+import re
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from influxdb_client.client.flux_table import FluxRecord, FluxTable, TableList
+
+from pyobs_weather import version
+from pyobs_weather.settings import INFLUXDB_MEASUREMENT_AVERAGE
+from pyobs_weather.weather import influx, latest, signals, tasks
+from pyobs_weather.weather.models import Evaluator, Sensor, Station
+from pyobs_weather.weather.registry import get_station
+
+log = logging.getLogger(__name__)
+
+# number of sensors of each synthetic station, i.e. of stations.Dummy
+SENSORS_PER_STATION = 6
+
+# distance between raw values in seconds, as for a station polled every 10 seconds
+RAW_STEP = 10
+
+# evaluators attached to the sensors of synthetic stations, by sensor type
+EVALUATORS = {
+    "humid": ("bench_humid", "pyobs_weather.weather.evaluators.SchmittTrigger", '{"good": 80, "bad": 85}'),
+    "windspeed": ("bench_wind", "pyobs_weather.weather.evaluators.Switch", '{"threshold": 40}'),
+    "rain": ("bench_rain", "pyobs_weather.weather.evaluators.Boolean", '{"invert": true}'),
+}
+
+
+def _synthetic(station: str, field: str, t: float) -> float:
+    """A smooth, deterministic value for each station, field and time."""
+    phase = sum(ord(c) for c in station + field) % 100
+    return round(50.0 + 40.0 * math.sin(t / 3600.0 + phase), 2)
+
+
+class FakeInflux:
+    """In-memory stand-in for InfluxDBClient, answering the queries in influx.py with synthetic values.
+
+    Queries are recognized by their shape, not parsed as Flux, and results are built from the same FluxRecord and
+    FluxTable classes the real client returns, so that processing them costs the same. Written points are
+    serialized to line protocol, and the latest value of each field is returned by last() queries.
+    """
+
+    def __init__(self):
+        self.latest: Dict[Tuple[str, str], dict] = {}
+        self.queries = 0
+        self.points = 0
+
+    def reset(self) -> None:
+        """Forgets written values and resets counters."""
+        self.latest.clear()
+        self.queries = 0
+        self.points = 0
+
+    def query_api(self) -> "FakeInflux":
+        return self
+
+    def write_api(self, *args, **kwargs) -> "FakeInflux":
+        return self
+
+    def write(self, bucket: str, org: str, record) -> None:
+        for point in record if isinstance(record, list) else [record]:
+            point.to_line_protocol()
+            t = datetime.strptime(point._time, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+            for field, value in point._fields.items():
+                self.latest[point._name, field] = {"time": t, "value": value}
+            self.points += 1
+
+    @staticmethod
+    def _pairs(query: str) -> List[Tuple[str, str]]:
+        """Returns all (station, field) pairs from a filter built by influx._sensor_filter()."""
+        pairs = []
+        for station, fields in re.findall(r'r\._measurement == "([^"]+)" and \((.*?)\)\)', query):
+            pairs.extend((station, field) for field in re.findall(r'r\._field == "([^"]+)"', fields))
+        return pairs
+
+    @staticmethod
+    def _range(query: str) -> Tuple[float, float]:
+        start, stop = re.search(r"range\(start: (\S+), stop: (\S+)\)", query).groups()
+        return (
+            datetime.strptime(start, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp(),
+            datetime.strptime(stop, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp(),
+        )
+
+    @staticmethod
+    def _step(query: str, default: int) -> int:
+        every = re.search(r"aggregateWindow\(every: (\d+)([smhd])", query)
+        if every is None:
+            return default
+        return int(every.group(1)) * {"s": 1, "m": 60, "h": 3600, "d": 86400}[every.group(2)]
+
+    def _records(self, query: str) -> Iterator[FluxRecord]:
+        self.queries += 1
+        now = datetime.now(timezone.utc)
+
+        # latest values
+        if "last()" in query:
+            for station, field in self._pairs(query):
+                value = self.latest.get((station, field))
+                if value is None:
+                    value = {"time": now, "value": _synthetic(station, field, now.timestamp())}
+                yield FluxRecord(
+                    0, {"_measurement": station, "_field": field, "_time": value["time"], "_value": value["value"]}
+                )
+
+        # history, pivoted by aggregation type
+        elif 'columnKey: ["agg_type"]' in query:
+            start, stop = self._range(query)
+            step = self._step(query, 300)
+            for station, field in self._pairs(query):
+                for t in range(int(start - start % step + step), int(stop), step):
+                    v = _synthetic(station, field, t)
+                    yield FluxRecord(
+                        0,
+                        {
+                            "_measurement": station,
+                            "_field": field,
+                            "_time": datetime.fromtimestamp(t, tz=timezone.utc),
+                            "mean": v,
+                            "min": v - 1.0,
+                            "max": v + 1.0,
+                        },
+                    )
+
+        # raw or aggregated values, pivoted by field
+        elif 'columnKey: ["_field"]' in query:
+            start, stop = self._range(query)
+            step = self._step(query, RAW_STEP)
+            stations: Dict[str, List[str]] = {}
+            for station, field in self._pairs(query):
+                stations.setdefault(station, []).append(field)
+            for t in range(int(start - start % step + step), int(stop), step):
+                for station, fields in sorted(stations.items()):
+                    values = {"_measurement": station, "_time": datetime.fromtimestamp(t, tz=timezone.utc)}
+                    values.update({field: _synthetic(station, field, t) for field in fields})
+                    yield FluxRecord(0, values)
+
+    def query(self, org: str, query: str) -> TableList:
+        table = FluxTable()
+        table.records = list(self._records(query))
+        result = TableList()
+        result.append(table)
+        return result
+
+    def query_stream(self, org: str, query: str) -> Iterator[FluxRecord]:
+        return self._records(query)
+
+
+@contextlib.contextmanager
+def fake_influx(fake: FakeInflux) -> Iterator[FakeInflux]:
+    """Routes all Influx queries and writes to the given stand-in."""
+    with influx.use_client(fake):
+        yield fake
+
+
+def create_stations(sensors: int) -> List[Station]:
+    """Creates synthetic stations and an average station, with evaluators attached to some sensor types.
+
+    Args:
+        sensors: Number of sensors to create, rounded up to full stations.
+
+    Returns:
+        List of synthetic stations.
+    """
+
+    # stations, which create their sensors on save
+    stations = [
+        Station.objects.create(
+            code="bench%04d" % i, name="Benchmark %d" % i, class_name="pyobs_weather.weather.stations.Dummy"
+        )
+        for i in range(math.ceil(sensors / SENSORS_PER_STATION))
+    ]
+    Station.objects.get_or_create(
+        code=INFLUXDB_MEASUREMENT_AVERAGE,
+        defaults={"name": "Average", "class_name": "pyobs_weather.weather.stations.Average", "history": False},
+    )
+
+    # evaluators
+    for code, (name, class_name, kwargs) in EVALUATORS.items():
+        evaluator, _ = Evaluator.objects.get_or_create(name=name, defaults={"class_name": class_name, "kwargs": kwargs})
+        evaluator.sensor_set.add(*Sensor.objects.filter(station__in=stations, type__code=code))
+    return stations
+
+
+def _update(station: Station) -> None:
+    get_station(station.code).update()
+
+
+class Scenario(NamedTuple):
+    """A benchmarked code path, run repeatedly on a prepared set of stations."""
+
+    name: str
+    run: Callable[[List[Station]], None]
+
+
+def _dump(stations: List[Station]) -> None:
+    end = datetime.now(timezone.utc).replace(microsecond=0)
+    args = ["-s", (end - timedelta(hours=1)).isoformat(), "-e", end.isoformat(), "-o", os.devnull, "--backend", "influx"]
+    for station in stations:
+        args += ["--station", station.code]
+    call_command("dump_weather", *args, stderr=io.StringIO())
+
+
+def _request(view: Callable, *args, **params) -> None:
+    response = view(RequestFactory().get("/", params), *args)
+    if response.status_code != 200:
+        raise RuntimeError("%s returned status %d." % (view.__name__, response.status_code))
+
+
+def _scenarios() -> List[Scenario]:
+    from pyobs_weather.api import views
+
+    return [
+        Scenario("ingest", lambda stations: [_update(station) for station in stations]),
+        Scenario("evaluate", lambda stations: tasks.evaluate()),
+        Scenario("average", lambda stations: _update(Station.objects.get(code=INFLUXDB_MEASUREMENT_AVERAGE))),
+        Scenario("api.current", lambda stations: _request(views.current)),
+        Scenario("api.sensors", lambda stations: _request(views.sensors)),
+        Scenario("api.history", lambda stations: _request(views.history, "humid")),
+        Scenario("dump_weather", _dump),
+    ]
+
+
+SCENARIOS = [scenario.name for scenario in _scenarios()]
+
+
+@contextlib.contextmanager
+def private_cache() -> Iterator[None]:
+    """Replaces all caches by a cache private to the benchmark, so that clearing it doesn't touch shared caches.
+
+    Since everything runs in this process, the caches are marked as shared, so that snapshots are still cached.
+    """
+    caches = {
+        alias: {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "benchmark-%s" % alias,
+            "SHARED": True,
+        }
+        for alias in settings.CACHES
+    }
+    with override_settings(CACHES=caches):
+        yield
+
+
+def _measure(scenario: Scenario, stations: List[Station], fake: FakeInflux, repeat: int) -> dict:
+    """Runs a scenario once for warming up and then repeatedly, and returns timings and query counts of the last run."""
+    scenario.run(stations)
+    timings = []
+    for _ in range(repeat):
+        fake.queries = fake.points = 0
+        with CaptureQueriesContext(connection) as sql:
+            start = time.perf_counter()
+            scenario.run(stations)
+            timings.append((time.perf_counter() - start) * 1000.0)
+    return {
+        "min_ms": min(timings),
+        "median_ms": statistics.median(timings),
+        "mean_ms": statistics.mean(timings),
+        "max_ms": max(timings),
+        "sql_queries": len(sql.captured_queries),
+        "influx_queries": fake.queries,
+        "influx_points": fake.points,
+    }
+
+
+def run_benchmarks(sizes: List[int], scenarios: Optional[List[str]] = None, repeat: int = 5) -> dict:
+    """Runs benchmarks for all scenarios and numbers of sensors.
+
+    Each size runs in a transaction that is rolled back afterwards, so this should be used with an empty test
+    database. Influx is replaced by FakeInflux, caches by private ones, and evaluations are not scheduled on ingest.
+
+    Args:
+        sizes: Numbers of sensors to run benchmarks for.
+        scenarios: Names of scenarios to run, defaults to all.
+        repeat: Number of timed runs for each scenario and size.
+
+    Returns:
+        Dict with environment and a result for each scenario and size, keyed as "<scenario>[<sensors>]".
+    """
+    selected = [s for s in _scenarios() if scenarios is None or s.name in scenarios]
+    results = {}
+    fake = FakeInflux()
+    scheduling = signals.sensors_updated.disconnect(tasks.schedule_evaluation)
+    try:
+        for size in sizes:
+            with private_cache(), fake_influx(fake), latest.use_store(None), transaction.atomic():
+                # fresh data for each size
+                fake.reset()
+                cache.clear()
+                stations = create_stations(size)
+                for station in stations:
+                    _update(station)
+
+                # run all scenarios
+                for scenario in selected:
+                    log.info("Running %s with %d sensors...", scenario.name, size)
+                    result = _measure(scenario, stations, fake, repeat)
+                    result["sensors"] = len(stations) * SENSORS_PER_STATION
+                    results["%s[%d]" % (scenario.name, size)] = result
+
+                # throw everything away
+                transaction.set_rollback(True)
+    finally:
+        if scheduling:
+            signals.sensors_updated.connect(tasks.schedule_evaluation)
+
+    return {
+        "version": version.VERSION,
+        "time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": connection.vendor,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare_benchmarks(baseline: dict, current: dict, threshold: float = 1.2) -> List[Tuple[str, float]]:
+    """Compares median timings of two benchmark runs.
+
+    Args:
+        baseline: Results of previous run.
+        current: Results of current run.
+        threshold: Ratio of medians above which a result counts as a regression.
+
+    Returns:
+        List of (key, ratio) tuples for all results that regressed.
+    """
+    regressions = []
+    for key, result in current["results"].items():
+        if key in baseline["results"]:
+            ratio = result["median_ms"] / max(baseline["results"][key]["median_ms"], 1e-6)
+            if ratio > threshold:
+                regressions.append((key, ratio))
+    return regressions
+
+
+__all__ = ["SCENARIOS", "FakeInflux", "fake_influx", "create_stations", "run_benchmarks", "compare_benchmarks"]
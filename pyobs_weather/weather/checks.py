@@ -0,0 +1,24 @@
+from django.core.checks import Error, Tags, register
+
+from pyobs_weather.weather.utils import is_shared_cache
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Checks that the default cache is shared between processes.
+
+    Locks of tasks, debouncing of evaluations, API snapshots and events are all kept in the cache, so with a cache
+    that lives in a single process, web and Celery workers would neither see nor exclude each other.
+    """
+    if is_shared_cache():
+        return []
+    return [
+        Error(
+            "The default cache is not shared between processes.",
+            hint="Use django.core.cache.backends.db.DatabaseCache or a Redis cache via CACHE_BACKEND.",
+            id="weather.E001",
+        )
+    ]
+
+
+__all__ = ["check_shared_cache"]
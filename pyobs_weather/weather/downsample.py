@@ -0,0 +1,123 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Influx returns up to this many times more values than requested, which then get reduced by LTTB
+OVERSAMPLE = 4
+
+# windows for aggregating history in Influx, as Flux duration and length in seconds
+WINDOWS = [
+    ("10m", 600),
+    ("15m", 900),
+    ("30m", 1800),
+    ("1h", 3600),
+    ("2h", 7200),
+    ("3h", 10800),
+    ("6h", 21600),
+    ("12h", 43200),
+    ("1d", 86400),
+]
+
+
+def choose_window(seconds: float, resolution: int, max_points: int) -> Optional[str]:
+    """Chooses the smallest aggregation window that gives at most max_points values for a time range.
+
+    Args:
+        seconds: Length of time range in seconds.
+        resolution: Resolution of stored data in seconds.
+        max_points: Maximum number of values.
+
+    Returns:
+        Flux duration, or None, if data at given resolution is coarse enough.
+    """
+    if seconds / resolution <= max_points:
+        return None
+    windows = [window for window in WINDOWS if window[1] > resolution]
+    for window, length in windows:
+        if seconds / length <= max_points:
+            return window
+    return windows[-1][0] if len(windows) > 0 else None
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Selects points using the Largest-Triangle-Three-Buckets algorithm.
+
+    First and last point are always kept, all others are divided into n-2 buckets, from each of which the point that
+    forms the largest triangle with the previously selected point and the average of the next bucket is selected.
+
+    Args:
+        x: X values, sorted.
+        y: Y values, NaNs are never selected, unless a bucket contains nothing else.
+        n: Number of points to select.
+
+    Returns:
+        Indices of selected points, and bucket edges as indices, so that point i was chosen from edges[i]:edges[i+1].
+    """
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size), np.arange(size + 1)
+
+    # bucket edges, with first and last point in buckets of their own
+    edges = np.concatenate(([0], np.linspace(1, size - 1, n - 1).astype(int), [size]))
+
+    # average of each bucket, for which NaNs are ignored
+    valid = ~np.isnan(y)
+    yv = np.where(valid, y, 0.0)
+    counts = np.add.reduceat(valid.astype(float), edges[:-1])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_x = np.add.reduceat(x, edges[:-1]) / np.diff(edges)
+        avg_y = np.add.reduceat(yv, edges[:-1]) / counts
+
+    # select points, each depends on the one selected before
+    selected = np.zeros(n, dtype=int)
+    for i in range(1, n - 1):
+        a = selected[i - 1]
+        lo, hi = edges[i], edges[i + 1]
+        cx, cy = avg_x[i + 1], (avg_y[i + 1] if counts[i + 1] > 0 else y[a])
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        selected[i] = lo + (np.nanargmax(area) if np.any(~np.isnan(area)) else 0)
+    selected[-1] = size - 1
+    return selected, edges
+
+
+def downsample(rows: List[dict], max_points: int) -> List[dict]:
+    """Downsamples history rows, selecting means with LTTB and keeping the min/max envelope of each bucket.
+
+    Args:
+        rows: List of dicts with time, mean, min and max, sorted by time.
+        max_points: Maximum number of rows to return.
+
+    Returns:
+        Downsampled rows.
+    """
+    if len(rows) <= max_points:
+        return rows
+
+    # to arrays
+    x = np.array([np.datetime64(r["time"].rstrip("Z"), "s") for r in rows]).astype(float)
+    mean = np.array([np.nan if r.get("mean") is None else r["mean"] for r in rows], dtype=float)
+    vmin = np.array([np.nan if r.get("min") is None else r["min"] for r in rows], dtype=float)
+    vmax = np.array([np.nan if r.get("max") is None else r["max"] for r in rows], dtype=float)
+
+    # select points for mean, and get envelope of their buckets
+    selected, edges = lttb(x, mean, max_points)
+    with np.errstate(invalid="ignore"):
+        bucket_min = np.fmin.reduceat(vmin, edges[:-1])
+        bucket_max = np.fmax.reduceat(vmax, edges[:-1])
+
+    def _value(v: float) -> Optional[float]:
+        return None if np.isnan(v) else float(v)
+
+    # build rows
+    return [
+        {
+            "time": rows[idx]["time"],
+            "mean": _value(mean[idx]),
+            "min": _value(bucket_min[i]),
+            "max": _value(bucket_max[i]),
+        }
+        for i, idx in enumerate(selected)
+    ]
+
+
+__all__ = ["OVERSAMPLE", "WINDOWS", "choose_window", "lttb", "downsample"]
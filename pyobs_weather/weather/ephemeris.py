@@ -0,0 +1,265 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import astropy.units as u
+import numpy as np
+from astropy.coordinates import AltAz, EarthLocation, get_sun
+from astropy.time import Time
+from django.conf import settings
+
+from pyobs_weather.settings import EPHEMERIS_DAYS, EPHEMERIS_FILE, EPHEMERIS_STEP
+
+log = logging.getLogger(__name__)
+
+# horizons for sunset/sunrise and for twilight in degrees
+HORIZON = 0.0
+TWILIGHT = -12.0
+
+# grid starts this many seconds before its computation, so that past events and altitudes are covered
+PAST = 1.5 * 86400.0
+
+# grid gets recomputed after this many seconds
+REFRESH = 86400.0
+
+
+def compute_sun_altitude(location: Tuple[float, float, float], times: np.ndarray) -> np.ndarray:
+    """Computes solar altitudes for many times at once, without refraction.
+
+    Args:
+        location: Longitude, latitude and elevation of observer.
+        times: UNIX timestamps.
+
+    Returns:
+        Solar altitudes in degrees.
+    """
+    t = Time(times, format="unix")
+    loc = EarthLocation(lon=location[0] * u.deg, lat=location[1] * u.deg, height=location[2] * u.m)
+    return np.asarray(get_sun(t).transform_to(AltAz(location=loc, obstime=t)).alt.degree)
+
+
+def _after(events: np.ndarray, time: float, until: Optional[float] = None) -> Optional[float]:
+    """Returns first of the sorted events after the given time and before the optional limit, or None."""
+    idx = np.searchsorted(events, time)
+    if idx >= len(events) or (until is not None and events[idx] > until):
+        return None
+    return float(events[idx])
+
+
+def _before(events: np.ndarray, time: float) -> Optional[float]:
+    """Returns last of the sorted events before the given time, or None."""
+    idx = np.searchsorted(events, time) - 1
+    return None if idx < 0 else float(events[idx])
+
+
+class Ephemeris:
+    """Solar altitudes on a regular time grid for a given location, together with all sunsets, sunrises and twilights
+    within that grid."""
+
+    def __init__(self, location: Tuple[float, float, float], start: float, step: float, alt: np.ndarray):
+        """Creates a new ephemeris.
+
+        Args:
+            location: Longitude, latitude and elevation of observer.
+            start: UNIX timestamp of first grid point.
+            step: Distance between grid points in seconds.
+            alt: Solar altitudes in degrees for all grid points.
+        """
+        self.location = location
+        self.start = start
+        self.step = step
+        self.alt = alt
+        self.times = start + step * np.arange(len(alt))
+
+        # find events
+        self.sunsets, self.sunrises = self._crossings(HORIZON)
+        self.dusks, self.dawns = self._crossings(TWILIGHT)
+
+    @staticmethod
+    def compute(location: Tuple[float, float, float], start: float, days: float, step: float) -> "Ephemeris":
+        """Computes solar altitudes for a location.
+
+        Args:
+            location: Longitude, latitude and elevation of observer.
+            start: UNIX timestamp to start at.
+            days: Number of days to compute.
+            step: Distance between grid points in seconds.
+
+        Returns:
+            New ephemeris.
+        """
+        alt = compute_sun_altitude(location, start + step * np.arange(int(days * 86400.0 / step) + 1))
+        return Ephemeris(location, start, step, alt)
+
+    def _crossings(self, horizon: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Finds times at which the sun crosses the given horizon.
+
+        Args:
+            horizon: Altitude in degrees.
+
+        Returns:
+            Times of setting and rising as UNIX timestamps, linearly interpolated between grid points.
+        """
+        a, b = self.alt[:-1], self.alt[1:]
+        setting = np.where((a >= horizon) & (b < horizon))[0]
+        rising = np.where((a < horizon) & (b >= horizon))[0]
+
+        def interp(idx):
+            return self.times[idx] + self.step * (a[idx] - horizon) / (a[idx] - b[idx])
+
+        return interp(setting), interp(rising)
+
+    def covers(self, start: float, end: float) -> bool:
+        """Whether the grid covers the given time range."""
+        return self.times[0] <= start and end <= self.times[-1]
+
+    def sun_altitude(self, times: np.ndarray) -> np.ndarray:
+        """Interpolates solar altitude.
+
+        Args:
+            times: UNIX timestamps.
+
+        Returns:
+            Solar altitudes in degrees.
+        """
+        return np.interp(times, self.times, self.alt)
+
+    def night(self, now: float) -> Dict[str, Optional[float]]:
+        """Returns events for the current night, or the next one during the day.
+
+        Events that don't happen within the grid are None, e.g. all of them during polar day or night, and dusk and
+        dawn during summer nights at high latitudes, when the sun never reaches the twilight horizon.
+
+        Args:
+            now: UNIX timestamp.
+
+        Returns:
+            Dict with sunset, dusk, dawn and sunrise as UNIX timestamps or None.
+        """
+
+        # during the day we want the next sunset, otherwise the previous one
+        if self.sun_altitude(now) > HORIZON:
+            sunset = _after(self.sunsets, now)
+        else:
+            sunset = _before(self.sunsets, now)
+        if sunset is None:
+            return {"sunset": None, "dusk": None, "dawn": None, "sunrise": None}
+
+        # sunrise after sunset, and twilights in between
+        sunrise = _after(self.sunrises, sunset)
+        dusk = _after(self.dusks, sunset, sunrise)
+        dawn = None if dusk is None else _after(self.dawns, dusk, sunrise)
+        return {"sunset": sunset, "dusk": dusk, "dawn": dawn, "sunrise": sunrise}
+
+    def save(self, filename: str) -> None:
+        """Save ephemeris to file, replacing it atomically, since other processes might be reading it."""
+        tmp = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmp, "wb") as f:
+            np.savez(f, location=self.location, start=self.start, step=self.step, alt=self.alt)
+        os.replace(tmp, filename)
+
+    @staticmethod
+    def load(filename: str) -> "Ephemeris":
+        """Load ephemeris from file."""
+        with open(filename, "rb") as f, np.load(f) as data:
+            return Ephemeris(tuple(data["location"]), float(data["start"]), float(data["step"]), data["alt"])
+
+
+_ephemeris: Optional[Ephemeris] = None
+_lock = threading.Lock()
+
+
+def _location() -> Tuple[float, float, float]:
+    """Returns location of observer from settings."""
+    loc = settings.OBSERVER_LOCATION
+    return loc["longitude"], loc["latitude"], loc["elevation"]
+
+
+def _valid(eph: Optional[Ephemeris], now: float) -> bool:
+    """Whether ephemeris is for the current location and recent enough."""
+    return (
+        eph is not None
+        and tuple(eph.location) == _location()
+        and eph.covers(now - 86400.0, now)
+        and now - eph.start - PAST < REFRESH
+    )
+
+
+def get_ephemeris(now: Optional[float] = None) -> Ephemeris:
+    """Returns ephemeris for the observer, and loads or computes it, if necessary.
+
+    The ephemeris is kept in memory and in EPHEMERIS_FILE, and recomputed once a day.
+
+    Args:
+        now: UNIX timestamp to get ephemeris for, defaults to current time.
+
+    Returns:
+        Ephemeris covering at least the last day and the next night.
+    """
+    global _ephemeris
+    if now is None:
+        now = time.time()
+
+    with _lock:
+        # still valid?
+        if _valid(_ephemeris, now):
+            return _ephemeris
+
+        # try to load it from file
+        if EPHEMERIS_FILE and os.path.exists(EPHEMERIS_FILE):
+            try:
+                eph = Ephemeris.load(EPHEMERIS_FILE)
+                if _valid(eph, now):
+                    _ephemeris = eph
+                    return _ephemeris
+            except Exception:
+                log.warning("Could not load ephemeris from %s.", EPHEMERIS_FILE)
+
+        # compute it
+        log.info("Computing solar ephemeris for the next %d days...", EPHEMERIS_DAYS)
+        _ephemeris = Ephemeris.compute(_location(), now - PAST, PAST / 86400.0 + EPHEMERIS_DAYS, EPHEMERIS_STEP)
+
+        # and store it
+        if EPHEMERIS_FILE:
+            try:
+                _ephemeris.save(EPHEMERIS_FILE)
+            except OSError:
+                log.warning("Could not write ephemeris to %s.", EPHEMERIS_FILE)
+        return _ephemeris
+
+
+def sun_altitude(times) -> np.ndarray:
+    """Returns solar altitude for the observer, without refraction.
+
+    Args:
+        times: UNIX timestamp(s).
+
+    Returns:
+        Solar altitude(s) in degrees.
+    """
+    times = np.asarray(times, dtype=float)
+    eph = get_ephemeris(float(np.max(times)))
+
+    # outside of grid?
+    if not eph.covers(float(np.min(times)), float(np.max(times))):
+        return compute_sun_altitude(_location(), times)
+    return eph.sun_altitude(times)
+
+
+def night_events(now: Optional[float] = None) -> Dict[str, Optional[float]]:
+    """Returns sunset, dusk, dawn and sunrise for the current night, or the next one during the day.
+
+    Args:
+        now: UNIX timestamp, defaults to current time.
+
+    Returns:
+        Dict with sunset, dusk, dawn and sunrise as UNIX timestamps, None for events that don't happen.
+    """
+    if now is None:
+        now = time.time()
+    return get_ephemeris(now).night(now)
+
+
+__all__ = ["Ephemeris", "compute_sun_altitude", "get_ephemeris", "sun_altitude", "night_events"]
@@ -0,0 +1,199 @@
+import importlib
+import inspect
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from django.db.models import QuerySet
+
+from pyobs_weather.settings import INFLUXDB_MEASUREMENT_AVERAGE
+from pyobs_weather.weather.events import publish
+from pyobs_weather.weather.evaluators.base import good_to_float, raw_values, value_to_float
+from pyobs_weather.weather.influx import read_latest_values
+from pyobs_weather.weather.metrics import EVALUATE_SENSORS
+from pyobs_weather.weather.models import Evaluator, GoodWeather, Sensor
+
+log = logging.getLogger(__name__)
+
+_evaluator_cache: dict[tuple[str, str], Any] = {}
+
+
+def create_evaluator(evaluator):
+    key = (evaluator.class_name, evaluator.kwargs or "")
+    if key not in _evaluator_cache:
+        module = evaluator.class_name[: evaluator.class_name.rfind(".")]
+        class_name = evaluator.class_name[evaluator.class_name.rfind(".") + 1 :]
+        kls = getattr(importlib.import_module(module), class_name)
+        kwargs = {} if evaluator.kwargs is None else json.loads(evaluator.kwargs)
+        _evaluator_cache[key] = kls(**kwargs)
+    return _evaluator_cache[key]
+
+
+def _takes_value(eva) -> bool:
+    """Whether a scalar evaluator gets the latest value as second argument. Evaluators written before values were
+    fetched in bulk only get the sensor and read its value themselves."""
+    try:
+        params = inspect.signature(eva).parameters.values()
+    except (TypeError, ValueError):
+        return True
+    if any(p.kind == inspect.Parameter.VAR_POSITIONAL for p in params):
+        return True
+    positional = [p for p in params if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+    return len(positional) >= 2
+
+
+def _evaluate(eva, sensors: List[Sensor], latest: Dict[Sensor, Optional[dict]], values: np.ndarray, good: np.ndarray):
+    """Evaluates an evaluator for some sensors, at once if it supports it, otherwise one by one.
+
+    Args:
+        eva: Evaluator to use.
+        sensors: Sensors to evaluate.
+        latest: Latest values by sensor.
+        values: Latest values of sensors as floats.
+        good: Current status of sensors.
+
+    Returns:
+        Boolean array with results of evaluation.
+    """
+    if hasattr(eva, "evaluate"):
+        if not getattr(eva, "numeric", True):
+            values = raw_values([latest[sensor] for sensor in sensors])
+        return eva.evaluate(values, good)
+    if _takes_value(eva):
+        return np.array([eva(sensor, latest[sensor]) for sensor in sensors], dtype=bool)
+    return np.array([eva(sensor) for sensor in sensors], dtype=bool)
+
+
+def _timestamps(times: List[Optional[datetime]]) -> np.ndarray:
+    """Converts list of datetimes to array of UNIX timestamps, NaN for None."""
+    return np.array([np.nan if t is None else t.timestamp() for t in times], dtype=float)
+
+
+def evaluate_sensors(sensors: Optional[QuerySet] = None, now: Optional[datetime] = None) -> bool:
+    """Evaluates many sensors at once and stores those whose status changed.
+
+    All latest values are fetched with a single query, and each evaluator is applied to all of its sensors at once.
+
+    Args:
+        sensors: Sensors to evaluate, defaults to all sensors except for those of the average station.
+        now: Time of evaluation, defaults to current time.
+
+    Returns:
+        Whether none of the evaluated sensors is bad.
+    """
+
+    # get sensors and time
+    if sensors is None:
+        sensors = Sensor.objects.exclude(station__code=INFLUXDB_MEASUREMENT_AVERAGE)
+    sensors = list(sensors.select_related("station", "type").prefetch_related("evaluators"))
+    if now is None:
+        now = datetime.now(timezone.utc)
+    EVALUATE_SENSORS.set(len(sensors))
+    if len(sensors) == 0:
+        return True
+
+    # fetch latest values and current status
+    latest = read_latest_values(sensors)
+    values = np.array([value_to_float(latest[sensor]) for sensor in sensors])
+    old = np.array([good_to_float(sensor.good) for sensor in sensors])
+
+    # group sensors by evaluator
+    groups: Dict[int, Tuple[Evaluator, List[int]]] = {}
+    for i, sensor in enumerate(sensors):
+        for evaluator in sensor.evaluators.all():
+            groups.setdefault(evaluator.id, (evaluator, []))[1].append(i)
+
+    # evaluate all evaluators, each for all of its sensors at once, a failing one doesn't stop the others
+    result = np.ones(len(sensors), dtype=bool)
+    evaluated = np.zeros(len(sensors), dtype=bool)
+    failed = np.zeros(len(sensors), dtype=bool)
+    for evaluator, idx in groups.values():
+        try:
+            eva = create_evaluator(evaluator)
+            res = _evaluate(eva, [sensors[i] for i in idx], latest, values[idx], old[idx])
+        except Exception:
+            log.exception("Evaluator %s failed, keeping current status of its sensors.", evaluator.name)
+            failed[idx] = True
+            continue
+        result[idx] &= res
+        evaluated[idx] = True
+
+    # new status, NaN for sensors without evaluators
+    is_good = np.where(evaluated, result.astype(float), np.nan)
+
+    # if status changed, set good/bad since, otherwise reset both
+    ts = now.timestamp()
+    good_since = _timestamps([sensor.good_since for sensor in sensors])
+    bad_since = _timestamps([sensor.bad_since for sensor in sensors])
+    changed = ~np.isnan(is_good) & (is_good != old)
+    set_good_since = changed & (is_good == 1)
+    set_bad_since = changed & (is_good == 0)
+    good_since = np.where(set_good_since, np.where(np.isnan(good_since), ts, good_since), np.nan)
+    bad_since = np.where(set_bad_since, np.where(np.isnan(bad_since), ts, bad_since), np.nan)
+
+    # if there's a delay, we may want to switch back
+    delay_good = np.array([sensor.delay_good for sensor in sensors], dtype=float)
+    delay_bad = np.array([sensor.delay_bad for sensor in sensors], dtype=float)
+    is_good = np.where((old == 1) & (ts - bad_since < delay_bad), 1.0, is_good)
+    is_good = np.where((old != 1) & (ts - good_since < delay_good), 0.0, is_good)
+
+    # sensors with a failed evaluator keep their status
+    is_good = np.where(failed, old, is_good)
+
+    # did status still change?
+    set_since = ~np.isnan(is_good) & (is_good != old)
+
+    # update sensors and collect those that changed
+    updated = []
+    transitions = []
+    for i, sensor in enumerate(sensors):
+        if failed[i]:
+            continue
+        before = (sensor.good, sensor.since, sensor.good_since, sensor.bad_since)
+        sensor.good = None if np.isnan(is_good[i]) else bool(is_good[i])
+        sensor.good_since = (sensor.good_since or now) if set_good_since[i] else None
+        sensor.bad_since = (sensor.bad_since or now) if set_bad_since[i] else None
+        if set_since[i]:
+            sensor.since = now
+        if (sensor.good, sensor.since, sensor.good_since, sensor.bad_since) != before:
+            updated.append(sensor)
+        if sensor.good != before[0]:
+            transitions.append(
+                {"station": sensor.station.code, "type": sensor.type.code, "good": sensor.good, "since": sensor.since}
+            )
+
+    # store changed sensors only
+    if len(updated) > 0:
+        Sensor.objects.bulk_update(updated, ["good", "since", "good_since", "bad_since"])
+
+    # tell clients about changed status
+    if len(transitions) > 0:
+        publish("sensors", transitions)
+
+    # found one that's not good?
+    return not bool(np.any(is_good == 0))
+
+
+def sensors_good() -> bool:
+    """Returns whether none of the evaluated sensors is currently bad, e.g. after evaluating only some of them."""
+    return not Sensor.objects.exclude(station__code=INFLUXDB_MEASUREMENT_AVERAGE).filter(good=False).exists()
+
+
+def update_good_weather(good: bool) -> None:
+    """Stores new GoodWeather status, if it changed.
+
+    Args:
+        good: Whether weather is good.
+    """
+
+    # get current GoodWeather status
+    current_good = GoodWeather.objects.order_by("-time").first()
+    if current_good is None or current_good.good != good:
+        # status has changed, store it and tell clients
+        gw = GoodWeather.objects.create(good=good)
+        publish("goodweather", {"time": gw.time, "good": gw.good})
+
+
+__all__ = ["create_evaluator", "evaluate_sensors", "sensors_good", "update_good_weather"]
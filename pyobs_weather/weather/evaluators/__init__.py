@@ -1,3 +1,4 @@
+from .base import VectorEvaluator
 from .boolean import Boolean
 from .schmitt import SchmittTrigger
 from .switch import Switch
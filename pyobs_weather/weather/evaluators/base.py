@@ -0,0 +1,82 @@
+from typing import List, Optional
+
+import numpy as np
+
+
+def value_to_float(value: Optional[dict]) -> float:
+    """Converts a latest value as returned by read_latest_values() to a float, NaN if missing or not numeric.
+
+    Args:
+        value: Latest value as dict with time and value, or None.
+
+    Returns:
+        Value as float.
+    """
+    if value is None or value["value"] is None:
+        return np.nan
+    try:
+        return float(value["value"])
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def raw_values(values: List[Optional[dict]]) -> np.ndarray:
+    """Converts latest values as returned by read_latest_values() to an object array of their raw values.
+
+    Args:
+        values: Latest values as dicts with time and value, or None.
+
+    Returns:
+        Array with raw values, None for missing ones.
+    """
+    raw = np.empty(len(values), dtype=object)
+    raw[:] = [None if value is None else value["value"] for value in values]
+    return raw
+
+
+def good_to_float(good: Optional[bool]) -> float:
+    """Converts a Sensor.good status to a float, i.e. 1 for good, 0 for bad and NaN for unknown.
+
+    Args:
+        good: Status to convert.
+
+    Returns:
+        Status as float.
+    """
+    return np.nan if good is None else float(good)
+
+
+class VectorEvaluator:
+    """Base class for evaluators that can evaluate the values of many sensors at once."""
+
+    # whether evaluate() gets values as floats, otherwise as object array of raw values, see raw_values()
+    numeric = True
+
+    def evaluate(self, values: np.ndarray, good: np.ndarray) -> np.ndarray:
+        """Evaluates this evaluator for many sensors.
+
+        Args:
+            values: Latest values of sensors, NaN for missing ones.
+            good: Current status of sensors, 1 for good, 0 for bad, and NaN for unknown.
+
+        Returns:
+            Boolean array with results of evaluation.
+        """
+        raise NotImplementedError
+
+    def __call__(self, sensor, value):
+        """Evaluates this evaluator.
+
+        Args:
+            sensor: Sensor to evaluate.
+            value: Latest value of sensor as dict with time and value, or None.
+
+        Returns:
+            Result of evaluation.
+        """
+        values = np.array([value_to_float(value)]) if self.numeric else raw_values([value])
+        res = self.evaluate(values, np.array([good_to_float(sensor.good)]))
+        return bool(res[0])
+
+
+__all__ = ["VectorEvaluator", "value_to_float", "raw_values", "good_to_float"]
@@ -1,7 +1,9 @@
-from pyobs_weather.weather.influx import read_sensor_value
+import numpy as np
 
+from .base import VectorEvaluator
 
-class SchmittTrigger:
+
+class SchmittTrigger(VectorEvaluator):
     """A Schmitt trigger only changes its value when certain thresholds are reached."""
 
     def __init__(self, good: float, bad: float):
@@ -17,34 +19,23 @@ class SchmittTrigger:
         self._good = good
         self._bad = bad
 
-    def __call__(self, sensor):
-        """Evaluates this evaluator.
+    def evaluate(self, values: np.ndarray, good: np.ndarray) -> np.ndarray:
+        """Evaluates this evaluator for many sensors.
 
         Args:
-            sensor: Sensor to evaluate.
+            values: Latest values of sensors, NaN for missing ones.
+            good: Current status of sensors, 1 for good, 0 for bad, and NaN for unknown.
 
         Returns:
-            Result of evaluation.
+            Boolean array with results of evaluation.
         """
 
-        # get last value
-        # value = Value.objects.filter(sensor=sensor).order_by('-time').first()
-        value = read_sensor_value(sensor)
+        # if current value of sensor is good, we must be below bad to stay good,
+        # if current value of sensor is not good, we must be below good to become good
+        is_good = np.where(good != 0, values < self._bad, values < self._good)
 
         # non-existing values are always good
-        if value is None or value["value"] is None:
-            return True
-
-        # are we good?
-        if sensor.good is True or sensor.good is None:
-            # if current value of sensor is good, we must be below bad to stay good
-            is_good = value["value"] < self._bad
-        else:
-            # if current value of sensor is not good, we must be below good to become good
-            is_good = value["value"] < self._good
-
-        # return it
-        return is_good
+        return np.where(np.isnan(values), True, is_good)
 
     def areas(self) -> list:
         """Returns list of areas for plot."""
@@ -1,7 +1,9 @@
-from pyobs_weather.weather.influx import read_sensor_value
+import numpy as np
 
+from .base import VectorEvaluator
 
-class Switch:
+
+class Switch(VectorEvaluator):
     """A simple Switch that changes its value whenever a given threshold is reached."""
 
     def __init__(self, threshold: float, invert: bool = False):
@@ -16,32 +18,26 @@ class Switch:
         self._threshold = threshold
         self._invert = invert
 
-    def __call__(self, sensor):
-        """Evaluates this evaluator.
+    def evaluate(self, values: np.ndarray, good: np.ndarray) -> np.ndarray:
+        """Evaluates this evaluator for many sensors.
 
         Args:
-            sensor: Sensor to evaluate.
+            values: Latest values of sensors, NaN for missing ones.
+            good: Current status of sensors, 1 for good, 0 for bad, and NaN for unknown.
 
         Returns:
-            Result of evaluation.
+            Boolean array with results of evaluation.
         """
 
-        # get last value
-        value = read_sensor_value(sensor)
-
-        # non-existing values are always good
-        if value is None or value["value"] is None:
-            return True
-
         # are we good?
-        is_good = value["value"] < self._threshold
+        is_good = values < self._threshold
 
         # invert?
         if self._invert:
-            is_good = not is_good
+            is_good = ~is_good
 
-        # return it
-        return is_good
+        # non-existing values are always good
+        return np.where(np.isnan(values), True, is_good)
 
     def areas(self) -> list:
         """Returns list of areas for plot."""
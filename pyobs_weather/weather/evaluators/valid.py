@@ -1,28 +1,29 @@
-from pyobs_weather.weather.influx import read_sensor_value
+import numpy as np
 
+from .base import VectorEvaluator
 
-class Valid:
+
+class Valid(VectorEvaluator):
     """A Valid evaluator checks, whether the sensor's value is valid, i.e. not None."""
 
+    # any value is valid, not only numbers
+    numeric = False
+
     def __init__(self):
         """Creates a new Valid evaluator."""
         pass
 
-    def __call__(self, sensor):
-        """Evaluates this evaluator.
+    def evaluate(self, values: np.ndarray, good: np.ndarray) -> np.ndarray:
+        """Evaluates this evaluator for many sensors.
 
         Args:
-            sensor: Sensor to evaluate.
+            values: Raw latest values of sensors, None for missing ones. NaN is treated as missing as well, so that
+                float values work, too.
+            good: Current status of sensors, 1 for good, 0 for bad, and NaN for unknown.
 
         Returns:
-            Result of evaluation.
+            Boolean array with results of evaluation.
         """
 
-        # get last value
-        value = read_sensor_value(sensor)
-
         # are we good?
-        is_good = value is not None and value["value"] is not None
-
-        # return it
-        return is_good
+        return np.array([v is not None and not (isinstance(v, float) and np.isnan(v)) for v in values], dtype=bool)
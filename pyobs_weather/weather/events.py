@@ -0,0 +1,114 @@
+import json
+import logging
+from typing import Any, List, Tuple
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F
+
+from pyobs_weather.settings import EVENTS_BUFFER
+from pyobs_weather.weather.models import EventSequence
+from pyobs_weather.weather.utils import has_atomic_incr
+
+log = logging.getLogger(__name__)
+
+# an event as (id, name, JSON data)
+Event = Tuple[int, str, str]
+
+SEQ_KEY = "events:seq"
+
+
+def _slot(event_id: int) -> str:
+    """Cache key of slot in ring buffer for given event ID."""
+    return "events:%d" % (event_id % EVENTS_BUFFER)
+
+
+def publish(name: str, data: Any) -> int:
+    """Publishes an event to all connected clients.
+
+    Events are kept in a ring buffer of EVENTS_BUFFER slots in the cache, so that all web processes see them. Their
+    IDs are counted by the cache, if it increments atomically, otherwise by a row in the database, so that concurrent
+    publishers never get the same ID and overwrite each other's slot.
+
+    Args:
+        name: Name of event.
+        data: Data for event, must be serializable to JSON.
+
+    Returns:
+        ID of new event.
+    """
+    event_id = _next_id()
+    cache.set(_slot(event_id), (event_id, name, json.dumps(data, cls=DjangoJSONEncoder)), timeout=None)
+    return event_id
+
+
+def _next_id() -> int:
+    """Returns ID for a new event."""
+    if has_atomic_incr():
+        cache.add(SEQ_KEY, 0, timeout=None)
+        return cache.incr(SEQ_KEY)
+
+    # the row stays locked until the transaction ends, so nobody else gets the same value
+    with transaction.atomic():
+        EventSequence.objects.get_or_create(id=1)
+        EventSequence.objects.filter(id=1).update(seq=F("seq") + 1)
+        return EventSequence.objects.values_list("seq", flat=True).get(id=1)
+
+
+def last_event_id() -> int:
+    """Returns ID of latest published event."""
+    if has_atomic_incr():
+        return cache.get(SEQ_KEY) or 0
+    return EventSequence.objects.filter(id=1).values_list("seq", flat=True).first() or 0
+
+
+def get_events(after: int) -> List[Event]:
+    """Returns all events published after the given one.
+
+    If the requested events are not available anymore, a single "reset" event is returned instead, after which a
+    client should fetch the full state again.
+
+    Args:
+        after: ID of last event seen by client.
+
+    Returns:
+        List of events.
+    """
+
+    # nothing new?
+    last = last_event_id()
+    if after == last:
+        return []
+
+    # too far behind, or sequence has been reset?
+    if after > last or after < last - EVENTS_BUFFER:
+        return [(last, "reset", "{}")]
+
+    # fetch slots
+    ids = range(after + 1, last + 1)
+    slots = cache.get_many([_slot(i) for i in ids])
+
+    # collect events
+    events = []
+    for i in ids:
+        event = slots.get(_slot(i))
+        if event is None or event[0] < i:
+            # not written yet, try again later
+            break
+        if event[0] > i:
+            # overwritten in the meantime
+            return [(last, "reset", "{}")]
+        events.append(event)
+    return events
+
+
+def publish_values(sender, station, rows, **kwargs):
+    """Receiver for sensors_updated, publishes the latest values of a station."""
+    if len(rows) == 0:
+        return
+    time, values = max(rows, key=lambda row: row[0])
+    publish("values", {"station": station.code, "time": time, "values": dict(values)})
+
+
+__all__ = ["publish", "publish_values", "get_events", "last_event_id"]
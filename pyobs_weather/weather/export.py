@@ -0,0 +1,263 @@
+import csv
+import io
+import itertools
+import json
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+from typing import IO, Iterator, List, Optional, Tuple
+
+from pyobs_weather.settings import USE_INFLUX
+from pyobs_weather.weather.influx import stream_pivoted_values
+from pyobs_weather.weather.models import SensorType, Value
+
+log = logging.getLogger(__name__)
+
+# a row as time, station code and one value per sensor type
+Row = Tuple[datetime, str, List[Optional[float]]]
+
+# number of rows per batch when writing columnar formats
+BATCH_SIZE = 10000
+
+# columnar formats need pyarrow from the arrow extra
+ARROW_MISSING = "Arrow and Parquet require pyarrow, please install pyobs-weather[arrow]."
+
+
+def export_types(stations: List[str]) -> List[str]:
+    """Returns codes of all sensor types that exist for at least one of the given stations.
+
+    Args:
+        stations: Codes of stations.
+
+    Returns:
+        List of sensor type codes.
+    """
+    qs = SensorType.objects.filter(sensor__station__code__in=stations).distinct().order_by("id")
+    return list(qs.values_list("code", flat=True))
+
+
+def _influx_rows(
+    stations: List[str], types: List[str], start: datetime, end: datetime, every: Optional[str], chunk: timedelta
+) -> Iterator[Row]:
+    """Stream rows from Influx, one query per chunk of time."""
+    t = start
+    while t < end:
+        stop = min(t + chunk, end)
+        for time, station, values in stream_pivoted_values(stations, types, t, stop, every=every):
+            yield time, station, [values[c] for c in types]
+        t = stop
+
+
+def _sql_rows(stations: List[str], types: List[str], start: datetime, end: datetime) -> Iterator[Row]:
+    """Stream rows from Value table, pivoted while iterating over a server-side cursor."""
+    index = {code: i for i, code in enumerate(types)}
+    qs = (
+        Value.objects.filter(sensor__station__code__in=stations, sensor__type__code__in=types)
+        .filter(time__gte=start, time__lt=end)
+        .order_by("time", "sensor__station__code")
+        .values_list("time", "sensor__station__code", "sensor__type__code", "value")
+    )
+    for (time, station), group in itertools.groupby(qs.iterator(chunk_size=BATCH_SIZE), key=lambda v: v[:2]):
+        values: List[Optional[float]] = [None] * len(types)
+        for _, _, code, value in group:
+            values[index[code]] = value
+        yield time, station, values
+
+
+def export_rows(
+    stations: List[str],
+    types: List[str],
+    start: datetime,
+    end: datetime,
+    every: Optional[str] = None,
+    chunk: timedelta = timedelta(days=1),
+    influx: Optional[bool] = None,
+) -> Iterator[Row]:
+    """Streams values of stations from the configured backend, pivoted to one row per station and time.
+
+    Args:
+        stations: Codes of stations.
+        types: Codes of sensor types, i.e. the value columns.
+        start: Start of time range.
+        end: End of time range.
+        every: Aggregate means in windows of this Flux duration, e.g. "5m". Only supported with Influx.
+        chunk: Length of time range fetched with each query.
+        influx: Whether to read from Influx or from the database, defaults to USE_INFLUX.
+
+    Yields:
+        Tuples of time, station code and list of values in the order of types, sorted by time and station.
+    """
+    if every is not None and not re.match(r"^\d+(ms|s|m|h|d|w)$", every):
+        raise ValueError("Invalid aggregation window: %s" % every)
+    if USE_INFLUX if influx is None else influx:
+        return _influx_rows(stations, types, start, end, every, chunk)
+    if every is not None:
+        raise ValueError("Aggregation is only supported with InfluxDB.")
+    return _sql_rows(stations, types, start, end)
+
+
+def format_time(time: datetime) -> str:
+    """Formats a time as ISO 8601 in UTC."""
+    if time.tzinfo is not None:
+        time = time.astimezone(timezone.utc)
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def csv_lines(types: List[str], rows: Iterator[Row]) -> Iterator[str]:
+    """Formats rows as CSV lines, starting with a header.
+
+    Args:
+        types: Codes of sensor types.
+        rows: Rows to format.
+
+    Yields:
+        Lines of CSV, including line breaks.
+    """
+
+    class Line:
+        def write(self, line):
+            return line
+
+    writer = csv.writer(Line())
+    yield writer.writerow(["time", "station"] + types)
+    for time, station, values in rows:
+        yield writer.writerow([format_time(time), station] + ["" if v is None else v for v in values])
+
+
+def ndjson_lines(types: List[str], rows: Iterator[Row]) -> Iterator[str]:
+    """Formats rows as newline-delimited JSON, one object per row.
+
+    Args:
+        types: Codes of sensor types.
+        rows: Rows to format.
+
+    Yields:
+        Lines of JSON, including line breaks.
+    """
+    for time, station, values in rows:
+        data = {"time": format_time(time), "station": station}
+        data.update(zip(types, values))
+        yield json.dumps(data) + "\n"
+
+
+def write_csv(f: IO[str], types: List[str], rows: Iterator[Row]) -> int:
+    """Writes rows as CSV.
+
+    Args:
+        f: Text file to write to.
+        types: Codes of sensor types.
+        rows: Rows to write.
+
+    Returns:
+        Number of written rows.
+    """
+    count = -1
+    for count, line in enumerate(csv_lines(types, rows)):
+        f.write(line)
+    return count
+
+
+def _to_float(value) -> Optional[float]:
+    """Converts a value to float for columnar formats, None if not numeric."""
+    try:
+        return None if value is None else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def has_arrow() -> bool:
+    """Whether pyarrow can be imported, which is needed for Arrow and Parquet."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def arrow_batches(types: List[str], rows: Iterator[Row]):
+    """Converts rows to Arrow record batches of at most BATCH_SIZE rows.
+
+    Args:
+        types: Codes of sensor types.
+        rows: Rows to convert.
+
+    Yields:
+        Schema first, then record batches.
+    """
+    import pyarrow as pa
+
+    # schema
+    schema = pa.schema(
+        [pa.field("time", pa.timestamp("ms", tz="UTC")), pa.field("station", pa.string())]
+        + [pa.field(t, pa.float64()) for t in types]
+    )
+    yield schema
+
+    # batches
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if len(batch) == 0:
+            break
+        columns = [[r[0] for r in batch], [r[1] for r in batch]]
+        columns += [[_to_float(r[2][i]) for r in batch] for i in range(len(types))]
+        yield pa.RecordBatch.from_arrays([pa.array(c, type=f.type) for c, f in zip(columns, schema)], schema=schema)
+
+
+def arrow_stream(types: List[str], rows: Iterator[Row]) -> Iterator[bytes]:
+    """Formats rows as an Arrow IPC stream.
+
+    Args:
+        types: Codes of sensor types.
+        rows: Rows to format.
+
+    Yields:
+        Chunks of the stream, one per record batch.
+    """
+    import pyarrow as pa
+
+    batches = arrow_batches(types, rows)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, next(batches)) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+
+def write_parquet(filename: str, types: List[str], rows: Iterator[Row]) -> int:
+    """Writes rows as Parquet, one row group per batch.
+
+    Args:
+        filename: Name of file to write to.
+        types: Codes of sensor types.
+        rows: Rows to write.
+
+    Returns:
+        Number of written rows.
+    """
+    import pyarrow.parquet as pq
+
+    batches = arrow_batches(types, rows)
+    count = 0
+    with pq.ParquetWriter(filename, next(batches)) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            count += batch.num_rows
+    return count
+
+
+__all__ = [
+    "export_types",
+    "export_rows",
+    "format_time",
+    "csv_lines",
+    "ndjson_lines",
+    "arrow_stream",
+    "write_csv",
+    "ARROW_MISSING",
+    "has_arrow",
+    "arrow_batches",
+    "write_parquet",
+]
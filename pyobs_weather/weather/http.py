@@ -0,0 +1,125 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pyobs_weather.settings import STATION_HTTP_TIMEOUT, STATION_HTTP_POOL_SIZE
+from pyobs_weather.weather.metrics import STATION_FETCH_SECONDS, STATION_FETCHES
+
+log = logging.getLogger(__name__)
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_lock = threading.Lock()
+
+# ETag and Last-Modified headers of last processed response for each station and URL
+_validators: Dict[Tuple[str, str], Tuple[Optional[str], Optional[str]]] = {}
+
+# the same for responses that have been fetched, but not yet processed by their station
+_pending: Dict[Tuple[str, str], Tuple[Optional[str], Optional[str]]] = {}
+
+# fetch statistics for each station
+_stats: Dict[str, Dict[str, float]] = {}
+
+
+def get_session() -> requests.Session:
+    """Returns the HTTP session of this process, which keeps connections to each host open between requests."""
+    global _session, _session_pid
+    with _lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=STATION_HTTP_POOL_SIZE, pool_maxsize=STATION_HTTP_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session, _session_pid = session, os.getpid()
+        return _session
+
+
+def _record(station: str, key: str, duration: Optional[float] = None) -> None:
+    """Update fetch statistics for station."""
+    stats = _stats.setdefault(
+        station, {"requests": 0, "not_modified": 0, "errors": 0, "seconds": 0.0, "last_seconds": 0.0}
+    )
+    stats[key] += 1
+    STATION_FETCHES.labels(station=station, result=key).inc()
+    if duration is not None:
+        stats["seconds"] += duration
+        stats["last_seconds"] = duration
+        STATION_FETCH_SECONDS.labels(station=station).observe(duration)
+
+
+def fetch(
+    url: str, station: str = "", method: str = "GET", conditional: bool = True, **kwargs
+) -> Optional[requests.Response]:
+    """Fetches a URL using the pooled session.
+
+    For GET requests, the ETag and Last-Modified headers of the last response are sent back, so that the server can
+    tell us that nothing has changed. They are only used after commit_validators() has been called for the station,
+    so that a response that could not be processed is fetched again.
+
+    Args:
+        url: URL to fetch.
+        station: Code of station, used for statistics.
+        method: HTTP method.
+        conditional: Whether to send a conditional GET request.
+        **kwargs: Passed to requests.
+
+    Returns:
+        Response or None, if content has not changed since last request.
+    """
+
+    # conditional request?
+    conditional = conditional and method.upper() == "GET" and "params" not in kwargs
+    headers = dict(kwargs.pop("headers", {}))
+    if conditional and (station, url) in _validators:
+        etag, modified = _validators[station, url]
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if modified is not None:
+            headers["If-Modified-Since"] = modified
+
+    # do request
+    start = time.monotonic()
+    try:
+        r = get_session().request(method, url, headers=headers, timeout=STATION_HTTP_TIMEOUT, **kwargs)
+    except requests.RequestException:
+        _record(station, "errors")
+        raise
+    _record(station, "requests", time.monotonic() - start)
+
+    # not modified?
+    if conditional and r.status_code == 304:
+        _record(station, "not_modified")
+        log.info("Content at %s has not changed.", url)
+        return None
+
+    # remember validators until response has been processed
+    if conditional and r.status_code == 200:
+        _pending[station, url] = (r.headers.get("ETag"), r.headers.get("Last-Modified"))
+    return r
+
+
+def commit_validators(station: str, success: bool = True) -> None:
+    """Called after a station processed all fetched responses, e.g. wrote their values.
+
+    Args:
+        station: Code of station.
+        success: If True, validators of fetched responses are sent with the next requests, otherwise they are
+            discarded, so that the content is fetched again.
+    """
+    for key in [key for key in list(_pending.keys()) if key[0] == station]:
+        validators = _pending.pop(key, None)
+        if success and validators is not None:
+            _validators[key] = validators
+
+
+def get_stats() -> Dict[str, Dict[str, float]]:
+    """Returns fetch statistics for each station."""
+    return {station: dict(stats) for station, stats in _stats.items()}
+
+
+__all__ = ["fetch", "commit_validators", "get_session", "get_stats"]
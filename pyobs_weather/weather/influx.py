@@ -1,5 +1,8 @@
 import atexit
-from typing import List, Tuple, Optional
+import contextlib
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional
+from celery.signals import worker_process_shutdown
+import numpy as np
 from influxdb_client import InfluxDBClient, Point
 from datetime import datetime
 from influxdb_client.client.write_api import SYNCHRONOUS, WriteApi
@@ -10,30 +13,91 @@ from pyobs_weather.settings import (
     INFLUXDB_TOKEN,
     INFLUXDB_BUCKET,
     INFLUXDB_BUCKET_5MIN,
+    INFLUXDB_WRITE_MODE,
+    INFLUXDB_BATCH_SIZE,
+    INFLUXDB_FLUSH_INTERVAL,
+    INFLUXDB_QUEUE_SIZE,
+    INFLUXDB_MAX_RETRIES,
+    INFLUXDB_RETRY_INTERVAL,
 )
+from pyobs_weather.weather.evaluators.base import value_to_float
 from pyobs_weather.weather.models import Station, Sensor
+from pyobs_weather.weather.latest import get_store
+from pyobs_weather.weather.metrics import INFLUX_POINTS, influx_operation
+from pyobs_weather.weather.writer import BatchingWriter
 
 _client: InfluxDBClient | None = None
-_write_api: WriteApi | None = None
+_write_api: WriteApi | BatchingWriter | None = None
 
 
 def get_client() -> InfluxDBClient:
     global _client, _write_api
     if _client is None:
         c = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-        _write_api = c.write_api(write_options=SYNCHRONOUS)
         atexit.register(c.close)
+        write_api = c.write_api(write_options=SYNCHRONOUS)
+        if INFLUXDB_WRITE_MODE == "batching":
+            # batches get written in background, flush them before client is closed
+            _write_api = BatchingWriter(
+                write_api,
+                batch_size=INFLUXDB_BATCH_SIZE,
+                flush_interval=INFLUXDB_FLUSH_INTERVAL,
+                queue_size=INFLUXDB_QUEUE_SIZE,
+                max_retries=INFLUXDB_MAX_RETRIES,
+                retry_interval=INFLUXDB_RETRY_INTERVAL,
+            )
+            atexit.register(_write_api.close)
+        else:
+            _write_api = write_api
         _client = c
     return _client  # type: ignore[return-value]
 
 
-def _get_write_api() -> WriteApi:
+@contextlib.contextmanager
+def use_client(client, write_api=None) -> Iterator[None]:
+    """Routes all queries and writes in this process to the given client, e.g. an in-memory stand-in.
+
+    Args:
+        client: Client to use instead of the configured one.
+        write_api: Write API to use, defaults to the one of the client.
+    """
+    global _client, _write_api
+    previous = _client, _write_api
+    _client, _write_api = client, client.write_api() if write_api is None else write_api
+    try:
+        yield
+    finally:
+        _client, _write_api = previous
+
+
+@worker_process_shutdown.connect
+def _close_write_api(**kwargs) -> None:
+    """Celery worker processes don't run atexit handlers, so flush pending writes here."""
+    if isinstance(_write_api, BatchingWriter):
+        _write_api.close()
+
+
+def get_write_stats() -> Dict[str, float]:
+    """Returns statistics of batching writer, or an empty dict, if writing synchronously."""
+    return _write_api.stats if isinstance(_write_api, BatchingWriter) else {}
+
+
+def _get_write_api() -> WriteApi | BatchingWriter:
     get_client()
     assert _write_api is not None
     return _write_api
 
 
+@influx_operation
 def read_sensor_value(sensor):
+    # got a fresh value in store?
+    store = get_store()
+    key = (sensor.station.code, sensor.type.code)
+    if store is not None:
+        cached = store.get_many([key])
+        if key in cached:
+            return cached[key]
+
     client = get_client()
     query = f"""
         from(bucket:"{INFLUXDB_BUCKET}")
@@ -44,10 +108,212 @@ def read_sensor_value(sensor):
         """
     result = client.query_api().query(org=INFLUXDB_ORG, query=query)
     value = result.to_values(columns=["_time", "_value"])
+    if len(value) == 0:
+        return None
+
+    # remember it
+    if store is not None:
+        store.set_many(sensor.station.code, value[0][0], [(sensor.type.code, value[0][1])])
+    return {"time": value[0][0], "value": value[0][1]}
+
+
+def _group_sensors(sensors: Iterable[Sensor]) -> Dict[str, Dict[str, List[Sensor]]]:
+    """Group sensors by station and field code."""
+    fields: Dict[str, Dict[str, List[Sensor]]] = {}
+    for sensor in sensors:
+        fields.setdefault(sensor.station.code, {}).setdefault(sensor.type.code, []).append(sensor)
+    return fields
+
+
+def _sensor_filter(fields: Dict[str, Dict[str, List[Sensor]]]) -> str:
+    """Build Flux predicate matching all given (station, field) pairs."""
+    return " or ".join(
+        f'(r._measurement == "{station}" and (' + " or ".join(f'r._field == "{f}"' for f in codes) + "))"
+        for station, codes in fields.items()
+    )
+
+
+@influx_operation
+def read_latest_values(sensors: Iterable[Sensor]) -> Dict[Sensor, Optional[dict]]:
+    """Read latest values for a whole set of sensors with a single query.
+
+    Args:
+        sensors: Sensors to fetch values for, should have station and type already selected.
+
+    Returns:
+        Dictionary with a {"time": ..., "value": ...} dict for each sensor, or None, if no recent value exists.
+    """
+
+    # group sensors by station and field
+    sensors = list(sensors)
+    values: Dict[Sensor, Optional[dict]] = {sensor: None for sensor in sensors}
+    fields = _group_sensors(sensors)
+
+    # take fresh values from store and only query the others
+    store = get_store()
+    if store is not None:
+        cached = store.get_many((station, field) for station, codes in fields.items() for field in codes)
+        for (station, field), value in cached.items():
+            for sensor in fields[station].pop(field):
+                values[sensor] = value
+        fields = {station: codes for station, codes in fields.items() if len(codes) > 0}
+
+    # nothing to do?
+    if len(fields) == 0:
+        return values
+
+    # query
+    client = get_client()
+    query = f"""
+        from(bucket:"{INFLUXDB_BUCKET}")
+            |> range(start: -5m)
+            |> filter(fn:(r) => {_sensor_filter(fields)})
+            |> last()
+        """
+    result = client.query_api().query(org=INFLUXDB_ORG, query=query)
+
+    # assign values to sensors
+    for station, field, time, value in result.to_values(columns=["_measurement", "_field", "_time", "_value"]):
+        for sensor in fields.get(station, {}).get(field, []):
+            values[sensor] = {"time": time, "value": value}
+        if store is not None:
+            store.set_many(station, time, [(field, value)])
+    return values
+
+
+@influx_operation
+def read_sensor_history(
+    sensors: Iterable[Sensor],
+    start: datetime,
+    end: datetime,
+    agg_types: Tuple[str, ...] = ("mean", "min", "max"),
+    every: Optional[str] = None,
+    bucket: str = INFLUXDB_BUCKET_5MIN,
+) -> Dict[Sensor, List[dict]]:
+    """Read aggregated values for a set of sensors with a single query.
+
+    All aggregation types are pivoted into columns, so each returned row contains all of them for the same time.
+
+    Args:
+        sensors: Sensors to fetch values for, should have station and type already selected.
+        start: Start of time range.
+        end: End of time range.
+        agg_types: Aggregation types to fetch.
+        every: If given, aggregate further in windows of this Flux duration, e.g. "1h", using the mean of means,
+            the minimum of minimums and the maximum of maximums.
+        bucket: Bucket with aggregated values to read from.
+
+    Returns:
+        Dictionary with a list of {"time": ..., <agg_type>: ...} dicts for each sensor.
+    """
+
+    # group sensors by station and field
+    sensors = list(sensors)
+    values: Dict[Sensor, List[dict]] = {sensor: [] for sensor in sensors}
+    fields = _group_sensors(sensors)
 
-    return {"time": value[0][0], "value": value[0][1]} if len(value) > 0 else None
+    # nothing to do?
+    if len(fields) == 0:
+        return values
 
+    # one stream per aggregation type, aggregated further, if requested
+    streams = []
+    for agg_type in agg_types:
+        stream = f'data |> filter(fn:(r) => r.agg_type == "{agg_type}")'
+        if every is not None:
+            fn = agg_type if agg_type in ("min", "max") else "mean"
+            stream += f" |> aggregateWindow(every: {every}, fn: {fn}, createEmpty: false)"
+        streams.append(stream)
 
+    # query
+    client = get_client()
+    query = f"""
+        data = from(bucket:"{bucket}")
+            |> range(start: {start.strftime('%Y-%m-%dT%H:%M:%SZ')}, stop: {end.strftime('%Y-%m-%dT%H:%M:%SZ')})
+            |> filter(fn:(r) => {_sensor_filter(fields)})
+        union(tables: [{", ".join(streams)}])
+            |> pivot(rowKey: ["_time"], columnKey: ["agg_type"], valueColumn: "_value")
+            |> sort(columns: ["_time"])
+        """
+    result = client.query_api().query(org=INFLUXDB_ORG, query=query)
+
+    # assign rows to sensors
+    for table in result:
+        for record in table.records:
+            row = {"time": record.get_time().strftime("%Y-%m-%dT%H:%M:%SZ")}
+            row.update({agg_type: record.values.get(agg_type) for agg_type in agg_types})
+            for sensor in fields.get(record.get_measurement(), {}).get(record.get_field(), []):
+                values[sensor].append(row)
+    return values
+
+
+@influx_operation
+def stream_pivoted_values(
+    stations: List[str], types: List[str], start: datetime, end: datetime, every: Optional[str] = None
+) -> Iterator[Tuple[datetime, str, dict]]:
+    """Stream raw or aggregated values of many stations, pivoted to one row per station and time.
+
+    Records are parsed while they are received, so memory is bounded by the server-side sort of the time range.
+
+    Args:
+        stations: Codes of stations.
+        types: Codes of sensor types.
+        start: Start of time range.
+        end: End of time range.
+        every: If given, aggregate means in windows of this Flux duration, e.g. "5m".
+
+    Yields:
+        Tuples of time, station code and a dictionary with values for the given types, sorted by time and station.
+    """
+
+    # nothing to do?
+    if len(stations) == 0 or len(types) == 0:
+        return
+
+    # query
+    client = get_client()
+    aggregate = f"|> toFloat() |> aggregateWindow(every: {every}, fn: mean, createEmpty: false)" if every else ""
+    query = f"""
+        from(bucket:"{INFLUXDB_BUCKET}")
+            |> range(start: {start.strftime('%Y-%m-%dT%H:%M:%SZ')}, stop: {end.strftime('%Y-%m-%dT%H:%M:%SZ')})
+            |> filter(fn:(r) => {_sensor_filter({station: types for station in stations})})
+            {aggregate}
+            |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+            |> group()
+            |> sort(columns: ["_time", "_measurement"])
+        """
+    for record in client.query_api().query_stream(org=INFLUXDB_ORG, query=query):
+        yield record.get_time(), record.get_measurement(), {t: record.values.get(t) for t in types}
+
+
+@influx_operation
+def read_sensor_series(sensor: Sensor, start: datetime, end: datetime) -> Tuple[np.ndarray, np.ndarray]:
+    """Read all raw values of a sensor in a time range.
+
+    Args:
+        sensor: Sensor to fetch values for.
+        start: Start of time range.
+        end: End of time range.
+
+    Returns:
+        Arrays of UNIX timestamps and values, sorted by time, with NaN for non-numeric values.
+    """
+    client = get_client()
+    query = f"""
+        from(bucket:"{INFLUXDB_BUCKET}")
+            |> range(start: {start.strftime('%Y-%m-%dT%H:%M:%SZ')}, stop: {end.strftime('%Y-%m-%dT%H:%M:%SZ')})
+            |> filter(fn:(r) => r._measurement == "{sensor.station.code}" and r._field == "{sensor.type.code}")
+            |> keep(columns: ["_time", "_value"])
+            |> sort(columns: ["_time"])
+        """
+    times, values = [], []
+    for record in client.query_api().query_stream(org=INFLUXDB_ORG, query=query):
+        times.append(record.get_time().timestamp())
+        values.append(record.get_value())
+    return np.array(times, dtype=float), np.array([value_to_float({"value": v}) for v in values], dtype=float)
+
+
+@influx_operation
 def read_sensor_values(sensor, start, end, agg_type: str = "mean"):
     client = get_client()
     query = f"""
@@ -67,6 +333,7 @@ def read_sensor_values(sensor, start, end, agg_type: str = "mean"):
     return values
 
 
+@influx_operation
 def write_sensor_value(sensor: Sensor, time: datetime, value: float, station: Optional[str] = None):
     """Write single value to influx.
 
@@ -80,6 +347,12 @@ def write_sensor_value(sensor: Sensor, time: datetime, value: float, station: Op
 
     p = Point(station).field(sensor.type.code, value).time(time.strftime("%Y-%m-%dT%H:%M:%SZ"))
     _get_write_api().write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=p)
+    INFLUX_POINTS.inc()
+
+    # write through to store of latest values
+    store = get_store()
+    if store is not None:
+        store.set_many(station, time, [(sensor.type.code, value)])
 
 
 def write_sensor_values(time: datetime, station: Station, values: List[Tuple[str, float]]) -> None:
@@ -90,8 +363,34 @@ def write_sensor_values(time: datetime, station: Station, values: List[Tuple[str
         station: Station to write for.
         values: List of [str, float] tuples with sensor readings.
     """
-    p = Point(station.code)
-    for sensor, value in values:
-        p = p.field(sensor, value)
-    p = p.time(time.strftime("%Y-%m-%dT%H:%M:%SZ"))
-    _get_write_api().write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=p)
\ No newline at end of file
+    write_sensor_rows(station=station, rows=[(time, values)])
+
+
+@influx_operation
+def write_sensor_rows(station: Station, rows: List[Tuple[datetime, List[Tuple[str, float]]]]) -> None:
+    """Write measurements for multiple times to influx with a single request.
+
+    Args:
+        station: Station to write for.
+        rows: List of (time, values) tuples, with values being a list of [str, float] tuples with sensor readings.
+    """
+
+    # create points
+    points = []
+    for time, values in rows:
+        p = Point(station.code)
+        for sensor, value in values:
+            p = p.field(sensor, value)
+        points.append(p.time(time.strftime("%Y-%m-%dT%H:%M:%SZ")))
+
+    # nothing to write?
+    if len(points) == 0:
+        return
+    _get_write_api().write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=points)
+    INFLUX_POINTS.inc(len(points))
+
+    # write through to store of latest values
+    store = get_store()
+    if store is not None:
+        for time, values in rows:
+            store.set_many(station.code, time, values)
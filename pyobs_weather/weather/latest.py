@@ -0,0 +1,140 @@
+import contextlib
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.core.cache import caches
+
+from pyobs_weather.settings import LATEST_VALUE_CACHE, LATEST_VALUE_CACHE_ALIAS, LATEST_VALUE_CACHE_TTL
+
+Key = Tuple[str, str]
+
+
+def _utc(time: datetime) -> datetime:
+    """Naive times are written to Influx as UTC, so treat them the same here."""
+    return time.replace(tzinfo=timezone.utc) if time.tzinfo is None else time.astimezone(timezone.utc)
+
+
+class LatestValueStore:
+    """Base class for stores that keep the latest value for each (station, field) pair."""
+
+    def __init__(self, ttl: int = LATEST_VALUE_CACHE_TTL):
+        """Creates a new store.
+
+        Args:
+            ttl: Values older than this number of seconds are considered stale.
+        """
+        self._ttl = ttl
+
+    def _load(self, keys: List[Key]) -> Dict[Key, dict]:
+        raise NotImplementedError
+
+    def _store(self, values: Dict[Key, dict]) -> None:
+        raise NotImplementedError
+
+    def get_many(self, keys: Iterable[Key]) -> Dict[Key, dict]:
+        """Returns all fresh values for the given keys.
+
+        Args:
+            keys: List of (station, field) tuples.
+
+        Returns:
+            Dictionary with a {"time": ..., "value": ...} dict for each key with a fresh value.
+        """
+        oldest = datetime.now(timezone.utc) - timedelta(seconds=self._ttl)
+        return {key: value for key, value in self._load(list(keys)).items() if value["time"] > oldest}
+
+    def set_many(self, station: str, time: datetime, values: Iterable[Tuple[str, Optional[float]]]) -> None:
+        """Stores new values for a station, unless a newer one is already stored.
+
+        Args:
+            station: Code of station.
+            time: Time of values.
+            values: List of (field, value) tuples, None values are ignored just like Influx does.
+        """
+        time = _utc(time)
+        new = {(station, field): {"time": time, "value": value} for field, value in values if value is not None}
+        current = self._load(list(new.keys()))
+        self._store({key: val for key, val in new.items() if key not in current or current[key]["time"] <= time})
+
+
+class LocalLatestValueStore(LatestValueStore):
+    """Process-local store, only suitable if all stations are updated and evaluated in the same process."""
+
+    def __init__(self, *args, **kwargs):
+        LatestValueStore.__init__(self, *args, **kwargs)
+        self._values: Dict[Key, dict] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, keys: List[Key]) -> Dict[Key, dict]:
+        with self._lock:
+            return {key: self._values[key] for key in keys if key in self._values}
+
+    def _store(self, values: Dict[Key, dict]) -> None:
+        with self._lock:
+            self._values.update(values)
+
+
+class DjangoCacheLatestValueStore(LatestValueStore):
+    """Store using a Django cache, which can be shared between processes, e.g. with a Redis backend."""
+
+    def __init__(self, alias: str = LATEST_VALUE_CACHE_ALIAS, *args, **kwargs):
+        LatestValueStore.__init__(self, *args, **kwargs)
+        self._alias = alias
+
+    @staticmethod
+    def _key(key: Key) -> str:
+        return "latest:%s:%s" % key
+
+    def _load(self, keys: List[Key]) -> Dict[Key, dict]:
+        cached = caches[self._alias].get_many([self._key(key) for key in keys])
+        return {key: cached[self._key(key)] for key in keys if self._key(key) in cached}
+
+    def _store(self, values: Dict[Key, dict]) -> None:
+        caches[self._alias].set_many({self._key(key): val for key, val in values.items()}, timeout=self._ttl)
+
+
+_store: Optional[LatestValueStore] = None
+
+
+def create_store() -> Optional[LatestValueStore]:
+    """Creates a new store for latest values as configured or returns None, if disabled."""
+    if LATEST_VALUE_CACHE == "local":
+        return LocalLatestValueStore()
+    elif LATEST_VALUE_CACHE == "django":
+        return DjangoCacheLatestValueStore()
+    return None
+
+
+def get_store() -> Optional[LatestValueStore]:
+    """Returns the configured store for latest values or None, if disabled."""
+    global _store
+    if _store is None:
+        _store = create_store()
+    return _store
+
+
+@contextlib.contextmanager
+def use_store(store: Optional[LatestValueStore]) -> Iterator[None]:
+    """Uses the given store for latest values in this process, e.g. a private one.
+
+    Args:
+        store: Store to use, or None to create a new one as configured on first use.
+    """
+    global _store
+    previous = _store
+    _store = store
+    try:
+        yield
+    finally:
+        _store = previous
+
+
+__all__ = [
+    "LatestValueStore",
+    "LocalLatestValueStore",
+    "DjangoCacheLatestValueStore",
+    "create_store",
+    "get_store",
+    "use_store",
+]
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta, timezone
+
+import dateutil.parser
+from django.core.management.base import BaseCommand, CommandError
+
+from pyobs_weather.weather.models import Station
+from pyobs_weather.weather.registry import get_station
+
+
+class Command(BaseCommand):
+    help = "Fetch past data of a station that supports it, e.g. to fill gaps after an outage"
+
+    def add_arguments(self, parser):
+        parser.add_argument("station", type=str, help="Code of station")
+        parser.add_argument("-s", "--start", type=str, required=True, help="Start of time range")
+        parser.add_argument("-e", "--end", type=str, help="End of time range, defaults to now")
+        parser.add_argument("--chunk", type=float, default=6.0, help="Hours of data per request")
+        parser.add_argument("--workers", type=int, default=4, help="Number of parallel requests")
+
+    def handle(self, *args, **options):
+        # time range
+        end = self._parse_time(options["end"]) if options["end"] else datetime.now(timezone.utc)
+        start = self._parse_time(options["start"])
+        if start >= end or options["chunk"] <= 0 or options["workers"] < 1:
+            raise CommandError("Invalid time range, chunk or number of workers.")
+
+        # get station
+        try:
+            obj = get_station(options["station"])
+        except Station.DoesNotExist:
+            raise CommandError("Unknown station: %s" % options["station"])
+        if not hasattr(obj, "backfill"):
+            raise CommandError("Station %s does not support backfilling." % options["station"])
+
+        # fetch data
+        count = obj.backfill(start, end, chunk=timedelta(hours=options["chunk"]), workers=options["workers"])
+        self.stdout.write("Wrote %d rows from %s to %s." % (count, start, end))
+
+    @staticmethod
+    def _parse_time(value: str) -> datetime:
+        # parse and assume UTC, if no time zone given
+        t = dateutil.parser.parse(value)
+        return t.replace(tzinfo=timezone.utc) if t.tzinfo is None else t.astimezone(timezone.utc)
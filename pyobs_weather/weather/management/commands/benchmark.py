@@ -0,0 +1,68 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from pyobs_weather.weather.benchmark import SCENARIOS, compare_benchmarks, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = "Benchmark ingestion, evaluation and API with synthetic stations on a test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=str, default="10,100,1000", help="Comma-separated numbers of sensors to benchmark"
+        )
+        parser.add_argument(
+            "--scenario", action="append", choices=SCENARIOS, help="Scenario to run, can be given multiple times"
+        )
+        parser.add_argument("--repeat", type=int, default=5, help="Number of timed runs per scenario")
+        parser.add_argument("-o", "--output", type=str, help="Write results as JSON to this file")
+        parser.add_argument("--compare", type=str, help="Compare with results from a previous run in this file")
+        parser.add_argument(
+            "--threshold", type=float, default=1.2, help="Ratio of median times that counts as regression"
+        )
+
+    def handle(self, *args, **options):
+        # sizes
+        try:
+            sizes = [int(s) for s in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("Invalid sizes: %s" % options["sizes"])
+
+        # load baseline first, so that we fail early
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                baseline = json.load(f)
+
+        # run on a test database, so that no real data gets touched
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = run_benchmarks(sizes, scenarios=options["scenario"], repeat=options["repeat"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        # print results
+        self.stdout.write(
+            "%-25s %10s %10s %10s %8s %8s" % ("scenario", "min ms", "median ms", "max ms", "sql", "influx")
+        )
+        for key, res in results["results"].items():
+            self.stdout.write(
+                "%-25s %10.2f %10.2f %10.2f %8d %8d"
+                % (key, res["min_ms"], res["median_ms"], res["max_ms"], res["sql_queries"], res["influx_queries"])
+            )
+
+        # store them
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+
+        # compare with baseline
+        if baseline is not None:
+            regressions = compare_benchmarks(baseline, results, options["threshold"])
+            for key, ratio in regressions:
+                self.stderr.write("Regression in %s: %.2fx slower than in %s." % (key, ratio, baseline["version"]))
+            if len(regressions) > 0:
+                raise CommandError("Found %d regression(s)." % len(regressions))
@@ -1,44 +1,89 @@
-from astropy.time import Time
-from django.core.management.base import BaseCommand
+import gzip
+import sys
+from datetime import datetime, timedelta, timezone
+
+import dateutil.parser
+from django.core.management.base import BaseCommand, CommandError
 
 from pyobs_weather.settings import INFLUXDB_MEASUREMENT_AVERAGE
-from pyobs_weather.weather.models import Station, Value, SensorType
+from pyobs_weather.weather.export import ARROW_MISSING, export_rows, export_types, has_arrow, write_csv, write_parquet
 
 
 class Command(BaseCommand):
-    help = "Init pyobs-weather"
+    help = "Dump weather data as CSV, gzipped CSV or Parquet"
 
     def add_arguments(self, parser):
-        parser.add_argument("-s", "--start", type=str, help="Start date to dump")
-        parser.add_argument("-e", "--end", type=str, help="End date to dump")
-
-    def handle(self, start: str, end: str, *args, **options):
-        # get average station
-        station = Station.objects.filter(code=INFLUXDB_MEASUREMENT_AVERAGE).first()
-
-        # get all sensor types and print header
-        sensor_types = [st.code for st in SensorType.objects.all()]
-        print("datetime," + ",".join(sensor_types))
-
-        # get all timestamps for station in range
-        query = Value.objects.filter(sensor__station=station)
-        if start is not None:
-            query = query.filter(time__gte=start)
-        if end is not None:
-            query = query.filter(time__lte=end)
-        timestamps = query.order_by("time").values_list("time", flat=True)
-
-        # now loop all times
-        for t in timestamps:
-            # get all values
-            values = dict(
-                Value.objects.filter(sensor__station=station, time=t).values_list("sensor__type__code", "value").all()
+        parser.add_argument("-s", "--start", type=str, help="Start date to dump, defaults to one day before end")
+        parser.add_argument("-e", "--end", type=str, help="End date to dump, defaults to now")
+        parser.add_argument(
+            "--station", action="append", help="Station to dump, can be given multiple times, defaults to average"
+        )
+        parser.add_argument("--type", action="append", help="Sensor type to dump, can be given multiple times")
+        parser.add_argument("--every", type=str, help="Aggregate means in windows of this length, e.g. 5m")
+        parser.add_argument(
+            "--backend", choices=["influx", "sql"], help="Read from InfluxDB or the database, defaults to configured one"
+        )
+        parser.add_argument("--chunk", type=float, default=24.0, help="Hours of data fetched per query")
+        parser.add_argument("-f", "--format", choices=["csv", "csv.gz", "parquet"], help="Output format")
+        parser.add_argument("-o", "--output", type=str, help="Output file, defaults to stdout for CSV")
+
+    def handle(self, *args, **options):
+        # time range
+        end = self._parse_time(options["end"]) if options["end"] else datetime.now(timezone.utc)
+        start = self._parse_time(options["start"]) if options["start"] else end - timedelta(days=1)
+
+        # stations and types
+        stations = options["station"] or [INFLUXDB_MEASUREMENT_AVERAGE]
+        types = options["type"] or export_types(stations)
+
+        # format from option or filename
+        output = options["output"]
+        fmt = options["format"]
+        if fmt is None:
+            fmt = "csv"
+            if output is not None and output.endswith(".gz"):
+                fmt = "csv.gz"
+            elif output is not None and output.endswith(".parquet"):
+                fmt = "parquet"
+
+        # check, before anything is fetched
+        if fmt == "parquet":
+            if output is None:
+                raise CommandError("Parquet needs an output file.")
+            if not has_arrow():
+                raise CommandError(ARROW_MISSING)
+
+        # get rows
+        try:
+            rows = export_rows(
+                stations,
+                types,
+                start,
+                end,
+                every=options["every"],
+                chunk=timedelta(hours=options["chunk"]),
+                influx=None if options["backend"] is None else options["backend"] == "influx",
             )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        # write them
+        if fmt == "parquet":
+            count = write_parquet(output, types, rows)
+        elif fmt == "csv.gz":
+            with gzip.open(output or sys.stdout.buffer, "wt", newline="") as f:
+                count = write_csv(f, types, rows)
+        elif output is not None:
+            with open(output, "w", newline="") as f:
+                count = write_csv(f, types, rows)
+        else:
+            count = write_csv(sys.stdout, types, rows)
+
+        # report to stderr, so that it doesn't end up in data
+        self.stderr.write("Dumped %d rows." % count)
 
-            # dump it in correct order
-            line = Time(t).isot
-            for st in sensor_types:
-                line += ","
-                if st in values and values[st] is not None:
-                    line += str(values[st])
-            print(line)
+    @staticmethod
+    def _parse_time(value: str) -> datetime:
+        # parse and assume UTC, if no time zone given
+        t = dateutil.parser.parse(value)
+        return t.replace(tzinfo=timezone.utc) if t.tzinfo is None else t.astimezone(timezone.utc)
@@ -1,7 +1,14 @@
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from django_celery_beat.schedulers import IntervalSchedule, PeriodicTask
 
-from pyobs_weather.settings import INFLUXDB_MEASUREMENT_AVERAGE
+from pyobs_weather.settings import (
+    INFLUXDB_MEASUREMENT_AVERAGE,
+    EVALUATE_SWEEP_INTERVAL,
+    ROLLUP,
+    ROLLUP_INTERVAL,
+    USE_INFLUX,
+)
 from pyobs_weather.weather.models import Station, Evaluator
 
 
@@ -9,6 +16,9 @@ class Command(BaseCommand):
     help = "Init pyobs-weather"
 
     def handle(self, *args, **options):
+        # create table for database cache, if used
+        call_command("createcachetable")
+
         # create average station
         interval, _ = IntervalSchedule.objects.get_or_create(every=10, period=IntervalSchedule.SECONDS)
         if Station.objects.filter(code=INFLUXDB_MEASUREMENT_AVERAGE).count() == 0:
@@ -31,14 +41,34 @@ class Command(BaseCommand):
                 history=False,
             )
 
-        # create interval for evaluation
-        interval, _ = IntervalSchedule.objects.get_or_create(every=10, period=IntervalSchedule.SECONDS)
-        PeriodicTask.objects.get_or_create(
-            interval=interval,
+        # let queued updates of existing stations expire when the next one is due
+        for station in Station.objects.filter(interval__isnull=False):
+            PeriodicTask.objects.filter(name=station.name).update(expire_seconds=int(station.interval_seconds()))
+
+        # create interval for evaluation, which is only a safety sweep, if evaluation is triggered by new data
+        interval, _ = IntervalSchedule.objects.get_or_create(
+            every=EVALUATE_SWEEP_INTERVAL, period=IntervalSchedule.SECONDS
+        )
+        PeriodicTask.objects.update_or_create(
             name="Evaluate sensor goodness",
-            task="pyobs_weather.weather.tasks.evaluate",
+            defaults=dict(
+                interval=interval, task="pyobs_weather.weather.tasks.evaluate", expire_seconds=EVALUATE_SWEEP_INTERVAL
+            ),
         )
 
+        # create buckets and schedule task for rollups
+        if USE_INFLUX and ROLLUP:
+            from pyobs_weather.weather.rollup import ensure_buckets
+
+            ensure_buckets()
+            interval, _ = IntervalSchedule.objects.get_or_create(every=ROLLUP_INTERVAL, period=IntervalSchedule.SECONDS)
+            PeriodicTask.objects.update_or_create(
+                name="Roll up sensor values",
+                defaults=dict(
+                    interval=interval, task="pyobs_weather.weather.tasks.rollup", expire_seconds=ROLLUP_INTERVAL
+                ),
+            )
+
         # add some default evaluators
         Evaluator.objects.get_or_create(
             name="humid",
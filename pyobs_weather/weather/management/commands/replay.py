@@ -0,0 +1,100 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import dateutil.parser
+from django.core.management.base import BaseCommand, CommandError
+
+from pyobs_weather.settings import INFLUXDB_MEASUREMENT_AVERAGE
+from pyobs_weather.weather.models import Sensor
+from pyobs_weather.weather.replay import replay
+
+
+class Command(BaseCommand):
+    help = "Replay evaluation of sensors over historical data, e.g. for testing new evaluator kwargs or delays"
+
+    def add_arguments(self, parser):
+        parser.add_argument("-s", "--start", type=str, help="Start of replay, defaults to one day before end")
+        parser.add_argument("-e", "--end", type=str, help="End of replay, defaults to now")
+        parser.add_argument(
+            "--sensor", action="append", help="Sensor as STATION:TYPE, can be given multiple times, defaults to all"
+        )
+        parser.add_argument(
+            "--kwargs", action="append", help="Replace kwargs of an evaluator as NAME=JSON, can be given multiple times"
+        )
+        parser.add_argument("--delay-good", type=float, help="Replace delay for becoming good of all sensors")
+        parser.add_argument("--delay-bad", type=float, help="Replace delay for becoming bad of all sensors")
+        parser.add_argument("--step", type=float, default=10.0, help="Seconds between evaluations")
+        parser.add_argument("--changes", action="store_true", help="List all changes of global status")
+
+    def handle(self, *args, **options):
+        # time range
+        end = self._parse_time(options["end"]) if options["end"] else datetime.now(timezone.utc)
+        start = self._parse_time(options["start"]) if options["start"] else end - timedelta(days=1)
+        if start >= end or options["step"] <= 0:
+            raise CommandError("Invalid time range or step.")
+
+        # sensors
+        sensors = Sensor.objects.exclude(station__code=INFLUXDB_MEASUREMENT_AVERAGE)
+        if options["sensor"]:
+            codes = [s.split(":", 1) for s in options["sensor"]]
+            if any(len(c) != 2 for c in codes):
+                raise CommandError("Sensors must be given as STATION:TYPE.")
+            sensors = [self._get_sensor(station, type_) for station, type_ in codes]
+        else:
+            sensors = list(sensors.select_related("station", "type").prefetch_related("evaluators"))
+
+        # evaluator kwargs
+        kwargs = {}
+        for kw in options["kwargs"] or []:
+            name, _, value = kw.partition("=")
+            try:
+                json.loads(value)
+            except ValueError:
+                raise CommandError("Invalid JSON for evaluator %s: %s" % (name, value))
+            kwargs[name] = value
+
+        # replay
+        try:
+            result = replay(
+                sensors,
+                start,
+                end,
+                step=options["step"],
+                kwargs=kwargs,
+                delay_good=options["delay_good"],
+                delay_bad=options["delay_bad"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        # print summary per sensor
+        step_hours = result.step / 3600.0
+        for sensor, states in result.states.items():
+            self.stdout.write(
+                "%-30s good for %8.2f h, %d changes"
+                % (sensor, states.sum() * step_hours, len(result.changes(states)) - 1)
+            )
+
+        # and global status
+        changes = result.changes()
+        if options["changes"]:
+            for time, good in changes:
+                t = datetime.fromtimestamp(time, tz=timezone.utc)
+                self.stdout.write("%s %s" % (t.strftime("%Y-%m-%dT%H:%M:%SZ"), "good" if good else "bad"))
+        self.stdout.write(
+            "Good weather for %.2f of %.2f hours, %d changes."
+            % (result.good_hours, (end - start).total_seconds() / 3600.0, max(len(changes) - 1, 0))
+        )
+
+    @staticmethod
+    def _get_sensor(station: str, type_: str) -> Sensor:
+        try:
+            return Sensor.objects.prefetch_related("evaluators").get(station__code=station, type__code=type_)
+        except Sensor.DoesNotExist:
+            raise CommandError("Unknown sensor %s:%s." % (station, type_))
+
+    @staticmethod
+    def _parse_time(value: str) -> datetime:
+        # parse and assume UTC, if no time zone given
+        t = dateutil.parser.parse(value)
+        return t.replace(tzinfo=timezone.utc) if t.tzinfo is None else t.astimezone(timezone.utc)
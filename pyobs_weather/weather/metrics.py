@@ -0,0 +1,227 @@
+import contextlib
+import functools
+import inspect
+import logging
+import os
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+from celery.signals import task_postrun, task_prerun, task_revoked
+from django.db import connection
+from django.http import HttpResponse
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+log = logging.getLogger(__name__)
+
+# buckets for durations in seconds, from single queries up to slow station updates
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# buckets for numbers of SQL queries per request
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class _NullMetric:
+    """Does nothing, used for all metrics if prometheus_client is not installed."""
+
+    def labels(self, *args, **kwargs) -> "_NullMetric":
+        return self
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+
+def _metric(kind: str, name: str, documentation: str, labels: tuple = (), **kwargs):
+    """Creates a metric of the given kind from prometheus_client, or a no-op, if it is not installed."""
+    if prometheus_client is None:
+        return _NullMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labels, **kwargs)
+
+
+INFLUX_SECONDS = _metric(
+    "Histogram", "pyobs_weather_influx_seconds", "Duration of Influx operations", ("operation",), buckets=BUCKETS
+)
+INFLUX_ERRORS = _metric("Counter", "pyobs_weather_influx_errors", "Failed Influx queries and writes", ("operation",))
+INFLUX_POINTS = _metric("Counter", "pyobs_weather_influx_points", "Points handed to the Influx write API")
+WRITER_EVENTS = _metric("Counter", "pyobs_weather_writer_points", "Points processed by batching writer", ("result",))
+STATION_UPDATE_SECONDS = _metric(
+    "Histogram", "pyobs_weather_station_update_seconds", "Duration of station updates", ("station",), buckets=BUCKETS
+)
+STATION_UPDATE_FAILURES = _metric(
+    "Counter", "pyobs_weather_station_update_failures", "Failed station updates", ("station",)
+)
+STATION_FETCH_SECONDS = _metric(
+    "Histogram", "pyobs_weather_station_fetch_seconds", "Duration of station requests", ("station",), buckets=BUCKETS
+)
+STATION_FETCHES = _metric(
+    "Counter", "pyobs_weather_station_fetches", "Requests to stations by result", ("station", "result")
+)
+EVALUATE_SECONDS = _metric("Histogram", "pyobs_weather_evaluate_seconds", "Duration of evaluations", buckets=BUCKETS)
+EVALUATE_SENSORS = _metric(
+    "Gauge", "pyobs_weather_evaluate_sensors", "Number of sensors in last evaluation", multiprocess_mode="max"
+)
+REQUEST_SECONDS = _metric(
+    "Histogram", "pyobs_weather_request_seconds", "Duration of requests", ("view", "method", "status"), buckets=BUCKETS
+)
+REQUEST_QUERIES = _metric(
+    "Histogram", "pyobs_weather_request_sql_queries", "SQL queries per request", ("view",), buckets=QUERY_BUCKETS
+)
+TASK_SECONDS = _metric(
+    "Histogram", "pyobs_weather_task_seconds", "Duration of Celery tasks", ("task", "state"), buckets=BUCKETS
+)
+TASK_SKIPPED = _metric("Counter", "pyobs_weather_task_skipped", "Runs skipped, since previous still running", ("task",))
+TASK_OVERRAN = _metric("Counter", "pyobs_weather_task_overran", "Runs that took longer than their interval", ("task",))
+TASK_EXPIRED = _metric("Counter", "pyobs_weather_task_expired", "Queued runs that expired before start", ("task",))
+
+
+@contextlib.contextmanager
+def timed(histogram, errors=None, **labels) -> Iterator[None]:
+    """Observes duration of a block in a histogram, and counts exceptions.
+
+    Args:
+        histogram: Histogram to observe duration in.
+        errors: Counter for exceptions.
+        **labels: Labels for both metrics.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.labels(**labels).inc()
+        raise
+    finally:
+        if labels:
+            histogram.labels(**labels).observe(time.perf_counter() - start)
+        else:
+            histogram.observe(time.perf_counter() - start)
+
+
+def influx_operation(func: Callable) -> Callable:
+    """Decorator for observing duration and errors of a function in influx.py, including generators."""
+    operation = func.__name__
+
+    if inspect.isgeneratorfunction(func):
+
+        @functools.wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            with timed(INFLUX_SECONDS, INFLUX_ERRORS, operation=operation):
+                yield from func(*args, **kwargs)
+
+        return gen_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with timed(INFLUX_SECONDS, INFLUX_ERRORS, operation=operation):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+class MetricsMiddleware:
+    """Observes duration and number of SQL queries of each request, labelled by the name of the view."""
+
+    def __init__(self, get_response: Callable):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # count SQL queries while handling request
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        # handle request
+        start = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        # unmatched URLs would create a label for every path
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match is not None else "unmatched"
+        REQUEST_SECONDS.labels(view=view, method=request.method, status=response.status_code).observe(duration)
+        REQUEST_QUERIES.labels(view=view).observe(queries[0])
+        return response
+
+
+def metrics(request) -> HttpResponse:
+    """Exposes all metrics in Prometheus text format, collected from all processes in multiprocess mode."""
+    if prometheus_client is None:
+        return HttpResponse("Metrics require prometheus_client, please install pyobs-weather[metrics].", status=501)
+
+    # in multiprocess mode, metrics of all processes are read from PROMETHEUS_MULTIPROC_DIR
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return HttpResponse(prometheus_client.generate_latest(registry), content_type=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+# start times of running Celery tasks by task ID
+_task_start: Dict[str, float] = {}
+
+
+@task_prerun.connect
+def _task_started(task_id: Optional[str] = None, **kwargs) -> None:
+    if task_id is not None:
+        _task_start[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _task_finished(task_id: Optional[str] = None, task=None, state: Optional[str] = None, **kwargs) -> None:
+    start = _task_start.pop(task_id, None)
+    if start is None or task is None:
+        return
+    duration = time.perf_counter() - start
+    TASK_SECONDS.labels(task=task.name, state=state or "UNKNOWN").observe(duration)
+
+    # send as task event for monitors like Flower, if events are enabled
+    if task.app.conf.worker_send_task_events:
+        try:
+            task.send_event("task-metrics", duration=duration, state=state)
+        except Exception:
+            log.exception("Could not send task event.")
+
+
+@task_revoked.connect
+def _task_revoked(sender=None, expired: bool = False, **kwargs) -> None:
+    if expired and sender is not None:
+        TASK_EXPIRED.labels(task=sender.name).inc()
+
+
+__all__ = [
+    "INFLUX_SECONDS",
+    "INFLUX_ERRORS",
+    "INFLUX_POINTS",
+    "WRITER_EVENTS",
+    "STATION_UPDATE_SECONDS",
+    "STATION_UPDATE_FAILURES",
+    "STATION_FETCH_SECONDS",
+    "STATION_FETCHES",
+    "EVALUATE_SECONDS",
+    "EVALUATE_SENSORS",
+    "REQUEST_SECONDS",
+    "REQUEST_QUERIES",
+    "TASK_SECONDS",
+    "TASK_SKIPPED",
+    "TASK_OVERRAN",
+    "TASK_EXPIRED",
+    "timed",
+    "influx_operation",
+    "MetricsMiddleware",
+    "metrics",
+]
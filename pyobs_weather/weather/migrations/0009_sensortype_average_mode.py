@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+def set_circular(apps, schema_editor):
+    SensorType = apps.get_model("weather", "SensorType")
+    SensorType.objects.filter(code="winddir").update(average_mode="circular")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("weather", "0008_alter_sensor_unique_together_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sensortype",
+            name="average_mode",
+            field=models.CharField(
+                choices=[
+                    ("mean", "Weighted mean"),
+                    ("median", "Weighted median"),
+                    ("sigmaclip", "Sigma-clipped weighted mean"),
+                    ("circular", "Weighted circular mean, for angles in degrees"),
+                ],
+                default="mean",
+                max_length=10,
+                verbose_name="Method for calculating average",
+            ),
+        ),
+        migrations.RunPython(set_circular, migrations.RunPython.noop),
+    ]
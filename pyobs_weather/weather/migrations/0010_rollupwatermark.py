@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0009_sensortype_average_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('resolution', models.CharField(max_length=10, unique=True, verbose_name='Resolution of rollup')),
+                ('start', models.DateTimeField(verbose_name='Data after this time has been rolled up')),
+                ('time', models.DateTimeField(verbose_name='Data before this time has been rolled up')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0010_rollupwatermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='station',
+            name='state',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='State kept by station between updates'),
+        ),
+    ]
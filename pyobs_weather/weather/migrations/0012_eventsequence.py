@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0011_station_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventSequence',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('seq', models.BigIntegerField(default=0, verbose_name='ID of last published event')),
+            ],
+        ),
+    ]
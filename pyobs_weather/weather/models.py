@@ -3,6 +3,7 @@ import logging
 from django.db import models
 from django_celery_beat.models import CrontabSchedule, IntervalSchedule, PeriodicTask
 
+from pyobs_weather.weather.averaging import AVERAGE_MODES
 from pyobs_weather.weather.utils import get_class
 from pyobs_weather.settings import USE_INFLUX
 
@@ -41,10 +42,15 @@ class Station(models.Model):
     history = models.BooleanField("Whether to keep more than one point", default=True)
     active = models.BooleanField("Whether station is currently active", default=True)
     color = models.CharField("Plot color", max_length=20, default="rgba(0, 0, 0, 0.1)")
+    state = models.JSONField("State kept by station between updates", default=dict, blank=True, editable=False)
 
     def __str__(self):
         return self.name
 
+    def interval_seconds(self):
+        """Returns interval between updates in seconds, or None, if not running in an interval."""
+        return None if self.interval is None else self.interval.schedule.run_every.total_seconds()
+
     def save(self, *args, **kwargs):
         # actually save model
         models.Model.save(self, *args, **kwargs)
@@ -68,7 +74,7 @@ class Station(models.Model):
         except Station.DoesNotExist:
             pass
 
-        # update periodic task
+        # update periodic task, queued runs expire when the next one is due
         if self.crontab is not None or self.interval is not None:
             PeriodicTask.objects.get_or_create(
                 crontab=self.crontab,
@@ -76,6 +82,7 @@ class Station(models.Model):
                 name=self.name,
                 task="pyobs_weather.weather.tasks.update_stations",
                 args='["%s"]' % self.code,
+                expire_seconds=None if self.interval is None else int(self.interval_seconds()),
             )
 
     def delete(self, *args, **kwargs):
@@ -94,6 +101,9 @@ class SensorType(models.Model):
     name = models.CharField("Name of sensor type", max_length=50)
     unit = models.CharField("Unit for value", max_length=10)
     average = models.BooleanField("Calculate average for this type", default=True)
+    average_mode = models.CharField(
+        "Method for calculating average", max_length=10, choices=AVERAGE_MODES, default="mean"
+    )
 
     def __str__(self):
         return "%s (%s)" % (self.name, self.code)
@@ -152,3 +162,22 @@ class GoodWeather(models.Model):
     id = models.AutoField(primary_key=True)
     time = models.DateTimeField("Date and time of status change", db_index=True, auto_now_add=True)
     good = models.BooleanField("Weather now good?")
+
+
+class EventSequence(models.Model):
+    """Counter for IDs of events pushed to clients, used if the cache can't increment atomically."""
+
+    id = models.AutoField(primary_key=True)
+    seq = models.BigIntegerField("ID of last published event", default=0)
+
+
+class RollupWatermark(models.Model):
+    """Time range that has been rolled up to a given resolution."""
+
+    id = models.AutoField(primary_key=True)
+    resolution = models.CharField("Resolution of rollup", max_length=10, unique=True)
+    start = models.DateTimeField("Data after this time has been rolled up")
+    time = models.DateTimeField("Data before this time has been rolled up")
+
+    def __str__(self):
+        return "%s until %s" % (self.resolution, self.time)
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from pyobs_weather.settings import STATION_REGISTRY_TTL
+from pyobs_weather.weather.models import Sensor, Station
+from pyobs_weather.weather.utils import get_class
+
+log = logging.getLogger(__name__)
+
+
+class _Entry(NamedTuple):
+    """A station instance together with what it was created from."""
+
+    obj: object
+    station_id: int
+    fingerprint: tuple
+    version: Optional[int]
+    checked: float
+
+
+# station instances of this process by station code
+_entries: Dict[str, _Entry] = {}
+_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def _version_key(station_id: int) -> str:
+    return "station:version:%d" % station_id
+
+
+def _fingerprint(station: Station) -> tuple:
+    """All fields of a station except for the state it keeps itself, an instance is rebuilt when any of them
+    changes."""
+    return tuple(getattr(station, field.attname) for field in Station._meta.concrete_fields if field.name != "state")
+
+
+def _create(station: Station) -> _Entry:
+    """Instantiates the class of a station."""
+    log.info("Creating instance of station %s...", station.code)
+    version = cache.get(_version_key(station.id))
+    kls = get_class(station.class_name)
+    obj = kls(**json.loads(station.kwargs), station=station)
+    return _Entry(obj, station.id, _fingerprint(station), version, time.monotonic())
+
+
+def get_station(code: str):
+    """Returns the long-lived instance of a station in this process, so that it can keep connections and state
+    between updates.
+
+    Instances are rebuilt when their station or one of its sensors is saved or deleted, which is signalled through
+    the cache, and when the station changed in the database, which is checked every STATION_REGISTRY_TTL seconds.
+    Fields that change without a rebuild, i.e. the state of a station, are stale in the instance's Station object and
+    must be read from the database, as WeatherStation._load_state() does.
+
+    Args:
+        code: Code of station.
+
+    Returns:
+        Instance of station class.
+
+    Raises:
+        Station.DoesNotExist: If station does not exist.
+    """
+    global _pid
+
+    with _lock:
+        # forked into a new worker process?
+        if _pid != os.getpid():
+            _entries.clear()
+            _pid = os.getpid()
+
+        # no instance yet?
+        entry = _entries.get(code)
+        if entry is None:
+            entry = _entries[code] = _create(Station.objects.get(code=code))
+            return entry.obj
+
+        # invalidated by signal?
+        if cache.get(_version_key(entry.station_id)) != entry.version:
+            entry = _entries[code] = _create(Station.objects.get(code=code))
+
+        # changed in database?
+        elif time.monotonic() - entry.checked > STATION_REGISTRY_TTL:
+            station = Station.objects.get(code=code)
+            if station.id != entry.station_id or _fingerprint(station) != entry.fingerprint:
+                entry = _entries[code] = _create(station)
+            else:
+                # keep the instance, but with the state just read
+                entry.obj.station.state = station.state
+                entry = _entries[code] = entry._replace(checked=time.monotonic())
+
+        return entry.obj
+
+
+def invalidate(station_id: int) -> None:
+    """Makes all processes rebuild their instance of a station on next use.
+
+    Args:
+        station_id: ID of station.
+    """
+    key = _version_key(station_id)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # expired in between
+            cache.set(key, 1, timeout=None)
+
+
+@receiver(post_save, sender=Station)
+@receiver(post_delete, sender=Station)
+def _station_changed(sender, instance: Station, **kwargs) -> None:
+    invalidate(instance.id)
+
+
+@receiver(post_save, sender=Sensor)
+@receiver(post_delete, sender=Sensor)
+def _sensor_changed(sender, instance: Sensor, **kwargs) -> None:
+    invalidate(instance.station_id)
+
+
+__all__ = ["get_station", "invalidate"]
@@ -0,0 +1,289 @@
+import copy
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from pyobs_weather.weather.evaluation import _takes_value, create_evaluator
+from pyobs_weather.weather.evaluators.base import good_to_float
+from pyobs_weather.weather.influx import read_sensor_series
+from pyobs_weather.weather.models import Sensor
+
+log = logging.getLogger(__name__)
+
+# values older than this number of seconds are considered missing, like in read_latest_values()
+MAX_AGE = 300.0
+
+
+class ReplayResult(NamedTuple):
+    """Result of a replay."""
+
+    times: np.ndarray
+    """UNIX timestamps of evaluation grid."""
+
+    states: Dict[Sensor, np.ndarray]
+    """Boolean status of each sensor at each grid point."""
+
+    good: np.ndarray
+    """Boolean global status at each grid point."""
+
+    @property
+    def step(self) -> float:
+        """Distance between grid points in seconds."""
+        return float(self.times[1] - self.times[0]) if len(self.times) > 1 else 0.0
+
+    @property
+    def good_hours(self) -> float:
+        """Total number of hours with good weather."""
+        return float(np.count_nonzero(self.good)) * self.step / 3600.0
+
+    def changes(self, states: Optional[np.ndarray] = None) -> List[tuple]:
+        """Returns changes of status as list of (UNIX timestamp, good) tuples.
+
+        Args:
+            states: Status to get changes for, defaults to global status.
+        """
+        states = self.good if states is None else states
+        idx = np.concatenate(([0], np.where(states[1:] != states[:-1])[0] + 1)) if len(states) > 0 else []
+        return [(float(self.times[i]), bool(states[i])) for i in idx]
+
+
+def resample(times: np.ndarray, values: np.ndarray, grid: np.ndarray, max_age: float = MAX_AGE) -> np.ndarray:
+    """Takes latest value at each grid point, i.e. forward-fills values, and sets NaN, where they get too old.
+
+    Args:
+        times: UNIX timestamps of values, sorted.
+        values: Values.
+        grid: UNIX timestamps to get values for.
+        max_age: Maximum age of a value in seconds.
+
+    Returns:
+        Values at grid points.
+    """
+    idx = np.searchsorted(times, grid, side="right") - 1
+    valid = idx >= 0
+    idx = np.maximum(idx, 0)
+    if len(times) == 0:
+        return np.full(len(grid), np.nan)
+    return np.where(valid & (grid - times[idx] <= max_age), values[idx], np.nan)
+
+
+def _next_index(flags: np.ndarray) -> np.ndarray:
+    """For each position, returns index of next True value at or after it, or len(flags), if none."""
+    n = len(flags)
+    idx = np.where(flags, np.arange(n), n)
+    return np.minimum.accumulate(idx[::-1])[::-1]
+
+
+def run_state_machine(
+    times: np.ndarray,
+    if_good: np.ndarray,
+    if_bad: np.ndarray,
+    first: bool,
+    delay_good: float = 0.0,
+    delay_bad: float = 0.0,
+) -> np.ndarray:
+    """Applies delays to evaluation results, like evaluate_sensors() does at every step.
+
+    The results of evaluators can depend on the current status, so they are given for both cases. A status only
+    changes, when the opposite result persisted for the given delay. Instead of stepping through all values, this
+    jumps from one run of opposite results to the next.
+
+    Args:
+        times: UNIX timestamps, sorted.
+        if_good: Evaluation results at each time, if current status is good.
+        if_bad: Evaluation results at each time, if current status is bad.
+        first: Evaluation result at first time for an unknown status.
+        delay_good: Delay in seconds before switching to good.
+        delay_bad: Delay in seconds before switching to bad.
+
+    Returns:
+        Boolean status at each time.
+    """
+    n = len(times)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+
+    # for an unknown status, the first result starts the delay for becoming good
+    if_bad = if_bad.copy()
+    if_bad[0] = first
+
+    # next index with a bad result while good and with a good result while bad, and vice versa
+    next_bad = _next_index(~if_good)
+    next_good_again = _next_index(if_good)
+    next_good = _next_index(if_bad)
+    next_bad_again = _next_index(~if_bad)
+
+    # initial status, an unknown status goes through the delay for becoming good
+    state = first and delay_good <= 0
+    i = 1 if state else 0
+    changes = [(0, state)]
+
+    # jump between runs of opposite results
+    while i < n:
+        if state:
+            start = next_bad[i]
+            end = next_good_again[start] if start < n else n
+            delay = delay_bad
+        else:
+            start = next_good[i]
+            end = next_bad_again[start] if start < n else n
+            delay = delay_good
+        if start >= n:
+            break
+
+        # did run last long enough?
+        switch = max(start, int(np.searchsorted(times, times[start] + delay, side="left")))
+        if switch < end:
+            state = not state
+            changes.append((switch, state))
+            i = switch + 1
+        else:
+            i = end
+
+    # build status array from changes
+    states = np.zeros(n, dtype=bool)
+    for (idx, value), (next_idx, _) in zip(changes, changes[1:] + [(n, None)]):
+        states[idx:next_idx] = value
+    return states
+
+
+def _evaluate(eva, sensor: Optional[Sensor], times: np.ndarray, values: np.ndarray, good: Optional[bool]) -> np.ndarray:
+    """Evaluates an evaluator at all grid points for a given status, at once if it supports it, otherwise one by one
+    with the latest value, like evaluate_sensors() does.
+
+    Args:
+        eva: Evaluator to use.
+        sensor: Sensor to pass to evaluators without evaluate().
+        times: UNIX timestamps of evaluation grid.
+        values: Value of sensor at each grid point, NaN for missing.
+        good: Current status of sensor.
+
+    Returns:
+        Boolean array with results of evaluation.
+    """
+    if hasattr(eva, "evaluate"):
+        return eva.evaluate(values, np.full(len(values), good_to_float(good)))
+
+    # evaluator only works on the sensor object, so give it one with the status to evaluate for
+    sensor = copy.copy(sensor)
+    sensor.good = good
+    latest = [
+        None if np.isnan(v) else {"time": datetime.fromtimestamp(t, tz=timezone.utc), "value": float(v)}
+        for t, v in zip(times, values)
+    ]
+    return np.array([eva(sensor, value) for value in latest], dtype=bool)
+
+
+def check_evaluator(eva, name: str) -> None:
+    """Checks that an evaluator can be replayed, i.e. that it doesn't read the sensor's value itself.
+
+    Args:
+        eva: Evaluator to check.
+        name: Name of evaluator for the error message.
+
+    Raises:
+        ValueError: If evaluator can't be replayed.
+    """
+    if not hasattr(eva, "evaluate") and not _takes_value(eva):
+        raise ValueError("Evaluator %s reads the latest value itself and can't be replayed." % name)
+
+
+def replay_sensor(
+    times: np.ndarray,
+    values: np.ndarray,
+    evaluators: list,
+    delay_good: float = 0.0,
+    delay_bad: float = 0.0,
+    sensor: Optional[Sensor] = None,
+) -> np.ndarray:
+    """Replays evaluation of a single sensor.
+
+    Args:
+        times: UNIX timestamps of evaluation grid.
+        values: Value of sensor at each grid point, NaN for missing.
+        evaluators: Evaluator objects, which either implement evaluate() or take the sensor and its latest value.
+        delay_good: Delay in seconds before switching to good.
+        delay_bad: Delay in seconds before switching to bad.
+        sensor: Sensor to pass to evaluators without evaluate().
+
+    Returns:
+        Boolean status at each grid point.
+    """
+
+    # evaluate for both possible states, and the unknown one
+    if_good = np.ones(len(values), dtype=bool)
+    if_bad = np.ones(len(values), dtype=bool)
+    first = True
+    for eva in evaluators:
+        if_good &= _evaluate(eva, sensor, times, values, True)
+        if_bad &= _evaluate(eva, sensor, times, values, False)
+        first &= bool(_evaluate(eva, sensor, times[:1], values[:1], None)[0]) if len(values) > 0 else True
+
+    # apply delays
+    return run_state_machine(times, if_good, if_bad, first, delay_good, delay_bad)
+
+
+def replay(
+    sensors: List[Sensor],
+    start: datetime,
+    end: datetime,
+    step: float = 10.0,
+    kwargs: Optional[Dict[str, str]] = None,
+    delay_good: Optional[float] = None,
+    delay_bad: Optional[float] = None,
+) -> ReplayResult:
+    """Replays evaluation of sensors over a time range with historical values from Influx.
+
+    Args:
+        sensors: Sensors to replay, sensors without evaluators are ignored.
+        start: Start of time range.
+        end: End of time range.
+        step: Distance in seconds between evaluations.
+        kwargs: Replaces kwargs of evaluators, given as JSON strings by evaluator name.
+        delay_good: Replaces delay_good of all sensors.
+        delay_bad: Replaces delay_bad of all sensors.
+
+    Returns:
+        Result of replay.
+
+    Raises:
+        ValueError: If an evaluator can't be replayed.
+    """
+    # create evaluators of all sensors with replaced kwargs first, so that we fail before fetching anything
+    replayed = []
+    for sensor in sensors:
+        objects = []
+        for evaluator in sensor.evaluators.all():
+            if kwargs is not None and evaluator.name in kwargs:
+                evaluator.kwargs = kwargs[evaluator.name]
+            eva = create_evaluator(evaluator)
+            check_evaluator(eva, evaluator.name)
+            objects.append(eva)
+        if len(objects) > 0:
+            replayed.append((sensor, objects))
+
+    # fetch values and replay
+    grid = np.arange(start.timestamp(), end.timestamp(), step)
+    states: Dict[Sensor, np.ndarray] = {}
+    for sensor, objects in replayed:
+        log.info("Replaying %s...", sensor)
+        times, values = read_sensor_series(sensor, start, end)
+        states[sensor] = replay_sensor(
+            grid,
+            resample(times, values, grid),
+            objects,
+            sensor.delay_good if delay_good is None else delay_good,
+            sensor.delay_bad if delay_bad is None else delay_bad,
+            sensor=sensor,
+        )
+
+    # weather is good, if no sensor is bad
+    good = np.ones(len(grid), dtype=bool)
+    for s in states.values():
+        good &= s
+    return ReplayResult(grid, states, good)
+
+
+__all__ = ["ReplayResult", "check_evaluator", "replay", "replay_sensor", "resample", "run_state_machine"]
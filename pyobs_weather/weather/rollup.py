@@ -0,0 +1,196 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional, Tuple
+
+from influxdb_client.rest import ApiException
+
+from pyobs_weather.settings import (
+    INFLUXDB_BUCKET,
+    INFLUXDB_BUCKET_1D,
+    INFLUXDB_BUCKET_1H,
+    INFLUXDB_BUCKET_5MIN,
+    INFLUXDB_ORG,
+    ROLLUP,
+    ROLLUP_BACKFILL,
+    ROLLUP_DELAY,
+)
+from pyobs_weather.weather.influx import get_client
+from pyobs_weather.weather.models import RollupWatermark
+
+log = logging.getLogger(__name__)
+
+
+class Resolution(NamedTuple):
+    """A resolution for rollups."""
+
+    name: str
+    seconds: int
+    bucket: str
+
+
+# all resolutions, each rolled up from the one before, the first one from raw data
+RESOLUTIONS = [
+    Resolution("5m", 300, INFLUXDB_BUCKET_5MIN),
+    Resolution("1h", 3600, INFLUXDB_BUCKET_1H),
+    Resolution("1d", 86400, INFLUXDB_BUCKET_1D),
+]
+
+# number of windows aggregated with each query
+CHUNK = 288
+
+# how source values are aggregated for each aggregation type in coarser resolutions
+AGGREGATES = {"mean": "mean", "min": "min", "max": "max", "count": "sum"}
+
+
+def _floor(time: datetime, seconds: int) -> datetime:
+    """Round time down to a multiple of the given number of seconds."""
+    ts = time.timestamp()
+    return datetime.fromtimestamp(ts - ts % seconds, tz=timezone.utc)
+
+
+def _ceil(time: datetime, seconds: int) -> datetime:
+    """Round time up to a multiple of the given number of seconds."""
+    floor = _floor(time, seconds)
+    return floor if floor == time else floor + timedelta(seconds=seconds)
+
+
+def _flux_time(time: datetime) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _raw_query(res: Resolution, start: datetime, end: datetime) -> str:
+    """Query for rolling up raw data, with numeric and boolean fields converted to float."""
+    streams = [
+        f"data |> aggregateWindow(every: {res.name}, fn: {fn}, createEmpty: false)"
+        f' |> toFloat() |> set(key: "agg_type", value: "{fn}")'
+        for fn in ("mean", "min", "max", "count")
+    ]
+    return f"""
+        import "types"
+        data = from(bucket:"{INFLUXDB_BUCKET}")
+            |> range(start: {_flux_time(start)}, stop: {_flux_time(end)})
+            |> filter(fn:(r) => types.isNumeric(v: r._value) or types.isType(v: r._value, type: "bool"))
+            |> toFloat()
+        union(tables: [{", ".join(streams)}])
+            |> to(bucket: "{res.bucket}", org: "{INFLUXDB_ORG}")
+            |> group()
+            |> count()
+        """
+
+
+def _rollup_query(res: Resolution, source: Resolution, start: datetime, end: datetime) -> str:
+    """Query for rolling up data from a finer resolution.
+
+    Source values are stamped with the end of their window, so the range is shifted by one source window, and the
+    results are shifted back, so that each new window gets exactly the source windows within it.
+    """
+    shift = f"{source.seconds}s"
+    streams = [
+        f'data |> filter(fn:(r) => r.agg_type == "{agg_type}")'
+        f" |> aggregateWindow(every: {res.name}, offset: {shift}, fn: {fn}, createEmpty: false)"
+        for agg_type, fn in AGGREGATES.items()
+    ]
+    return f"""
+        data = from(bucket:"{source.bucket}")
+            |> range(start: {_flux_time(start + timedelta(seconds=source.seconds))},
+                     stop: {_flux_time(end + timedelta(seconds=source.seconds))})
+        union(tables: [{", ".join(streams)}])
+            |> timeShift(duration: -{shift})
+            |> to(bucket: "{res.bucket}", org: "{INFLUXDB_ORG}")
+            |> group()
+            |> count()
+        """
+
+
+def rollup(index: int, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Rolls up all complete windows since the last run for a resolution.
+
+    Args:
+        index: Index of resolution in RESOLUTIONS.
+        now: Current time, defaults to now.
+
+    Returns:
+        New watermark, or None, if nothing has been rolled up yet.
+    """
+    res = RESOLUTIONS[index]
+    source = RESOLUTIONS[index - 1] if index > 0 else None
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    # end of last complete window, which must also be complete in source
+    end = _floor(now - timedelta(seconds=ROLLUP_DELAY), res.seconds)
+    if source is not None:
+        source_mark = RollupWatermark.objects.filter(resolution=source.name).first()
+        if source_mark is None:
+            return None
+        end = min(end, _floor(source_mark.time, res.seconds))
+
+    # get watermark, or start with backfill
+    mark = RollupWatermark.objects.filter(resolution=res.name).first()
+    if mark is None:
+        start = _floor(now - timedelta(days=ROLLUP_BACKFILL), res.seconds)
+        if source is not None:
+            start = max(start, _ceil(source_mark.start, res.seconds))
+        mark = RollupWatermark(resolution=res.name, start=start, time=start)
+
+    # process in chunks and move watermark after each one
+    client = get_client()
+    chunk = timedelta(seconds=res.seconds * CHUNK)
+    while mark.time < end:
+        stop = min(mark.time + chunk, end)
+        log.info("Rolling up %s from %s to %s...", res.name, mark.time, stop)
+        query = _raw_query(res, mark.time, stop) if source is None else _rollup_query(res, source, mark.time, stop)
+        client.query_api().query(org=INFLUXDB_ORG, query=query)
+        mark.time = stop
+        mark.save()
+    return mark.time
+
+
+def run_rollups(now: Optional[datetime] = None) -> None:
+    """Runs rollups for all resolutions, from finest to coarsest."""
+    for index in range(len(RESOLUTIONS)):
+        rollup(index, now)
+
+
+def choose_resolution(start: datetime, end: datetime, max_points: int) -> Tuple[str, int]:
+    """Chooses the coarsest resolution that covers a time range and still gives at least max_points values.
+
+    Args:
+        start: Start of time range.
+        end: End of time range.
+        max_points: Number of values wanted.
+
+    Returns:
+        Bucket and resolution in seconds.
+    """
+    seconds = (end - start).total_seconds()
+    bucket, resolution = RESOLUTIONS[0].bucket, RESOLUTIONS[0].seconds
+    if not ROLLUP:
+        return bucket, resolution
+
+    # check all coarser resolutions
+    start = start if start.tzinfo is not None else start.replace(tzinfo=timezone.utc)
+    marks = {m.resolution: m for m in RollupWatermark.objects.all()}
+    for res in RESOLUTIONS[1:]:
+        mark = marks.get(res.name)
+        if seconds / res.seconds < max_points or mark is None or mark.start > start:
+            break
+        bucket, resolution = res.bucket, res.seconds
+    return bucket, resolution
+
+
+def ensure_buckets() -> None:
+    """Creates buckets for all resolutions, if they don't exist and the token is allowed to."""
+    api = get_client().buckets_api()
+    for res in RESOLUTIONS:
+        try:
+            if api.find_bucket_by_name(res.bucket) is None:
+                log.info("Creating bucket %s...", res.bucket)
+                api.create_bucket(bucket_name=res.bucket, org=INFLUXDB_ORG)
+        except ApiException as e:
+            if e.status not in (401, 403):
+                raise
+            log.warning("Not allowed to create bucket %s, please create it manually.", res.bucket)
+
+
+__all__ = ["RESOLUTIONS", "Resolution", "rollup", "run_rollups", "choose_resolution", "ensure_buckets"]
@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# sent after new values for a station have been written, with "station" and "rows" as list of (time, values) tuples
+sensors_updated = Signal()
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+
+from pyobs_weather.settings import API_SNAPSHOT_TTL, INFLUXDB_MEASUREMENT_AVERAGE
+from pyobs_weather.weather.events import publish
+from pyobs_weather.weather.influx import read_latest_values
+from pyobs_weather.weather.models import Sensor, Station
+from pyobs_weather.weather.utils import is_shared_cache
+
+log = logging.getLogger(__name__)
+
+
+def build_current() -> Optional[dict]:
+    """Builds current weather from the average station and the status of all sensors.
+
+    Returns:
+        Dict with time, good and sensors, or None, if there is no average station.
+    """
+
+    # get average station
+    station = Station.objects.filter(code=INFLUXDB_MEASUREMENT_AVERAGE).first()
+    if station is None:
+        return None
+
+    # get all sensors and latest values of average sensors
+    all_sensors = list(Sensor.objects.filter(active=True, station__active=True).select_related("station", "type"))
+    values = read_latest_values([s for s in all_sensors if s.station == station])
+
+    # loop all sensors
+    sensors = {}
+    time = None
+    for sensor in all_sensors:
+        # create, if necessary
+        if sensor.type.code not in sensors:
+            sensors[sensor.type.code] = {"good": None, "value": None}
+
+        # set it
+        if sensor.good is not None:
+            # if current value is None, set it with new one, otherwise and it
+            if sensors[sensor.type.code]["good"] is None:
+                sensors[sensor.type.code]["good"] = sensor.good
+            else:
+                sensors[sensor.type.code]["good"] = sensor.good and sensors[sensor.type.code]["good"]
+
+        # is average sensor?
+        if sensor.station == station:
+            # get latest value
+            value = values[sensor]
+
+            # set it
+            sensors[sensor.type.code]["value"] = None if value is None else value["value"]
+            if value is not None and "time" in value:
+                time = value["time"]
+
+    # totally good?
+    good = True
+    for sensor in sensors.values():
+        if sensor["good"] is not None:
+            good = good and sensor["good"]
+
+    # return all
+    return {"time": time, "good": good, "sensors": sensors}
+
+
+def build_sensors() -> list:
+    """Builds list of all active sensors with their status and latest value.
+
+    Returns:
+        List of dicts, one per sensor.
+    """
+
+    # get all sensors
+    data = Sensor.objects.filter(station__active=True, active=True)
+
+    # add station and type
+    data = data.annotate(station_code=F("station__code"), station_name=F("station__name"))
+    data = data.annotate(type_code=F("type__code"), type_name=F("type__name"), unit=F("type__unit"))
+
+    # order
+    data = data.order_by("station_name", "type_name")
+
+    # get values
+    values = list(data.values())
+
+    # add latest value
+    latest = {sensor.id: val for sensor, val in read_latest_values(data.select_related("station", "type")).items()}
+    for value in values:
+        val = latest.get(value["id"])
+        value["value"] = None if val is None else val["value"]
+    return values
+
+
+SNAPSHOTS: Dict[str, Callable] = {
+    "current": build_current,
+    "sensors": build_sensors,
+}
+
+
+def refresh_snapshot(name: str) -> Optional[Tuple[bytes, str]]:
+    """Rebuilds a snapshot and stores it in the cache.
+
+    Args:
+        name: Name of snapshot, one of those in SNAPSHOTS.
+
+    Returns:
+        Tuple of JSON body and its ETag, or None, if nothing could be built.
+    """
+
+    # build and serialize it
+    data = SNAPSHOTS[name]()
+    if data is None:
+        return None
+    body = json.dumps(data, cls=DjangoJSONEncoder).encode("utf-8")
+
+    # strong ETag from content, so that unchanged snapshots keep their tag
+    snapshot = (body, '"%s"' % hashlib.sha1(body).hexdigest())
+    cache.set("snapshot:%s" % name, snapshot, timeout=API_SNAPSHOT_TTL)
+    return snapshot
+
+
+def refresh_snapshots() -> None:
+    """Rebuilds all snapshots, called after each evaluation cycle."""
+    for name in SNAPSHOTS:
+        try:
+            old = cache.get("snapshot:%s" % name)
+            new = refresh_snapshot(name)
+        except Exception:
+            log.exception("Could not refresh snapshot %s.", name)
+            continue
+
+        # push changed current weather to clients
+        if name == "current" and new is not None and (old is None or old[1] != new[1]):
+            publish("current", json.loads(new[0]))
+
+
+def get_snapshot(name: str) -> Optional[Tuple[bytes, str]]:
+    """Returns a snapshot from the cache, and builds it, if it's missing or expired.
+
+    With a process-local cache, the snapshots refreshed by the Celery worker never reach the web processes, so the
+    snapshot is always built anew.
+
+    Args:
+        name: Name of snapshot, one of those in SNAPSHOTS.
+
+    Returns:
+        Tuple of JSON body and its ETag, or None, if nothing could be built.
+    """
+    snapshot = cache.get("snapshot:%s" % name) if is_shared_cache() else None
+    return refresh_snapshot(name) if snapshot is None else snapshot
+
+
+__all__ = ["build_current", "build_sensors", "get_snapshot", "refresh_snapshot", "refresh_snapshots"]
@@ -4,7 +4,9 @@ import numpy as np
 import pytz
 
 from .station import WeatherStation
-from ..influx import write_sensor_value, read_sensor_value
+from ..averaging import aggregate
+from ..evaluators.base import value_to_float
+from ..influx import read_latest_values
 from ...settings import INFLUXDB_MEASUREMENT_AVERAGE
 
 log = logging.getLogger(__name__)
@@ -20,6 +22,9 @@ class Average(WeatherStation):
     :ref:`Valid <pyobs_weather.weather.evaluators.Valid>` evaluators attached to them.
     """
 
+    # sensor types might be deleted while averaging
+    ignore_unknown_sensors = True
+
     def create_sensors(self):
         """Entry point for creating sensors for this station.
 
@@ -29,43 +34,59 @@ class Average(WeatherStation):
     def update(self):
         """Entry point for updating sensor values for this station.
 
-        This method loops all sensor types and fetches all related sensors from all stations and calculates
-        averages of the latest values, which it stores in sensors of the same type. Values from other stations are
-        only used if they are not older than 10 minutes.
+        This method fetches the latest values of all sensors from all stations at once and calculates averages for
+        each sensor type, which it stores in sensors of the same type. Values from other stations are only used if
+        they are not older than 10 minutes, and they are weighted with the weight of their station.
+
+        The method for averaging is defined by the average_mode of each sensor type, e.g. a circular mean for wind
+        directions.
         """
-        from pyobs_weather.weather.models import SensorType, Sensor, Value
+        from pyobs_weather.weather.models import SensorType, Sensor
 
         log.info("Updating average...")
 
         # get now
         now = datetime.utcnow().astimezone(pytz.UTC)
 
-        # loop all sensor types
-        for sensor_type in SensorType.objects.all():
-            values = []
-
-            # loop all sensors of that type
-            for sensor in Sensor.objects.filter(type=sensor_type, average=True, station__active=True, active=True):
-                # skip average
-                if sensor.station.code == INFLUXDB_MEASUREMENT_AVERAGE:
-                    continue
-
-                # get latest value of that sensor
-                value = read_sensor_value(sensor)
-
-                # valid?
-                if value is not None and value["value"] is not None:
-                    # and not too old?
-                    if value["time"] > now - timedelta(minutes=10):
-                        # add it
-                        values.append(value["value"])
-
-            # calculate average
-            avg = float(np.mean(values)) if values else None
-
-            # and store it
-            sensor = self._add_sensor(sensor_type.code)
-            write_sensor_value(sensor=sensor, time=now, value=avg, station=INFLUXDB_MEASUREMENT_AVERAGE)
+        # fetch latest values of all sensors from all other stations at once
+        sensors = (
+            Sensor.objects.filter(average=True, station__active=True, active=True)
+            .exclude(station__code=INFLUXDB_MEASUREMENT_AVERAGE)
+            .select_related("station", "type")
+        )
+        latest = read_latest_values(sensors)
+
+        # only use values that are not too old, non-numeric ones become NaN and are ignored in their group
+        latest = {
+            sensor: value_to_float(value)
+            for sensor, value in latest.items()
+            if value is not None and value["time"] > now - timedelta(minutes=10)
+        }
+
+        # get sensor types and index of type for each value
+        sensor_types = list(SensorType.objects.all())
+        index = {sensor_type.id: i for i, sensor_type in enumerate(sensor_types)}
+        groups = np.array([index[sensor.type_id] for sensor in latest.keys()], dtype=int)
+        values = np.array(list(latest.values()), dtype=float)
+        weights = np.array([sensor.station.weight for sensor in latest.keys()], dtype=float)
+
+        # calculate averages
+        averages = aggregate(groups, values, weights, [sensor_type.average_mode for sensor_type in sensor_types])
+
+        # make sure that all sensors exist
+        existing = self._get_sensors()
+        for sensor_type in sensor_types:
+            if sensor_type.code not in existing:
+                self._add_sensor(sensor_type.code)
+
+        # and store them all at once
+        self._add_values(
+            now,
+            [
+                (sensor_type.code, None if np.isnan(avg) else float(avg))
+                for sensor_type, avg in zip(sensor_types, averages)
+            ],
+        )
 
 
 __all__ = ["Average"]
@@ -1,7 +1,9 @@
 import logging
 import os
+from datetime import datetime
+from typing import BinaryIO, List, Optional, Tuple
+
 import pytz
-from astropy.time import Time
 import dateutil.parser
 
 from pyobs_weather.weather.models import Sensor, SensorType
@@ -9,6 +11,12 @@ from .station import WeatherStation
 
 log = logging.getLogger(__name__)
 
+# maximum number of bytes read with each update
+MAX_READ = 16 * 1024 * 1024
+
+# number of bytes read from end of file to find last line, if no position has been stored
+TAIL = 64 * 1024
+
 
 class CSV(WeatherStation):
     """The CSV weather station reads current weather information from a CSV file."""
@@ -51,6 +59,7 @@ class CSV(WeatherStation):
         self.timezone = None if timezone is None else pytz.timezone(timezone)
         self.columns = columns
         self.separator = separator
+        self._file: Optional[BinaryIO] = None
 
     def create_sensors(self):
         """Entry point for creating sensors for this station.
@@ -63,7 +72,7 @@ class CSV(WeatherStation):
                 # get or create sensor type
                 sensor_type, _ = SensorType.objects.get_or_create(code=typ['code'], name=typ['name'], unit=typ['unit'])
             else:
-                sensor_type = self._add_sensor(typ['code'])
+                sensor_type = self._add_sensor(typ['code']).type
 
             # get or create sensor
             Sensor.objects.get_or_create(station=self._station, type=sensor_type)
@@ -71,17 +80,44 @@ class CSV(WeatherStation):
     def update(self):
         """Entry point for updating sensor values for this station.
 
-        This method reads the last line of the given file and interprets it."""
-        log.info('Updating Database station %s...' % self._station.code)
+        This method reads all lines that have been appended to the given file since the last update and stores
+        all of them at once. The position in the file is stored in the station's state, so nothing is lost or
+        read twice across restarts."""
+        log.info('Updating CSV station %s...' % self._station.code)
 
-        # read last line of file
-        line = self._read_last_line(self.filename)
-
-        # nothing?
-        if line is None:
-            logging.error('Could not read line from CSV file.')
+        # read new lines
+        try:
+            lines, state = self._read_new_lines()
+        except OSError as e:
+            log.error('Could not read from CSV file %s: %s', self.filename, e)
             return
 
+        # parse them
+        rows = []
+        for line in lines:
+            if line.strip() == '':
+                continue
+            try:
+                rows.append(self._parse_line(line))
+            except (ValueError, IndexError, OverflowError):
+                log.warning('Could not parse line in CSV file %s: %s', self.filename, line.strip())
+
+        # store values and remember position, only after they have been written
+        if len(rows) > 0:
+            self._add_rows(rows)
+        if state != self._load_state():
+            self._save_state(state)
+
+    def _parse_line(self, line: str) -> Tuple[datetime, List[Tuple[str, float]]]:
+        """Parses a single line of the CSV file.
+
+        Args:
+            line: Line to parse.
+
+        Returns:
+            Time in UTC and list of (sensor code, value) tuples.
+        """
+
         # split it
         fields = line.split(self.separator)
 
@@ -99,6 +135,7 @@ class CSV(WeatherStation):
                 time = time.astimezone(pytz.utc)
 
         # other values
+        values = []
         for col, cfg in self.columns.items():
             # get column and value
             value = float(fields[int(col)])
@@ -114,30 +151,84 @@ class CSV(WeatherStation):
                 value = 0 if cfg['bool_false'] == value else 1
 
             # add value
-            self._add_value(cfg['code'], time, value)
+            values.append((cfg['code'], value))
+        return time, values
 
-    @staticmethod
-    def _read_last_line(filename: str) -> str:
-        """Reads the last line from the given file.
+    def _read_new_lines(self) -> Tuple[List[str], dict]:
+        """Reads all complete lines that have been appended since the last call.
+
+        Returns:
+            List of new lines and new state with inode of file and offset behind last complete line.
+        """
+        state = self._load_state()
+        stat = os.stat(self.filename)
+        lines = []
+
+        # file has been replaced, e.g. by log rotation? then read what's left in the old one, if still open
+        if self._file is not None and os.fstat(self._file.fileno()).st_ino != stat.st_ino:
+            if os.fstat(self._file.fileno()).st_ino == state.get('inode'):
+                lines, _ = self._read_lines(self._file, state['offset'])
+            self._file.close()
+            self._file = None
+
+        # keep file open between updates
+        if self._file is None:
+            self._file = open(self.filename, 'rb')
+
+        # where to start?
+        if state.get('inode') != stat.st_ino:
+            # new file after rotation from start, otherwise with last line like on first update
+            offset = 0 if 'inode' in state else self._last_line_offset(self._file, stat.st_size)
+        elif stat.st_size < state['offset']:
+            log.warning('CSV file %s has been truncated, reading from start.', self.filename)
+            offset = 0
+        else:
+            offset = state['offset']
+
+        # read lines
+        new_lines, offset = self._read_lines(self._file, offset)
+        return lines + new_lines, {'inode': stat.st_ino, 'offset': offset}
+
+    def _read_lines(self, f: BinaryIO, offset: int) -> Tuple[List[str], int]:
+        """Reads all complete lines from a file with a single read, starting at the given offset.
 
         Args:
-            filename: Name of file to read from.
+            f: File to read from.
+            offset: Offset to start at.
 
         Returns:
-            Last line in given file.
+            List of lines and offset behind last complete line.
         """
+        f.seek(offset)
+        data = f.read(MAX_READ)
+
+        # only use complete lines, the rest is read next time
+        end = data.rfind(b'\n')
+        if end < 0:
+            if len(data) == MAX_READ:
+                log.warning('Skipping line longer than %d bytes in CSV file %s.', MAX_READ, self.filename)
+                return [], offset + len(data)
+            return [], offset
+        return data[:end + 1].decode(errors='replace').splitlines(), offset + end + 1
 
-        # open file
-        with open(filename, 'rb') as f:
-            # seek end
-            f.seek(-2, os.SEEK_END)
+    @staticmethod
+    def _last_line_offset(f: BinaryIO, size: int) -> int:
+        """Finds start of last complete line in a file by reading its end.
 
-            # find last line break
-            while f.read(1) != b'\n':
-                f.seek(-2, os.SEEK_CUR)
+        Args:
+            f: File to read from.
+            size: Size of file.
 
-            # return lone
-            return f.readline().decode()
+        Returns:
+            Offset of last complete line.
+        """
+        start = max(0, size - TAIL)
+        f.seek(start)
+        data = f.read(size - start)
+        end = data.rfind(b'\n')
+        if end < 0:
+            return start
+        return start + data.rfind(b'\n', 0, end) + 1
 
 
 __all__ = ['CSV']
@@ -25,11 +25,13 @@ class Dummy(WeatherStation):
         log.info('Updating Dummy station %s...' % self._station.code)
         time = datetime.datetime.now()
 
-        self._add_value('temp', time, round(40*random(),1))
-        self._add_value('humid', time, round(100*random(),1))
-        self._add_value('winddir', time, round(360*random(),1))
-        self._add_value('windspeed', time, round(40*random(),1))
-        self._add_value('press', time, 970.0 + round(100*random(),1))
-        self._add_value('rain', time, randint(0,1))
+        self._add_values(time, [
+            ('temp', round(40*random(),1)),
+            ('humid', round(100*random(),1)),
+            ('winddir', round(360*random(),1)),
+            ('windspeed', round(40*random(),1)),
+            ('press', 970.0 + round(100*random(),1)),
+            ('rain', randint(0,1)),
+        ])
 
 __all__ = ['Dummy']
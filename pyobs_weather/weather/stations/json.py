@@ -1,6 +1,5 @@
 import logging
 import pytz
-import requests
 import dateutil.parser
 
 from pyobs_weather.weather.models import Sensor, SensorType
@@ -74,7 +73,10 @@ class JSON(WeatherStation):
         log.info('Updating Database station %s...' % self._station.code)
 
         # read data
-        res = requests.get(self.url)
+        res = self._fetch(self.url)
+        if res is None:
+            # unchanged since last poll
+            return
         if res.status_code != 200:
             log.warning('Could not fetch JSON.')
             return
@@ -94,9 +96,7 @@ class JSON(WeatherStation):
                 time = time.astimezone(pytz.utc)
 
         # other values
-        for field, cfg in self.fields.items():
-            # add value
-            self._add_value(cfg['code'], time, weather[field])
+        self._add_values(time, [(cfg['code'], weather[field]) for field, cfg in self.fields.items()])
 
 
 __all__ = ['JSON']
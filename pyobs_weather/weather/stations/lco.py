@@ -1,7 +1,6 @@
 import logging
 import pytz
 from astropy.time import Time
-import requests
 
 from .station import WeatherStation
 
@@ -44,7 +43,10 @@ class LCO(WeatherStation):
         log.info("Updating LCO station %s..." % self._station.code)
 
         # do request
-        r = requests.get(self._url)
+        r = self._fetch(self._url)
+        if r is None:
+            # unchanged since last poll
+            return
 
         # check code
         if r.status_code != 200:
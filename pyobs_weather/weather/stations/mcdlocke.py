@@ -2,7 +2,6 @@ import logging
 from datetime import datetime
 import pytz
 from astropy.time import Time
-import requests
 
 from .station import WeatherStation
 
@@ -48,7 +47,10 @@ class McDonaldLocke(WeatherStation):
         log.info('Updating McDonald Locke station %s...' % self._station.code)
 
         # do request
-        r = requests.get('http://weather.as.utexas.edu/latest_5min.dat')
+        r = self._fetch('http://weather.as.utexas.edu/latest_5min.dat')
+        if r is None:
+            # unchanged since last poll
+            return
 
         # check code
         if r.status_code != 200:
@@ -141,13 +143,15 @@ class McDonaldLocke(WeatherStation):
         rain = s[8] == 'Y'
 
         # got all values, now add them
-        self._add_value('temp', time, temp)
-        self._add_value('humid', time, humid)
-        self._add_value('press', time, press)
-        self._add_value('winddir', time, wind_dir)
-        self._add_value('windspeed', time, wind_speed)
-        self._add_value('particles', time, particles)
-        self._add_value('rain', time, rain)
+        self._add_values(time, [
+            ('temp', temp),
+            ('humid', humid),
+            ('press', press),
+            ('winddir', wind_dir),
+            ('windspeed', wind_speed),
+            ('particles', particles),
+            ('rain', rain),
+        ])
 
 
 __all__ = ['McDonaldLocke']
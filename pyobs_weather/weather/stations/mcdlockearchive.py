@@ -1,14 +1,27 @@
 import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+import dateutil.parser
 import pytz
-from astropy.time import Time
 import requests
+from astropy.time import Time
 
 from .station import WeatherStation
 from ..models import SensorType, Sensor
+from ...settings import STATION_HTTP_TIMEOUT
 
 log = logging.getLogger(__name__)
 
+# length of window to request in seconds, if nothing has been written yet
+WINDOW = 600
+
+# maximum length of window in seconds to catch up after an outage, longer gaps need a backfill
+MAX_WINDOW = 86400
+
 
 class McDonaldLockeArchive(WeatherStation):
     """The McDonaldLockeArchive weather station reads current weather information from the Mt. Lock weather archive
@@ -47,12 +60,99 @@ class McDonaldLockeArchive(WeatherStation):
     def update(self):
         """Entry point for updating sensor values for this station.
 
-        This method reads the Mt. Locke weather archive and extracts the latest values."""
+        This method reads all rows since the last written one from the Mt. Locke weather archive and stores them
+        with a single write."""
         log.info('Updating McDonald Locke Archive %s...' % self._station.code)
 
-        # create payload for request
+        # continue after last written row, but never request more than MAX_WINDOW
+        state = self._load_state()
+        last = dateutil.parser.isoparse(state['time']) if 'time' in state else None
         endtime = time.time()
-        starttime = endtime - 600
+        starttime = endtime - WINDOW
+        if last is not None:
+            if endtime - last.timestamp() > MAX_WINDOW:
+                log.warning('Last row for %s is older than %ds, use backfill to fill the gap.',
+                            self._station.code, MAX_WINDOW)
+            else:
+                starttime = min(starttime, last.timestamp())
+
+        # fetch rows and skip those already written
+        rows = self._fetch_rows(starttime, endtime)
+        if rows is None:
+            return
+        if last is not None:
+            rows = [(t, values) for t, values in rows if t > last]
+        if len(rows) == 0:
+            return
+
+        # store values and remember last time
+        self._add_rows(rows)
+        self._save_state({**state, 'time': rows[-1][0].isoformat()})
+
+    def backfill(self, start: datetime, end: datetime, chunk: timedelta = timedelta(hours=6),
+                 workers: int = 4) -> int:
+        """Fetches a past time range in chunks, of which several are requested in parallel, and writes them.
+
+        The values are written without triggering an evaluation, and the position of update() is not changed.
+
+        Args:
+            start: Start of time range.
+            end: End of time range.
+            chunk: Length of time range per request.
+            workers: Number of parallel requests.
+
+        Returns:
+            Number of rows written.
+        """
+
+        # each worker thread gets its own session, since sessions and fetch statistics are not thread-safe
+        local = threading.local()
+        sessions = []
+
+        def fetch(c: Tuple[datetime, datetime]):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                sessions.append(local.session)
+            return self._fetch_rows(c[0].timestamp(), c[1].timestamp(), session=local.session)
+
+        # only requests run in threads, rows are written here in order of chunks
+        chunks = list(self._chunks(start, end, chunk))
+        count = 0
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for (s, e), rows in zip(chunks, executor.map(fetch, chunks)):
+                    # chunks overlap at their boundaries
+                    rows = [(t, values) for t, values in rows or [] if s <= t < e or t == end]
+                    if len(rows) > 0:
+                        self._add_rows(rows, notify=False)
+                        count += len(rows)
+                    log.info('Wrote %d rows for %s from %s to %s.', len(rows), self._station.code, s, e)
+        finally:
+            for session in sessions:
+                session.close()
+        return count
+
+    @staticmethod
+    def _chunks(start: datetime, end: datetime, chunk: timedelta) -> Iterator[Tuple[datetime, datetime]]:
+        """Splits a time range into chunks."""
+        while start < end:
+            yield start, min(start + chunk, end)
+            start += chunk
+
+    def _fetch_rows(self, starttime: float, endtime: float, session: Optional[requests.Session] = None) \
+            -> Optional[List[Tuple[datetime, List[Tuple[str, float]]]]]:
+        """Requests a time range from the archive.
+
+        Args:
+            starttime: Start of range as UNIX timestamp.
+            endtime: End of range as UNIX timestamp.
+            session: Session to use instead of the pooled one of this process, e.g. in other threads.
+
+        Returns:
+            List of (time, values) tuples ordered by time, or None, if request failed.
+        """
+
+        # create payload for request
         payload = {
             'starttime': starttime,
             'endtime': endtime,
@@ -62,44 +162,46 @@ class McDonaldLockeArchive(WeatherStation):
         }
 
         # do request
-        r = requests.post("http://weather.as.utexas.edu/cgi-bin/weather/weather-data.pl", data=payload)
+        if session is None:
+            r = self._fetch(self.url, method='POST', data=payload)
+        else:
+            r = session.post(self.url, data=payload, timeout=STATION_HTTP_TIMEOUT)
 
         # check code
-        if r.status_code != 200:
-            logging.error('Could not connect to McDonald weather archive.')
-            return
+        if r is None or r.status_code != 200:
+            log.error('Could not connect to McDonald weather archive.')
+            return None
 
         # split lines
         lines = r.content.decode('utf-8').strip().split('\n')
+        if len(lines) < 2:
+            return []
 
-        # get columns and replace first '-' in name by '+'
+        # get columns and replace first '-' in name by '+', and get sensor codes
         columns = lines[0].split(',')
+        codes = [None] * len(columns)
         for i in range(1, len(columns)):
-            columns[i] = columns[i].replace('-', '+', 1)
-
-        # loop lines and store latest value
-        values = {}
-        for line in lines[1:]:
-            # split
-            s = line.split(',')
-
-            # get time
-            t = Time(s[0]).to_datetime(pytz.UTC)
-
-            # loop columns
-            for i, col in enumerate(columns[1:], 1):
-                # got something?
-                if len(s[i].strip()) > 0:
-                    # store it
-                    values[col] = (t, float(s[i]))
-
-        # store values
-        for field, (t, val) in values.items():
-            # get code
-            code = self.fields[field]['code']
-
-            # add value
-            self._add_value(code, t, val)
+            field = columns[i].strip().replace('-', '+', 1)
+            if field in self.fields:
+                codes[i] = self.fields[field]['code']
+
+        # parse all times at once
+        lines = [line.split(',') for line in lines[1:] if len(line.strip()) > 0]
+        if len(lines) == 0:
+            return []
+        times = Time([s[0].strip() for s in lines]).to_datetime(pytz.UTC)
+
+        # build a row for every line
+        rows = []
+        for t, s in zip(times, lines):
+            values = [(codes[i], float(v)) for i, v in enumerate(s[1:len(codes)], 1)
+                      if codes[i] is not None and len(v.strip()) > 0]
+            if len(values) > 0:
+                rows.append((t, values))
+
+        # sort by time
+        rows.sort(key=lambda row: row[0])
+        return rows
 
 
 __all__ = ['McDonaldLockeArchive']
@@ -61,10 +61,12 @@ class McDonaldTelnet(WeatherStation):
             values[s[0].strip()] = float(s[1])
 
         # add values
-        self._add_value('temp', time, (values['Ambient'] - 32) / 1.8)
-        self._add_value('skytemp', time, values['Sky-ambient'] / 1.8)
-        self._add_value('windspeed', time, values['Wind Speed'] / 1.609344)
-        self._add_value('rain', time, values['Rain'])
+        self._add_values(time, [
+            ('temp', (values['Ambient'] - 32) / 1.8),
+            ('skytemp', values['Sky-ambient'] / 1.8),
+            ('windspeed', values['Wind Speed'] / 1.609344),
+            ('rain', values['Rain']),
+        ])
 
 
 __all__ = ['McDonaldTelnet']
@@ -2,7 +2,6 @@ import logging
 import re
 import datetime
 import pytz
-import requests
 
 from .station import WeatherStation
 
@@ -68,7 +67,10 @@ class McDonaldVt100(WeatherStation):
         log.info('Updating McDonald Locke station %s...' % self._station.code)
 
         # do request
-        r = requests.get('http://prometheus.as.utexas.edu/cgi-bin/weather_vt100')
+        r = self._fetch('http://prometheus.as.utexas.edu/cgi-bin/weather_vt100')
+        if r is None:
+            # unchanged since last poll
+            return
 
         # check code
         if r.status_code != 200:
@@ -151,13 +153,15 @@ class McDonaldVt100(WeatherStation):
         warning |= warn
 
         # got all values, now add them
-        self._add_value('temp', time, temp)
-        self._add_value('humid', time, humid)
-        self._add_value('press', time, press)
-        self._add_value('winddir', time, wind_dir)
-        self._add_value('windspeed', time, wind_speed)
-        self._add_value('particles', time, particles)
-        self._add_value('rain', time, rain)
+        self._add_values(time, [
+            ('temp', temp),
+            ('humid', humid),
+            ('press', press),
+            ('winddir', wind_dir),
+            ('windspeed', wind_speed),
+            ('particles', particles),
+            ('rain', rain),
+        ])
 
 
 __all__ = ['McDonaldVt100']
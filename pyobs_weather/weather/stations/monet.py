@@ -1,7 +1,6 @@
 import logging
 import pytz
 from astropy.time import Time
-import requests
 
 from .station import WeatherStation
 
@@ -66,7 +65,10 @@ class Monet(WeatherStation):
         """Fetch and update latest values."""
 
         # do request
-        r = requests.get(self._url + '?type=current')
+        r = self._fetch(self._url + '?type=current')
+        if r is None:
+            # unchanged since last poll
+            return
 
         # check code
         if r.status_code != 200:
@@ -80,18 +82,23 @@ class Monet(WeatherStation):
         time = Time(weather['time']).to_datetime(pytz.UTC)
 
         # got all values, now add them
-        self._add_value('temp', time, weather['temp'])
-        self._add_value('humid', time, weather['humid'])
-        self._add_value('winddir', time, weather['winddir'])
-        self._add_value('windspeed', time, weather['windspeed'])
-        #self._add_value('press', time, weather['press'])
-        self._add_value('rain', time, weather['rain'])
+        self._add_values(time, [
+            ('temp', weather['temp']),
+            ('humid', weather['humid']),
+            ('winddir', weather['winddir']),
+            ('windspeed', weather['windspeed']),
+            # ('press', weather['press']),
+            ('rain', weather['rain']),
+        ])
 
     def _update_average(self):
         """Fetch and update average values."""
 
         # do request
-        r = requests.get(self._url + '?type=5min')
+        r = self._fetch(self._url + '?type=5min')
+        if r is None:
+            # unchanged since last poll
+            return
 
         # check code
         if r.status_code != 200:
@@ -105,12 +112,14 @@ class Monet(WeatherStation):
         time = Time(weather['time']).to_datetime(pytz.UTC)
 
         # got all values, now add them
-        self._add_value('temp', time, weather['temp']['avg'])
-        self._add_value('humid', time, weather['humid']['avg'])
-        self._add_value('winddir', time, weather['winddir']['avg'])
-        self._add_value('windspeed', time, weather['windspeed']['avg'])
-        #self._add_value('press', time, weather['press']['avg'])
-        self._add_value('rain', time, weather['rain']['max'])
+        self._add_values(time, [
+            ('temp', weather['temp']['avg']),
+            ('humid', weather['humid']['avg']),
+            ('winddir', weather['winddir']['avg']),
+            ('windspeed', weather['windspeed']['avg']),
+            # ('press', weather['press']['avg']),
+            ('rain', weather['rain']['max']),
+        ])
 
 
 __all__ = ['Monet']
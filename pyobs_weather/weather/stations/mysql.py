@@ -1,14 +1,21 @@
 import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
 import MySQLdb
 import pytz
-from astropy.time import Time, TimeDelta
-import astropy.units as u
 
 from pyobs_weather.weather.models import Sensor, SensorType
 from .station import WeatherStation
 
 log = logging.getLogger(__name__)
 
+# maximum number of rows read with a single query
+BATCH_SIZE = 1000
+
+# maximum number of queries per update
+MAX_BATCHES = 10
+
 
 class MySQL(WeatherStation):
     """The MySQL weather station reads current weather information from a MySQL database."""
@@ -66,6 +73,7 @@ class MySQL(WeatherStation):
         self.time = time
         self.time_offset = time_offset
         self.fields = fields
+        self._db = None
 
     def create_sensors(self):
         """Entry point for creating sensors for this station.
@@ -80,7 +88,7 @@ class MySQL(WeatherStation):
                     code=typ["code"], name=typ["name"], unit=typ["unit"]
                 )
             else:
-                sensor_type = self._add_sensor(typ["code"])
+                sensor_type = self._add_sensor(typ["code"]).type
 
             # get or create sensor
             Sensor.objects.get_or_create(station=self._station, type=sensor_type)
@@ -88,37 +96,117 @@ class MySQL(WeatherStation):
     def update(self):
         """Entry point for updating sensor values for this station.
 
-        This method connects to the database and reads the latest values."""
+        This method reads all rows that have been added to the database since the last update, in batches of
+        BATCH_SIZE rows, and stores each batch at once. The time of the last row read and the number of rows read
+        at that time are stored in the station's state, so that rows with the same time are neither skipped nor
+        read twice, if a batch ends between them. On the very first update, only the latest row is read."""
         log.info("Updating Database station %s..." % self._station.code)
 
-        # connect to DB
-        db = MySQLdb.connect(**self.connect)
-
-        # get all columns to query
-        columns = [self.time] + list(self.fields.keys())
+        # get time of last row read and number of rows at that time, which have been read already
+        state = self._load_state()
+        watermark = state.get("time")
+        if watermark is not None:
+            watermark = datetime.fromisoformat(watermark)
+        skip = state.get("skip", 0)
+
+        # get connection
+        try:
+            db = self._get_connection()
+        except MySQLdb.Error as e:
+            log.error("Could not connect to database: %s", e)
+            return
 
-        # build query
-        sql = "SELECT %s FROM %s ORDER BY %s DESC LIMIT 1" % (
-            ",".join(columns),
-            self.table,
-            self.time,
-        )
+        # read batches until all new rows have been read
+        for _ in range(MAX_BATCHES):
+            try:
+                rows = self._query(db, watermark, skip)
+            except MySQLdb.Error as e:
+                log.error("Could not query database: %s", e)
+                self._close()
+                return
+
+            # nothing?
+            if len(rows) == 0:
+                return
+
+            # store values and move watermark, count rows at its time, including those read before
+            self._add_rows([self._parse_row(row) for row in rows])
+            last = rows[-1][0]
+            ties = sum(1 for row in rows if row[0] == last)
+            skip = skip + ties if last == watermark else ties
+            watermark = last
+            self._save_state({"time": watermark.isoformat(), "skip": skip})
+
+            # got all?
+            if len(rows) < BATCH_SIZE:
+                return
+        log.warning("More than %d new rows in database, continuing with next update.", MAX_BATCHES * BATCH_SIZE)
+
+    def _get_connection(self):
+        """Returns connection to database, which is kept open between updates and re-opened if necessary."""
+        if self._db is not None:
+            try:
+                self._db.ping()
+            except MySQLdb.Error:
+                self._close()
+        if self._db is None:
+            self._db = MySQLdb.connect(**self.connect)
+
+            # without autocommit, a long-lived connection would never see new rows
+            self._db.autocommit(True)
+        return self._db
+
+    def _close(self):
+        """Closes connection to database."""
+        if self._db is not None:
+            try:
+                self._db.close()
+            except MySQLdb.Error:
+                pass
+            self._db = None
+
+    def _query(self, db, watermark: Optional[datetime], skip: int = 0) -> list:
+        """Queries rows from the watermark on, or only the latest one, if no watermark is given.
+
+        Rows are sorted by all columns, so that rows with the same time are always returned in the same order.
 
-        # and query
+        Args:
+            db: Connection to database.
+            watermark: Time of last row read.
+            skip: Number of rows at the time of the watermark, which have been read already.
+
+        Returns:
+            List of rows with time first, sorted by time.
+        """
+        columns = ",".join([self.time] + list(self.fields.keys()))
         cur = db.cursor()
-        cur.execute(sql)
-        row = cur.fetchone()
-        cur.close()
+        try:
+            if watermark is None:
+                cur.execute("SELECT %s FROM %s ORDER BY %s DESC LIMIT 1" % (columns, self.table, self.time))
+            else:
+                sql = "SELECT %s FROM %s WHERE %s >= %%s ORDER BY %s LIMIT %%s OFFSET %%s" % (
+                    columns,
+                    self.table,
+                    self.time,
+                    columns,
+                )
+                cur.execute(sql, (watermark, BATCH_SIZE, skip))
+            return list(cur.fetchall())
+        finally:
+            cur.close()
 
-        # nothing?
-        if row is None:
-            logging.error("Result from database is empty.")
-            return
+    def _parse_row(self, row: tuple) -> Tuple[datetime, List[Tuple[str, float]]]:
+        """Converts a row from the database to time in UTC and values.
+
+        Args:
+            row: Row with time first and then all fields.
+
+        Returns:
+            Time and list of (sensor code, value) tuples.
+        """
 
-        # evaluate row
-        time = (Time(row[0]) + TimeDelta(self.time_offset * u.second)).to_datetime(
-            pytz.UTC
-        )
+        # evaluate time, which is naive and assumed to be UTC after adding offset
+        time = row[0].replace(tzinfo=pytz.UTC) + timedelta(seconds=self.time_offset)
 
         # other values
         values = []
@@ -131,9 +219,7 @@ class MySQL(WeatherStation):
 
             # add value
             values.append((cfg["code"], value))
-
-        # to DB
-        self._add_values(time, values)
+        return time, values
 
 
 __all__ = ["MySQL"]
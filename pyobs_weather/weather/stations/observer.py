@@ -1,16 +1,31 @@
 import logging
-from astropy.coordinates import EarthLocation, get_sun, AltAz
-import astropy.units as u
+import math
 import pytz
 from astropy.time import Time
-from django.conf import settings
 
 from .station import WeatherStation
+from ..ephemeris import sun_altitude
 from ..models import Value, Sensor
 
 log = logging.getLogger(__name__)
 
 
+def refraction(alt, press, temp):
+    """Calculates atmospheric refraction using Saemundsson's formula.
+
+    Args:
+        alt: True altitude in degrees.
+        press: Pressure in hPa.
+        temp: Temperature in degrees Celsius.
+
+    Returns:
+        Refraction in degrees.
+    """
+    alt = max(alt, -1.0)
+    r = 1.02 / math.tan(math.radians(alt + 10.3 / (alt + 5.11)))
+    return r * press / 1010.0 * 283.0 / (273.0 + temp) / 60.0
+
+
 class Observer(WeatherStation):
     """The Observer calculates the current solar altitude.
 
@@ -50,37 +65,25 @@ class Observer(WeatherStation):
     def update(self):
         """Entry point for updating sensor values for this station.
 
-        This method fetches the current Temperature, Pressure and Relative Humidity from the
-        :ref:`Current <pyobs_weather.weather.stations.Current>` station and uses those to calculate the current solar altitude,
-        which it stores in a sensor."""
+        This method fetches the current Temperature and Pressure from the
+        :ref:`Current <pyobs_weather.weather.stations.Current>` station and uses those to correct the current solar
+        altitude from the ephemeris for refraction, and stores it in a sensor."""
         log.info('Updating observer info %s...' % self._station.code)
 
-        # get latest values for temp, press and humid
+        # get latest values for temp and press
         temp = self._get_latest_value('temp')
         press = self._get_latest_value('press')
-        humid = self._get_latest_value('humid')
-
-        # get location
-        location = EarthLocation(lon=settings.OBSERVER_LOCATION['longitude'] * u.deg,
-                                 lat=settings.OBSERVER_LOCATION['latitude'] * u.deg,
-                                 height=settings.OBSERVER_LOCATION['elevation'] * u.m)
 
-        # get sun coordinates
+        # get solar altitude from ephemeris
         time = Time.now()
-        sun = get_sun(time)
-
-        # create alt/az frame
-        altaz_frame = AltAz(location=location,
-                            obstime=time,
-                            pressure=press * u.hPa if press is not None else None,
-                            temperature=temp * u.deg_C if temp is not None else None,
-                            relative_humidity=humid)
+        alt = float(sun_altitude(time.unix))
 
-        # convert to alt/az
-        sun_altaz = sun.transform_to(altaz_frame)
+        # correct for refraction, if we know the pressure
+        if press is not None:
+            alt += refraction(alt, press, 10.0 if temp is None else temp)
 
         # store it
-        self._add_value('sunalt', time.to_datetime(pytz.UTC), sun_altaz.alt.degree)
+        self._add_values(time.to_datetime(pytz.UTC), [('sunalt', alt)])
 
 
 __all__ = ['Observer']
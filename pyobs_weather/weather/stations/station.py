@@ -1,15 +1,20 @@
 import datetime
-from typing import List, Tuple
+import logging
+from typing import Dict, List, Optional, Tuple
 
 from pyobs_weather.weather.models import Station, SensorType, Sensor
-from pyobs_weather.weather.influx import write_sensor_values, write_sensor_value
+from pyobs_weather.weather.http import fetch
+from pyobs_weather.weather.influx import write_sensor_rows
+from pyobs_weather.weather.signals import sensors_updated
+
+log = logging.getLogger(__name__)
 
 SENSOR_TYPES = dict(
     temp=dict(code="temp", name="Temperature", unit="°C"),
     humid=dict(code="humid", name="Relative humidity", unit="%"),
     dewpoint=dict(code="dewpoint", name="Dew point", unit="°"),
     press=dict(code="press", name="Pressure", unit="hPa"),
-    winddir=dict(code="winddir", name="Wind dir", unit="°E of N"),
+    winddir=dict(code="winddir", name="Wind dir", unit="°E of N", average_mode="circular"),
     windspeed=dict(code="windspeed", name="Wind speed", unit="km/h"),
     particles=dict(code="particles", name="Particle count", unit="ppcm"),
     rain=dict(code="rain", name="Raining", unit=""),
@@ -20,8 +25,26 @@ SENSOR_TYPES = dict(
 
 
 class WeatherStation:
+    # whether values for sensors that don't exist are dropped with a warning instead of raising
+    ignore_unknown_sensors = False
+
     def __init__(self, station: Station, *args, **kwargs):
         self._station = station
+        self._sensors: Optional[Dict[str, Sensor]] = None
+
+    @property
+    def station(self) -> Station:
+        """Station this instance was created for."""
+        return self._station
+
+    def _get_sensors(self) -> Dict[str, Sensor]:
+        """Returns all sensors of this station by the code of their type, loaded only once."""
+        if self._sensors is None:
+            self._sensors = {
+                sensor.type.code: sensor
+                for sensor in Sensor.objects.filter(station=self._station).select_related("type")
+            }
+        return self._sensors
 
     def _add_sensor(self, sensor_code):
         """Add a sensor type and a sensor, if necessary.
@@ -45,10 +68,45 @@ class WeatherStation:
 
         # now add sensor itself
         sensor, _ = Sensor.objects.get_or_create(station=self._station, type=sensor_type)
+        if self._sensors is not None:
+            self._sensors[sensor_code] = sensor
 
         # return it
         return sensor
 
+    def _load_state(self) -> dict:
+        """Returns state of this station as stored by _save_state(), e.g. a position in a file or database.
+
+        The state is always read from the database, since another worker process might have updated the station
+        since this instance was created.
+        """
+        self._station.state = Station.objects.filter(id=self._station.id).values_list("state", flat=True).first()
+        return dict(self._station.state or {})
+
+    def _save_state(self, state: dict) -> None:
+        """Stores state of this station, so that it survives restarts.
+
+        Only the state is written, so that neither Station.save() nor its signals are triggered.
+
+        Args:
+            state: JSON serializable state.
+        """
+        Station.objects.filter(id=self._station.id).update(state=state)
+        self._station.state = state
+
+    def _fetch(self, url: str, method: str = "GET", **kwargs):
+        """Fetches a URL with the pooled HTTP session of this process.
+
+        Args:
+            url: URL to fetch.
+            method: HTTP method.
+            **kwargs: Passed to requests.
+
+        Returns:
+            Response or None, if content has not changed since last request.
+        """
+        return fetch(url, station=self._station.code, method=method, **kwargs)
+
     def _add_value(self, sensor_code, time, value):
         """Add a value for the given sensor
 
@@ -57,12 +115,7 @@ class WeatherStation:
             time: Time of measurement
             value: Measured value
         """
-
-        # get sensor
-        sensor = Sensor.objects.get(station=self._station, type__code=sensor_code)
-
-        # create value
-        write_sensor_value(sensor=sensor, time=time, value=value)
+        self._add_rows([(time, [(sensor_code, value)])])
 
     def _add_values(self, time: datetime.datetime, values: List[Tuple[str, float]]):
         """Add values for the given sensors
@@ -71,9 +124,40 @@ class WeatherStation:
             time: Time of measurement
             values: Measured value as list of [station_code, value] pairs
         """
+        self._add_rows([(time, values)])
+
+    def _add_rows(self, rows: List[Tuple[datetime.datetime, List[Tuple[str, float]]]], notify: bool = True):
+        """Add values for the given sensors at multiple times with a single write.
+
+        Args:
+            rows: List of (time, values) tuples, with values as list of [sensor_code, value] pairs
+            notify: Whether to send sensors_updated, which should be False for historical data
+
+        Raises:
+            Sensor.DoesNotExist: If a value is given for a sensor that doesn't exist, unless ignore_unknown_sensors
+                is set, in which case it is dropped.
+        """
 
-        # create value
-        write_sensor_values(time=time, station=self._station, values=values)
+        # sensors might have been added since they were cached
+        sensors = self._get_sensors()
+        if any(code not in sensors for _, values in rows for code, _ in values):
+            self._sensors = None
+            sensors = self._get_sensors()
+
+        # only keep values for existing sensors
+        unknown = set(code for _, values in rows for code, _ in values if code not in sensors)
+        if len(unknown) > 0:
+            if not self.ignore_unknown_sensors:
+                raise Sensor.DoesNotExist(
+                    "Unknown sensors at %s: %s" % (self._station.code, ", ".join(sorted(unknown)))
+                )
+            log.warning("Ignoring values for unknown sensors at %s: %s", self._station.code, ", ".join(sorted(unknown)))
+            rows = [(time, [(code, value) for code, value in values if code in sensors]) for time, values in rows]
+
+        # create values and tell everybody
+        write_sensor_rows(station=self._station, rows=rows)
+        if notify:
+            sensors_updated.send(sender=self.__class__, station=self._station, rows=rows)
 
 
 __all__ = ["WeatherStation"]
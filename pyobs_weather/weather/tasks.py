@@ -1,118 +1,160 @@
-import importlib
-import json
+import contextlib
 import logging
-from datetime import datetime
-from typing import Any
+import time
+import uuid
+from typing import Iterator, Optional
 
-import pytz
+from django.core.cache import cache
 
 from pyobs_weather.celery import app
-from pyobs_weather.weather.models import GoodWeather
-from pyobs_weather.weather.utils import get_class
+from pyobs_weather.settings import (
+    EVALUATE_DEBOUNCE,
+    EVALUATE_SWEEP_INTERVAL,
+    INFLUXDB_MEASUREMENT_AVERAGE,
+    ROLLUP_INTERVAL,
+    TASK_LOCK_TIMEOUT,
+)
+from pyobs_weather.weather.evaluation import evaluate_sensors, sensors_good, update_good_weather
+from pyobs_weather.weather.http import commit_validators
+from pyobs_weather.weather.metrics import (
+    EVALUATE_SECONDS,
+    STATION_UPDATE_FAILURES,
+    STATION_UPDATE_SECONDS,
+    TASK_OVERRAN,
+    TASK_SKIPPED,
+    timed,
+)
+from pyobs_weather.weather.registry import get_station
+from pyobs_weather.weather.snapshot import refresh_snapshots
 
 log = logging.getLogger(__name__)
 
-_evaluator_cache: dict[tuple[str, str], Any] = {}
+# lock shared by all evaluations
+EVALUATE_LOCK = "evaluate"
+
+
+@contextlib.contextmanager
+def single_flight(task: str, key: str, interval: Optional[float] = None, lock: Optional[str] = None) -> Iterator[bool]:
+    """Holds a lock in the cache while running, so that runs of a task for the same key never overlap.
+
+    Args:
+        task: Name of task, used for metrics.
+        key: Key to lock, e.g. a station code.
+        interval: Interval of task in seconds, runs taking longer are counted as overran.
+        lock: Name of lock, defaults to name of task. Tasks sharing a lock never overlap.
+
+    Yields:
+        Whether the lock was acquired. If not, the run should be skipped.
+    """
+
+    # try to acquire lock, which expires in case the worker dies
+    lock = "lock:%s:%s" % (lock or task, key)
+    token = uuid.uuid4().hex
+    if not cache.add(lock, token, timeout=TASK_LOCK_TIMEOUT):
+        log.warning("Skipping %s for %s, since previous run is still active.", task, key)
+        TASK_SKIPPED.labels(task=task).inc()
+        yield False
+        return
+
+    # run and release lock, unless it expired and somebody else holds it now
+    start = time.monotonic()
+    try:
+        yield True
+    finally:
+        if cache.get(lock) == token:
+            cache.delete(lock)
+        duration = time.monotonic() - start
+        if interval is not None and duration > interval:
+            log.warning("Running %s for %s took %.1fs, longer than interval of %.1fs.", task, key, duration, interval)
+            TASK_OVERRAN.labels(task=task).inc()
 
 
 @app.task
 def update_stations(station_code: str):
-    from pyobs_weather.weather.models import Station
-
-    # get station
-    station = Station.objects.get(code=station_code)
+    # get instance of station, which is kept between updates
+    obj = get_station(station_code)
+    station = obj.station
 
     # not active?
     if not station.active:
         return
 
-    # get class and update station
-    kls = get_class(station.class_name)
-    obj = kls(**json.loads(station.kwargs), station=station)
-    obj.update()
+    # update station, unless previous update is still running
+    with single_flight("update_stations", station_code, station.interval_seconds()) as acquired:
+        if acquired:
+            with timed(STATION_UPDATE_SECONDS, STATION_UPDATE_FAILURES, station=station_code):
+                try:
+                    obj.update()
+                except Exception:
+                    commit_validators(station_code, success=False)
+                    raise
 
-
-def create_evaluator(evaluator):
-    key = (evaluator.class_name, evaluator.kwargs or "")
-    if key not in _evaluator_cache:
-        module = evaluator.class_name[:evaluator.class_name.rfind('.')]
-        class_name = evaluator.class_name[evaluator.class_name.rfind('.') + 1:]
-        kls = getattr(importlib.import_module(module), class_name)
-        kwargs = {} if evaluator.kwargs is None else json.loads(evaluator.kwargs)
-        _evaluator_cache[key] = kls(**kwargs)
-    return _evaluator_cache[key]
+            # only now ask servers for changes since the fetched content
+            commit_validators(station_code)
 
 
 @app.task
 def evaluate():
-    from pyobs_weather.weather.models import Station
-
-    # get now
-    now = datetime.utcnow().astimezone(pytz.UTC)
-
-    # let's see, whether we find any sensor that's not evaluated to good
-    all_good = True
-
-    # loop all stations (except for average, which we don't evaluate)
-    for station in Station.objects.exclude(code='average').all():
-        # loop all sensors at station
-        for sensor in station.sensor_set.all():
-            # init good
-            is_good = True
-
-            # evaluate all evaluators
-            was_evaluated = False
-            for evaluator in sensor.evaluators.all():
-                # get evaluator
-                eva = create_evaluator(evaluator)
-
-                # and evaluate
-                res = eva(sensor)
-                is_good = is_good and res
-                was_evaluated = True
-
-            # has not been evaluated?
-            if not was_evaluated:
-                # reset is_good
-                is_good = None
-
-            # status changed?
-            if is_good is not None and is_good != sensor.good:
-                # set good/bad since, if necessary
-                if is_good is True:
-                    if sensor.good_since is None:
-                        sensor.good_since = now
-                    sensor.bad_since = None
-                else:
-                    if sensor.bad_since is None:
-                        sensor.bad_since = now
-                    sensor.good_since = None
-            else:
-                # reset both
-                sensor.good_since = None
-                sensor.bad_since = None
-
-            # if there's a delay, we may want to switch back
-            if sensor.good and sensor.bad_since and (now - sensor.bad_since).total_seconds() < sensor.delay_bad:
-                is_good = True
-            if not sensor.good and sensor.good_since and (now - sensor.good_since).total_seconds() < sensor.delay_good:
-                is_good = False
-
-            # did status still change?
-            if is_good is not None and is_good != sensor.good:
-                # then store time
-                sensor.since = datetime.utcnow().astimezone(pytz.UTC)
-
-            # store it
-            sensor.good = is_good
-            sensor.save()
-
-            # found one that's not good?
-            if is_good is False:
-                all_good = False
-
-    # get current GoodWeather status
-    current_good = GoodWeather.objects.order_by('-time').first()
-    if current_good is None or current_good.good != all_good:
-        # status has changed, store it
-        GoodWeather.objects.create(good=all_good)
+    # all evaluations share a lock, so that no two of them write GoodWeather at the same time
+    with single_flight("evaluate", "all", EVALUATE_SWEEP_INTERVAL, lock=EVALUATE_LOCK) as acquired:
+        if not acquired:
+            return
+
+        # evaluate all sensors and store global status
+        with timed(EVALUATE_SECONDS):
+            good = evaluate_sensors()
+        update_good_weather(good)
+
+        # rebuild snapshots for API
+        refresh_snapshots()
+
+
+@app.task
+def evaluate_station(station_code: str):
+    from pyobs_weather.weather.models import Sensor
+
+    # allow new events to schedule another evaluation
+    cache.delete("evaluate:%s" % station_code)
+
+    with single_flight("evaluate_station", "all", lock=EVALUATE_LOCK) as acquired:
+        # another evaluation might have read the values before the new ones arrived, so try again later
+        if not acquired:
+            _schedule_station(station_code)
+            return
+
+        # evaluate sensors of station and store global status
+        with timed(EVALUATE_SECONDS):
+            evaluate_sensors(Sensor.objects.filter(station__code=station_code))
+        update_good_weather(sensors_good())
+
+        # rebuild snapshots for API
+        refresh_snapshots()
+
+
+@app.task
+def rollup():
+    from pyobs_weather.weather.rollup import run_rollups
+
+    # aggregate new data to all resolutions
+    with single_flight("rollup", "all", ROLLUP_INTERVAL) as acquired:
+        if acquired:
+            run_rollups()
+
+
+def schedule_evaluation(sender, station, **kwargs):
+    """Receiver for sensors_updated, schedules a debounced evaluation of the station's sensors."""
+
+    # average is never evaluated
+    if station.code == INFLUXDB_MEASUREMENT_AVERAGE:
+        return
+
+    _schedule_station(station.code)
+
+
+def _schedule_station(station_code: str) -> None:
+    """Schedules evaluation of a station after EVALUATE_DEBOUNCE seconds, if not already pending."""
+    if cache.add("evaluate:%s" % station_code, True, timeout=EVALUATE_DEBOUNCE):
+        # if it waits too long in the queue, the next sweep will do the job
+        evaluate_station.apply_async(
+            args=[station_code], countdown=EVALUATE_DEBOUNCE, expires=EVALUATE_DEBOUNCE + EVALUATE_SWEEP_INTERVAL
+        )
@@ -1,3 +1,991 @@
-from django.test import TestCase
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+import requests
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.management.base import SystemCheckError
+from django.test import TestCase, TransactionTestCase, override_settings
+from influxdb_client.rest import ApiException
+
+from pyobs_weather.weather import benchmark, checks, http, influx, registry, rollup, snapshot, tasks
+from pyobs_weather.weather.averaging import aggregate
+from pyobs_weather.weather.downsample import choose_window, downsample, lttb
+from pyobs_weather.weather.ephemeris import Ephemeris
+from pyobs_weather.weather.evaluation import evaluate_sensors
+from pyobs_weather.weather.evaluators import Boolean, SchmittTrigger, Switch, Valid
+from pyobs_weather.weather.events import last_event_id, publish
+from pyobs_weather.weather.export import has_arrow
+from pyobs_weather.weather.latest import DjangoCacheLatestValueStore, LocalLatestValueStore
+from pyobs_weather.weather.models import Evaluator, EventSequence, RollupWatermark, Sensor, Station, Value
+from pyobs_weather.weather.registry import get_station
+from pyobs_weather.weather.replay import replay_sensor, resample, run_state_machine
+from pyobs_weather.weather.stations import CSV, Average, Dummy, McDonaldLockeArchive
+from pyobs_weather.weather.stations.mcdlockearchive import MAX_WINDOW, WINDOW
+from pyobs_weather.weather.writer import BatchingWriter
+
+
+class LegacyEvaluator:
+    """An evaluator written before values were passed in, which only gets the sensor."""
+
+    def __call__(self, sensor):
+        return sensor.type.code != "rain"
+
+
+class ScalarSchmittTrigger:
+    """An evaluator that gets sensor and value, and behaves like SchmittTrigger(good=80, bad=85)."""
+
+    def __call__(self, sensor, value):
+        return value is None or value["value"] < (80 if sensor.good is False else 85)
+
+
+class FailingEvaluator:
+    """An evaluator that always raises."""
+
+    def __call__(self, sensor, value):
+        raise RuntimeError("broken")
+
+
+def create_station(code: str = "test") -> Station:
+    """Creates a station with the dummy class, which adds a sensor for each of its types."""
+    return Station.objects.create(code=code, name=code, class_name="pyobs_weather.weather.stations.Dummy")
+
+
+def add_evaluator(sensor: Sensor, name: str, class_name: str, kwargs: str = "{}") -> Evaluator:
+    """Adds an evaluator to a sensor."""
+    evaluator, _ = Evaluator.objects.get_or_create(name=name, class_name=class_name, kwargs=kwargs)
+    sensor.evaluators.add(evaluator)
+    return evaluator
+
+
+def update_station(code: str, obj=None) -> list:
+    """Updates a station, or the given instance of it, and returns the first value of each row it wrote."""
+    written = []
+    with mock.patch("pyobs_weather.weather.stations.station.write_sensor_rows") as write:
+        write.side_effect = lambda station, rows: written.extend(values[0][1] for _, values in rows)
+        (get_station(code) if obj is None else obj).update()
+    return written
+
+
+def latest(values: dict):
+    """Returns a replacement for read_latest_values() with the given values by sensor type."""
+    now = datetime.now(timezone.utc)
+
+    def read(sensors):
+        return {s: None if s.type.code not in values else {"time": now, "value": values[s.type.code]} for s in sensors}
+
+    return read
+
+
+class EvaluationTest(TestCase):
+    def setUp(self):
+        self.station = create_station()
+        self.sensors = {sensor.type.code: sensor for sensor in Sensor.objects.filter(station=self.station)}
+
+    def evaluate(self, values: dict) -> bool:
+        with mock.patch("pyobs_weather.weather.evaluation.read_latest_values", latest(values)):
+            return evaluate_sensors(Sensor.objects.filter(station=self.station))
+
+    def test_legacy_evaluator(self):
+        # evaluators with __call__(self, sensor) still work
+        for code in ("temp", "rain"):
+            add_evaluator(self.sensors[code], "legacy", "pyobs_weather.weather.tests.LegacyEvaluator")
+        self.assertFalse(self.evaluate({"temp": 10.0, "rain": 1.0}))
+        self.assertTrue(Sensor.objects.get(id=self.sensors["temp"].id).good)
+        self.assertFalse(Sensor.objects.get(id=self.sensors["rain"].id).good)
+
+    def test_failing_evaluator(self):
+        # a failing evaluator keeps the status of its sensor, while others are still evaluated
+        Sensor.objects.filter(id=self.sensors["humid"].id).update(good=True)
+        add_evaluator(self.sensors["humid"], "failing", "pyobs_weather.weather.tests.FailingEvaluator")
+        add_evaluator(self.sensors["temp"], "switch", "pyobs_weather.weather.evaluators.Switch", '{"threshold": 5}')
+        with self.assertLogs("pyobs_weather.weather.evaluation", "ERROR"):
+            self.assertFalse(self.evaluate({"temp": 10.0, "humid": 50.0}))
+        self.assertTrue(Sensor.objects.get(id=self.sensors["humid"].id).good)
+        self.assertFalse(Sensor.objects.get(id=self.sensors["temp"].id).good)
+
+    def test_valid_non_numeric(self):
+        # any value is valid, not only numbers
+        for code in ("temp", "humid", "rain"):
+            add_evaluator(self.sensors[code], "valid", "pyobs_weather.weather.evaluators.Valid")
+        self.assertFalse(self.evaluate({"temp": "dry", "humid": 50.0}))
+        good = {
+            s.type.code: s.good
+            for s in Sensor.objects.filter(station=self.station, type__code__in=["temp", "humid", "rain"])
+        }
+        self.assertEqual(good, {"temp": True, "humid": True, "rain": False})
+
+
+class EvaluatorTest(TestCase):
+    def assertEvaluates(self, evaluator, values, good, expected):
+        result = evaluator.evaluate(np.array(values), np.array(good, dtype=float))
+        self.assertEqual(result.tolist(), expected)
+
+    def test_switch(self):
+        # missing values are always good
+        self.assertEvaluates(Switch(5), [1.0, 10.0, np.nan], [1, 1, 1], [True, False, True])
+        self.assertEvaluates(Switch(5, invert=True), [1.0, 10.0, np.nan], [1, 1, 1], [False, True, True])
+
+    def test_boolean(self):
+        self.assertEvaluates(Boolean(), [0.0, 1.0, np.nan], [1, 1, 1], [False, True, True])
+        self.assertEvaluates(Boolean(invert=True), [0.0, 1.0, np.nan], [1, 1, 1], [True, False, True])
+
+    def test_schmitt_trigger(self):
+        # between thresholds, status is kept, and an unknown status counts as good
+        self.assertEvaluates(
+            SchmittTrigger(good=80, bad=85),
+            [82.0, 82.0, 90.0, 70.0, 82.0, np.nan],
+            [1, 0, 1, 0, np.nan, 0],
+            [True, False, False, True, True, True],
+        )
+
+    def test_valid(self):
+        values = np.array([None, np.nan, "dry", 0.0], dtype=object)
+        self.assertEqual(Valid().evaluate(values, np.ones(4)).tolist(), [False, False, True, True])
+
+    def test_single_sensor(self):
+        # evaluating a single sensor uses its current status
+        sensor = mock.Mock(good=False)
+        self.assertFalse(SchmittTrigger(good=80, bad=85)(sensor, {"time": None, "value": 82.0}))
+        sensor.good = True
+        self.assertTrue(SchmittTrigger(good=80, bad=85)(sensor, {"time": None, "value": 82.0}))
+        self.assertTrue(SchmittTrigger(good=80, bad=85)(sensor, None))
+
+
+class ReplayTest(TestCase):
+    def test_resample(self):
+        # values are forward-filled, until they get too old
+        grid = np.array([-5.0, 0.0, 5.0, 10.0, 400.0])
+        values = resample(np.array([0.0, 10.0]), np.array([1.0, 2.0]), grid, max_age=300)
+        np.testing.assert_array_equal(values, [np.nan, 1.0, 1.0, 2.0, np.nan])
+        self.assertTrue(np.isnan(resample(np.array([]), np.array([]), grid)).all())
+
+    def test_delay_bad(self):
+        # bad results must last delay_bad seconds, then a good result switches back immediately
+        times = np.arange(0, 100, 10.0)
+        results = np.array([True, True, False, False, False, True, True, True, True, True])
+        states = run_state_machine(times, results, results, True, delay_good=0, delay_bad=15)
+        self.assertEqual(states.tolist(), [True] * 4 + [False] + [True] * 5)
+
+    def test_delay_good(self):
+        # an unknown status goes through delay_good first, and a short run of good results doesn't switch
+        times = np.arange(0, 100, 10.0)
+        results = np.array([True, True, False, False, False, True, True, True, True, True])
+        states = run_state_machine(times, results, results, True, delay_good=25, delay_bad=0)
+        self.assertEqual(states.tolist(), [False] * 8 + [True] * 2)
+
+    def test_replay_sensor(self):
+        # results depend on the status at each step, also for evaluators that work on single values
+        values = np.array([70.0, 82.0, 90.0, 82.0, 78.0])
+        for eva in (SchmittTrigger(good=80, bad=85), ScalarSchmittTrigger()):
+            states = replay_sensor(np.arange(0, 50, 10.0), values, [eva], sensor=Sensor())
+            self.assertEqual(states.tolist(), [True, True, False, False, True])
+
+    def test_legacy_evaluator(self):
+        # evaluators that read the value themselves are rejected before fetching anything
+        sensor = Sensor.objects.get(station=create_station(), type__code="rain")
+        add_evaluator(sensor, "legacy", "pyobs_weather.weather.tests.LegacyEvaluator")
+        with mock.patch("pyobs_weather.weather.replay.read_sensor_series") as read:
+            with self.assertRaisesMessage(CommandError, "Evaluator legacy"):
+                call_command("replay", "--sensor", "test:rain")
+        read.assert_not_called()
+
+
+class DownsampleTest(TestCase):
+    def test_choose_window(self):
+        # smallest window giving at most max_points values, or the largest one
+        self.assertIsNone(choose_window(3600, 10, 1000))
+        self.assertEqual(choose_window(7 * 86400, 10, 1000), "15m")
+        self.assertEqual(choose_window(3650 * 86400, 10, 100), "1d")
+
+    def test_lttb(self):
+        # first, last and outstanding points are kept
+        y = np.zeros(100)
+        y[50] = 10.0
+        selected, edges = lttb(np.arange(100.0), y, 10)
+        self.assertEqual(len(selected), 10)
+        self.assertEqual(len(edges), 11)
+        self.assertEqual((selected[0], selected[-1]), (0, 99))
+        self.assertIn(50, selected)
+
+        # nothing to do
+        selected, _ = lttb(np.arange(5.0), np.zeros(5), 10)
+        self.assertEqual(selected.tolist(), [0, 1, 2, 3, 4])
+
+    def test_downsample(self):
+        rows = [
+            {"time": "2024-01-01T%02d:%02d:00Z" % divmod(i, 60), "mean": float(i % 7), "min": 0.0, "max": 7.0}
+            for i in range(300)
+        ]
+        rows[123]["max"] = 100.0
+        rows[124]["mean"] = None
+
+        # envelope of all buckets is kept
+        result = downsample(rows, 50)
+        self.assertEqual(len(result), 50)
+        self.assertEqual((result[0]["time"], result[-1]["time"]), (rows[0]["time"], rows[-1]["time"]))
+        self.assertEqual(max(r["max"] for r in result), 100.0)
+        self.assertNotIn(None, [r["mean"] for r in result])
+
+        # short histories are returned as they are
+        self.assertIs(downsample(rows, 300), rows)
+
+
+class AveragingTest(TestCase):
+    def aggregate(self, values, weights, mode) -> float:
+        return aggregate(np.zeros(len(values), dtype=int), np.array(values), np.array(weights, dtype=float), [mode])[0]
+
+    def test_mean(self):
+        self.assertAlmostEqual(self.aggregate([1.0, 3.0], [1, 3], "mean"), 2.5)
+
+        # missing values and those without weight are ignored, groups without values are NaN
+        result = aggregate(
+            np.array([0, 0, 0, 1]), np.array([1.0, np.nan, 5.0, 2.0]), np.array([1, 1, 0, 0.0]), ["mean"] * 3
+        )
+        self.assertEqual(result[0], 1.0)
+        self.assertTrue(np.isnan(result[1:]).all())
+
+    def test_circular(self):
+        # wraps around at 0/360 degrees
+        avg = self.aggregate([350.0, 20.0], [1, 1], "circular")
+        self.assertAlmostEqual(avg, 5.0)
+        avg = self.aggregate([350.0, 10.0], [1, 1], "circular")
+        self.assertAlmostEqual(min(avg, 360.0 - avg), 0.0)
+
+    def test_median(self):
+        self.assertEqual(self.aggregate([1.0, 2.0, 100.0], [1, 1, 1], "median"), 2.0)
+        self.assertEqual(self.aggregate([1.0, 2.0, 100.0], [1, 1, 5], "median"), 100.0)
+
+    def test_sigmaclip(self):
+        # outlier is rejected
+        self.assertAlmostEqual(self.aggregate([10.0] * 9 + [100.0], [1] * 10, "sigmaclip"), 10.0)
+        self.assertAlmostEqual(self.aggregate([10.0] * 9 + [100.0], [1] * 10, "mean"), 19.0)
+
+
+class AddRowsTest(TestCase):
+    def setUp(self):
+        self.obj = Dummy(station=create_station())
+        patcher = mock.patch("pyobs_weather.weather.stations.station.write_sensor_rows")
+        self.write = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unknown(self):
+        # values for sensors that don't exist are not written
+        now = datetime.now(timezone.utc)
+        with self.assertRaises(Sensor.DoesNotExist):
+            self.obj._add_values(now, [("temp", 10.0), ("skytemp", -20.0)])
+        self.write.assert_not_called()
+
+        # unless they are ignored, like for the average station
+        self.obj.ignore_unknown_sensors = True
+        with self.assertLogs("pyobs_weather.weather.stations.station", "WARNING"):
+            self.obj._add_values(now, [("temp", 10.0), ("skytemp", -20.0)])
+        self.assertEqual(self.write.call_args.kwargs["rows"], [(now, [("temp", 10.0)])])
+
+    def test_added(self):
+        # sensors added by someone else after they have been cached are found
+        self.obj._get_sensors()
+        Dummy(station=self.obj.station)._add_sensor("skytemp")
+        now = datetime.now(timezone.utc)
+        self.obj._add_values(now, [("skytemp", -20.0)])
+        self.assertEqual(self.write.call_args.kwargs["rows"], [(now, [("skytemp", -20.0)])])
+
+
+class AverageStationTest(TestCase):
+    def test_non_numeric(self):
+        # values that are not numbers are ignored, but others of the same type still averaged
+        sensors = [Sensor.objects.get(station=create_station(code), type__code="temp") for code in ("a", "b", "c")]
+        now = datetime.now(timezone.utc)
+        latest = {s: {"time": now, "value": v} for s, v in zip(sensors, (10.0, "broken", 20.0))}
+        station = Station.objects.create(
+            code="average", name="Average", class_name="pyobs_weather.weather.stations.Average"
+        )
+        with (
+            mock.patch("pyobs_weather.weather.stations.average.read_latest_values", return_value=latest),
+            mock.patch("pyobs_weather.weather.stations.average.INFLUXDB_MEASUREMENT_AVERAGE", "average"),
+            mock.patch.object(Average, "_add_values") as add_values,
+        ):
+            Average(station=station).update()
+        self.assertEqual(dict(add_values.call_args.args[1])["temp"], 15.0)
+
+
+class FakeWriteApi:
+    """Replaces the synchronous write API of Influx, fails with the given errors first and records written batches."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.batches = []
+
+    def write(self, bucket, org, record):
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        self.batches.append(list(record))
+
+
+class BatchingWriterTest(TestCase):
+    def writer(self, api: FakeWriteApi, **kwargs) -> BatchingWriter:
+        writer = BatchingWriter(api, **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_batch_size(self):
+        # full batches are written without waiting for the flush interval
+        api = FakeWriteApi()
+        writer = self.writer(api, batch_size=2, flush_interval=60)
+        writer.write("bucket", "org", [1, 2, 3, 4])
+        writer.flush()
+        self.assertEqual(api.batches, [[1, 2], [3, 4]])
+
+    def test_flush_interval(self):
+        api = FakeWriteApi()
+        writer = self.writer(api, batch_size=100, flush_interval=0.05)
+        writer.write("bucket", "org", 1)
+        writer.flush()
+        self.assertEqual(api.batches, [[1]])
+
+    def test_retry(self):
+        # delay is doubled for every retry
+        api = FakeWriteApi([ConnectionError(), ApiException(status=503)])
+        writer = self.writer(api, flush_interval=0.01, max_retries=2, retry_interval=1.0)
+        with mock.patch("pyobs_weather.weather.writer.time.sleep") as sleep:
+            writer.write("bucket", "org", 1)
+            writer.flush()
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [1.0, 2.0])
+        self.assertEqual(api.batches, [[1]])
+        self.assertEqual((writer.stats["retries"], writer.stats["written"]), (2, 1))
+
+        # client errors are not retried, and records are dropped after all retries
+        api.errors = [ApiException(status=400)] + [ConnectionError()] * 3
+        with mock.patch("pyobs_weather.weather.writer.time.sleep"), self.assertLogs("pyobs_weather.weather.writer"):
+            writer.write("bucket", "org", 2)
+            writer.flush()
+            writer.write("bucket", "org", 3)
+            writer.flush()
+        self.assertEqual(writer.stats["failed"], 2)
+        self.assertEqual(api.batches, [[1]])
+
+    def test_close(self):
+        # queued records are written on shutdown without waiting for the flush interval
+        api = FakeWriteApi()
+        writer = self.writer(api, batch_size=100, flush_interval=60)
+        writer.write("bucket", "org", [1, 2, 3])
+        start = time.monotonic()
+        writer.close()
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(api.batches, [[1, 2, 3]])
+
+
+class EvaluationLockTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_station_waits_for_sweep(self):
+        # while the sweep is running, a station is not evaluated, but scheduled again
+        with tasks.single_flight("evaluate", "all", lock=tasks.EVALUATE_LOCK) as acquired:
+            self.assertTrue(acquired)
+            with (
+                mock.patch.object(tasks, "evaluate_sensors") as evaluate,
+                mock.patch.object(tasks.evaluate_station, "apply_async") as schedule,
+                self.assertLogs("pyobs_weather.weather.tasks", "WARNING"),
+            ):
+                tasks.evaluate_station("test")
+        evaluate.assert_not_called()
+        self.assertEqual(schedule.call_args.kwargs["args"], ["test"])
+
+        # sweep is skipped while a station is evaluated
+        with tasks.single_flight("evaluate_station", "all", lock=tasks.EVALUATE_LOCK):
+            with (
+                mock.patch.object(tasks, "evaluate_sensors") as evaluate,
+                self.assertLogs("pyobs_weather.weather.tasks", "WARNING"),
+            ):
+                tasks.evaluate()
+        evaluate.assert_not_called()
+
+
+class FakeSession:
+    """Replaces the HTTP session, answers with 304 if the ETag matches, and records sent headers."""
+
+    def __init__(self, etag: str = "v1"):
+        self.etag = etag
+        self.headers = []
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.headers.append(headers)
+        status = 304 if headers.get("If-None-Match") == self.etag else 200
+        return mock.Mock(status_code=status, headers={"ETag": self.etag}, content=b"data")
+
+
+class ConditionalFetchTest(TestCase):
+    def setUp(self):
+        self.session = FakeSession()
+        patcher = mock.patch.object(http, "get_session", lambda: self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(http._validators.clear)
+        self.addCleanup(http._pending.clear)
+
+    def update(self, station: str, fail: bool = False):
+        """Runs update_stations for a station that fetches a URL and fails, if requested."""
+        obj = mock.Mock()
+        obj.station.active = True
+        obj.station.interval_seconds.return_value = None
+
+        def update():
+            obj.response = http.fetch("http://example.com/", station=station)
+            if fail:
+                raise ValueError("could not parse")
+
+        obj.update.side_effect = update
+        with mock.patch.object(tasks, "get_station", return_value=obj):
+            tasks.update_stations(station)
+        return obj.response
+
+    def test_not_modified(self):
+        # validators are only sent after a successful update, and then content is not fetched again
+        self.assertIsNotNone(self.update("a"))
+        self.assertIsNone(self.update("a"))
+        self.assertEqual(self.session.headers[-1]["If-None-Match"], "v1")
+
+        # other stations have their own validators
+        self.assertIsNotNone(self.update("b"))
+        self.assertNotIn("If-None-Match", self.session.headers[-1])
+
+    def test_failed_update(self):
+        # if an update fails, the content is fetched again
+        with self.assertRaises(ValueError):
+            self.update("a", fail=True)
+        self.assertIsNotNone(self.update("a"))
+        self.assertNotIn("If-None-Match", self.session.headers[-1])
+
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.station = create_station()
+
+    def test_local_cache(self):
+        # with a process-local cache, changes are visible immediately
+        with (
+            mock.patch.object(snapshot, "read_latest_values", latest({})),
+            mock.patch.object(snapshot, "is_shared_cache", return_value=False),
+        ):
+            body, _ = snapshot.get_snapshot("sensors")
+            Sensor.objects.filter(station=self.station).update(good=False)
+            changed, _ = snapshot.get_snapshot("sensors")
+        self.assertNotEqual(body, changed)
+
+    def test_shared_cache(self):
+        # with a shared cache, snapshots are only rebuilt after evaluation
+        with (
+            mock.patch.object(snapshot, "read_latest_values", latest({})),
+            mock.patch.object(snapshot, "is_shared_cache", return_value=True),
+        ):
+            body, _ = snapshot.get_snapshot("sensors")
+            Sensor.objects.filter(station=self.station).update(good=False)
+            self.assertEqual(snapshot.get_snapshot("sensors")[0], body)
+            snapshot.refresh_snapshots()
+            self.assertNotEqual(snapshot.get_snapshot("sensors")[0], body)
+
+
+class LatestValueStoreTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_stores(self):
+        now = datetime.now(timezone.utc)
+        for store in (LocalLatestValueStore(ttl=300), DjangoCacheLatestValueStore("default", ttl=300)):
+            # None values are ignored, and older values never replace newer ones
+            store.set_many("a", now, [("temp", 10.0), ("humid", None)])
+            store.set_many("a", now - timedelta(seconds=10), [("temp", 5.0)])
+            self.assertEqual(
+                store.get_many([("a", "temp"), ("a", "humid")]), {("a", "temp"): {"time": now, "value": 10.0}}
+            )
+
+            # stale values are misses
+            store.set_many("b", now - timedelta(seconds=400), [("temp", 1.0)])
+            self.assertEqual(store.get_many([("b", "temp")]), {})
+
+    def test_fallback(self):
+        # only values missing in store are queried from Influx, and then stored
+        station = create_station()
+        sensors = list(
+            Sensor.objects.filter(station=station, type__code__in=["temp", "humid"]).select_related("station", "type")
+        )
+        now = datetime.now(timezone.utc)
+        store = LocalLatestValueStore()
+        store.set_many("test", now, [("temp", 10.0)])
+        client = mock.Mock()
+        query = client.query_api.return_value.query
+        query.return_value.to_values.return_value = [("test", "humid", now, 50.0)]
+        with (
+            mock.patch.object(influx, "get_store", return_value=store),
+            mock.patch.object(influx, "get_client", return_value=client),
+        ):
+            values = influx.read_latest_values(sensors)
+            self.assertEqual({s.type.code: v["value"] for s, v in values.items()}, {"temp": 10.0, "humid": 50.0})
+            self.assertIn('r._field == "humid"', query.call_args.kwargs["query"])
+            self.assertNotIn('r._field == "temp"', query.call_args.kwargs["query"])
+
+            # now everything is in store
+            influx.read_latest_values(sensors)
+            self.assertEqual(query.call_count, 1)
+
+
+class StreamTest(TransactionTestCase):
+    # events are read in another thread, which must see the cache without waiting for the test transaction
+    def setUp(self):
+        cache.clear()
+
+    def get(self, **headers) -> str:
+        response = self.client.get("/api/stream/", **headers)
+        return b"".join(response.streaming_content).decode("utf-8")
+
+    def test_reconnect(self):
+        # first request tells client where to continue
+        publish("values", {"station": "old"})
+        body = self.get()
+        self.assertIn("id: 1\n", body)
+        self.assertIn('"held": false', body)
+        self.assertNotIn('"old"', body)
+
+        # reconnecting client gets new events
+        publish("values", {"station": "new"})
+        body = self.get(HTTP_LAST_EVENT_ID="1")
+        self.assertIn('id: 2\nevent: values\ndata: {"station": "new"}', body)
+        self.assertNotIn("id: 1\n", body)
+
+    def test_sequence(self):
+        # without atomic increments in the cache, IDs are counted in the database
+        self.assertEqual([publish("values", {}) for _ in range(3)], [1, 2, 3])
+        self.assertEqual(EventSequence.objects.get().seq, 3)
+        self.assertEqual(last_event_id(), 3)
+
+        # otherwise by the cache
+        with mock.patch("pyobs_weather.weather.events.has_atomic_incr", return_value=True):
+            self.assertEqual(publish("values", {}), 1)
+            self.assertEqual(last_event_id(), 1)
+
+
+def timestamp(iso: str) -> float:
+    """Converts ISO time in UTC to UNIX timestamp."""
+    return datetime.fromisoformat(iso).replace(tzinfo=timezone.utc).timestamp()
+
+
+class EphemerisTest(TestCase):
+    def night(self, latitude: float, iso: str) -> dict:
+        eph = Ephemeris.compute((0.0, latitude, 0.0), timestamp(iso) - 86400, 3, 600)
+        return eph.night(timestamp(iso))
+
+    def test_night(self):
+        night = self.night(30.0, "2024-06-21T12:00:00")
+        self.assertLess(timestamp("2024-06-21T12:00:00"), night["sunset"])
+        self.assertTrue(night["sunset"] < night["dusk"] < night["dawn"] < night["sunrise"])
+
+    def test_polar(self):
+        # polar day and night have no events at all
+        for iso in ("2024-06-21T12:00:00", "2024-12-21T12:00:00"):
+            self.assertEqual(set(self.night(70.0, iso).values()), {None})
+
+    def test_no_twilight(self):
+        # sun sets, but never reaches twilight horizon
+        night = self.night(60.0, "2024-06-21T12:00:00")
+        self.assertIsNone(night["dusk"])
+        self.assertIsNone(night["dawn"])
+        self.assertLess(night["sunset"], night["sunrise"])
+
+    def test_timeline(self):
+        night = {"sunset": None, "dusk": None, "dawn": None, "sunrise": None}
+        with mock.patch("pyobs_weather.api.views.night_events", return_value=night):
+            response = self.client.get("/api/timeline/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["events"], [None, None, None, None])
+
+
+class DumpWeatherTest(TestCase):
+    def test_parquet_without_arrow(self):
+        # fails with a clear message before fetching anything
+        with (
+            mock.patch("pyobs_weather.weather.management.commands.dump_weather.has_arrow", return_value=False),
+            mock.patch("pyobs_weather.weather.management.commands.dump_weather.export_rows") as export_rows,
+        ):
+            with self.assertRaisesMessage(CommandError, "pyobs-weather[arrow]"):
+                call_command("dump_weather", "-o", "weather.parquet", "--type", "temp")
+        export_rows.assert_not_called()
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        # read values from the database, independent of USE_INFLUX in the environment
+        patcher = mock.patch("pyobs_weather.weather.export.USE_INFLUX", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        station = create_station()
+        sensor = Sensor.objects.get(station=station, type__code="temp")
+        Value.objects.create(sensor=sensor, time=datetime(2024, 1, 1, tzinfo=timezone.utc), value=1.5)
+        self.url = "/api/export/?stations=test&types=temp&start=2023-12-31&end=2024-01-02&format="
+
+    def test_csv(self):
+        response = self.client.get(self.url + "csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("1.5", b"".join(response.streaming_content).decode("utf-8"))
+
+    def test_arrow_without_pyarrow(self):
+        with mock.patch("pyobs_weather.api.views.has_arrow", return_value=False):
+            response = self.client.get(self.url + "arrow")
+        self.assertEqual(response.status_code, 501)
+        self.assertIn(b"pyobs-weather[arrow]", response.content)
+
+    @skipUnless(has_arrow(), "pyarrow not installed")
+    def test_arrow(self):
+        import pyarrow as pa
+
+        response = self.client.get(self.url + "arrow")
+        self.assertEqual(response.status_code, 200)
+        table = pa.ipc.open_stream(b"".join(response.streaming_content)).read_all()
+        self.assertEqual(table.column("temp").to_pylist(), [1.5])
+
+
+class RollupBucketsTest(TestCase):
+    def test_forbidden(self):
+        # missing permissions are logged for each bucket, other errors are raised
+        client = mock.Mock()
+        client.buckets_api.return_value.find_bucket_by_name.side_effect = ApiException(status=403)
+        with mock.patch.object(rollup, "get_client", return_value=client):
+            with self.assertLogs("pyobs_weather.weather.rollup", "WARNING") as logs:
+                rollup.ensure_buckets()
+            self.assertEqual(len(logs.output), len(rollup.RESOLUTIONS))
+            client.buckets_api.return_value.find_bucket_by_name.side_effect = ApiException(status=500)
+            with self.assertRaises(ApiException):
+                rollup.ensure_buckets()
+
+
+class BenchmarkTest(TestCase):
+    def test_private_cache(self):
+        # benchmarks don't clear the cache of a running installation
+        cache.set("benchmark-test", 1)
+        results = benchmark.run_benchmarks([6], scenarios=["evaluate", "api.sensors"], repeat=1)
+        self.assertEqual(set(results["results"]), {"evaluate[6]", "api.sensors[6]"})
+        self.assertEqual(cache.get("benchmark-test"), 1)
+
+
+class SharedCacheCheckTest(TestCase):
+    def test_local_cache(self):
+        # process-local caches are rejected
+        self.assertEqual(checks.check_shared_cache(None), [])
+        local = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        with override_settings(CACHES=local):
+            self.assertEqual([e.id for e in checks.check_shared_cache(None)], ["weather.E001"])
+            with self.assertRaisesMessage(SystemCheckError, "weather.E001"):
+                call_command("check")
+
+        # unless marked as shared, e.g. if only used from a single process
+        local["default"]["SHARED"] = True
+        with override_settings(CACHES=local):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+
+class SQLiteConnection:
+    """Replaces a connection from MySQLdb with one to an SQLite database."""
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    def autocommit(self, on):
+        pass
+
+    def ping(self):
+        pass
+
+    def close(self):
+        pass
+
+    def cursor(self):
+        return SQLiteCursor(self.db.cursor())
+
+
+class SQLiteCursor:
+    """Replaces a cursor from MySQLdb, converting its placeholders for SQLite."""
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(sql.replace("%s", "?"), params)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+class MySQLTest(TestCase):
+    def setUp(self):
+        # MySQLdb backed by SQLite
+        self.db = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES)
+        self.db.execute("CREATE TABLE weather (time TIMESTAMP, temp REAL)")
+        mysqldb = types.ModuleType("MySQLdb")
+        mysqldb.Error = sqlite3.Error
+        mysqldb.connect = lambda **kwargs: SQLiteConnection(self.db)
+        patcher = mock.patch.dict(sys.modules, {"MySQLdb": mysqldb})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(registry._entries.clear)
+
+        # station
+        kwargs = {"connect": {}, "table": "weather", "fields": {"temp": {"code": "temp"}}}
+        Station.objects.create(
+            code="mysql",
+            name="MySQL",
+            class_name="pyobs_weather.weather.stations.mysql.MySQL",
+            kwargs=json.dumps(kwargs),
+        )
+
+    def add(self, time: datetime, temp: float):
+        self.db.execute("INSERT INTO weather VALUES (?, ?)", (time, temp))
+
+    def update(self) -> list:
+        with mock.patch("pyobs_weather.weather.stations.mysql.BATCH_SIZE", 2):
+            return update_station("mysql")
+
+    def test_ties_across_batches(self):
+        # first update only reads latest row
+        t0 = datetime(2024, 1, 1)
+        self.add(t0, 0.0)
+        self.assertEqual(self.update(), [0.0])
+
+        # a batch ends between rows with the same time, none of them is lost or read twice
+        t1 = t0 + timedelta(seconds=10)
+        for temp in (1.0, 2.0, 3.0):
+            self.add(t1, temp)
+        self.add(t1 + timedelta(seconds=10), 4.0)
+        self.assertEqual(self.update(), [1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(self.update(), [])
+
+
+class RollupTest(TestCase):
+    def setUp(self):
+        self.client = mock.Mock()
+        for name, value in (("get_client", lambda: self.client), ("ROLLUP_DELAY", 600), ("ROLLUP_BACKFILL", 7)):
+            patcher = mock.patch.object(rollup, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def queries(self) -> list:
+        return [c.kwargs["query"] for c in self.client.query_api.return_value.query.call_args_list]
+
+    def test_windows(self):
+        # only complete windows that ended more than ROLLUP_DELAY ago, starting ROLLUP_BACKFILL days ago
+        now = datetime(2024, 1, 10, 12, 7, tzinfo=timezone.utc)
+        rollup.run_rollups(now)
+        marks = {m.resolution: (m.start, m.time) for m in RollupWatermark.objects.all()}
+        self.assertEqual(
+            marks,
+            {
+                "5m": (
+                    datetime(2024, 1, 3, 12, 5, tzinfo=timezone.utc),
+                    datetime(2024, 1, 10, 11, 55, tzinfo=timezone.utc),
+                ),
+                "1h": (datetime(2024, 1, 3, 13, tzinfo=timezone.utc), datetime(2024, 1, 10, 11, tzinfo=timezone.utc)),
+                "1d": (datetime(2024, 1, 4, tzinfo=timezone.utc), datetime(2024, 1, 10, tzinfo=timezone.utc)),
+            },
+        )
+
+        # raw data in chunks of a day, coarser ones from shifted windows of the finer resolution
+        queries = self.queries()
+        self.assertEqual(len(queries), 7 + 1 + 1)
+        self.assertIn("range(start: 2024-01-03T12:05:00Z, stop: 2024-01-04T12:05:00Z)", queries[0])
+        self.assertIn("range(start: 2024-01-03T13:05:00Z,", queries[7])
+        self.assertIn("timeShift(duration: -300s)", queries[7])
+
+        # nothing new to roll up, until the next window is complete
+        rollup.run_rollups(now + timedelta(minutes=2))
+        self.assertEqual(len(self.queries()), 9)
+        rollup.run_rollups(now + timedelta(minutes=4))
+        self.assertEqual(len(self.queries()), 11)
+        self.assertIn("range(start: 2024-01-10T11:55:00Z, stop: 2024-01-10T12:00:00Z)", self.queries()[9])
+
+    def test_choose_resolution(self):
+        start, end = datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 1, 31, tzinfo=timezone.utc)
+        for name in ("1h", "1d"):
+            RollupWatermark.objects.create(resolution=name, start=start, time=end)
+        with mock.patch.object(rollup, "ROLLUP", True):
+            self.assertEqual(rollup.choose_resolution(start, end, 500)[1], 3600)
+            self.assertEqual(rollup.choose_resolution(start, end, 20)[1], 86400)
+            self.assertEqual(rollup.choose_resolution(start - timedelta(days=1), end, 20)[1], 300)
+        self.assertEqual(rollup.choose_resolution(start, end, 20)[1], 300)
+
+
+class RegistryTest(TestCase):
+    def setUp(self):
+        self.addCleanup(registry._entries.clear)
+        self.station = create_station()
+
+    def test_reuse(self):
+        # instance is kept, also when the station stores its state
+        obj = get_station("test")
+        self.assertIs(get_station("test"), obj)
+        with mock.patch.object(registry, "STATION_REGISTRY_TTL", 0):
+            obj._save_state({"position": 1})
+            self.assertIs(get_station("test"), obj)
+
+            # state changed by another process is refreshed
+            Station.objects.filter(id=self.station.id).update(state={"position": 2})
+            self.assertEqual(get_station("test").station.state, {"position": 2})
+
+    def test_saved(self):
+        # saving the station or one of its sensors rebuilds the instance
+        obj = get_station("test")
+        self.station.name = "changed"
+        self.station.save()
+        changed = get_station("test")
+        self.assertIsNot(changed, obj)
+        Sensor.objects.filter(station=self.station).first().save()
+        self.assertIsNot(get_station("test"), changed)
+
+    def test_changed_in_database(self):
+        # changes without signals are only noticed after STATION_REGISTRY_TTL
+        obj = get_station("test")
+        Station.objects.filter(id=self.station.id).update(kwargs='{"x": 1}')
+        self.assertIs(get_station("test"), obj)
+        with mock.patch.object(registry, "STATION_REGISTRY_TTL", 0):
+            self.assertIsNot(get_station("test"), obj)
+
+
+class CSVTest(TestCase):
+    def setUp(self):
+        self.addCleanup(registry._entries.clear)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.filename = os.path.join(tmp.name, "weather.csv")
+        self.write(1, 2)
+
+        # station
+        kwargs = {"filename": self.filename, "columns": {"1": {"code": "temp"}}}
+        Station.objects.create(
+            code="csv", name="CSV", class_name="pyobs_weather.weather.stations.CSV", kwargs=json.dumps(kwargs)
+        )
+
+    def write(self, *temps, mode: str = "a", newline: bool = True):
+        with open(self.filename, mode) as f:
+            f.write("\n".join("2024-01-01T00:00:%02dZ,%.1f" % (t, t) for t in temps) + ("\n" if newline else ""))
+
+    def test_append(self):
+        # first update only reads last line, then all appended complete lines
+        self.assertEqual(update_station("csv"), [2.0])
+        self.write(3, 4)
+        self.write(5, newline=False)
+        self.assertEqual(update_station("csv"), [3.0, 4.0])
+        self.write()
+        self.assertEqual(update_station("csv"), [5.0])
+
+    def test_other_process(self):
+        # instances in other worker processes continue where the last update stopped
+        station = Station.objects.get(code="csv")
+        other = CSV(**json.loads(station.kwargs), station=Station.objects.get(code="csv"))
+        self.assertEqual(update_station("csv"), [2.0])
+        self.write(3)
+        self.assertEqual(update_station("csv", other), [3.0])
+        self.write(4)
+        self.assertEqual(update_station("csv"), [4.0])
+
+    def test_truncated(self):
+        self.assertEqual(update_station("csv"), [2.0])
+        self.write(3, mode="w")
+        with self.assertLogs("pyobs_weather.weather.stations.csv", "WARNING"):
+            self.assertEqual(update_station("csv"), [3.0])
+
+    def test_rotated(self):
+        # rest of old file is read, then new file from start
+        self.assertEqual(update_station("csv"), [2.0])
+        self.write(3)
+        os.rename(self.filename, self.filename + ".1")
+        self.write(4, 5)
+        self.assertEqual(update_station("csv"), [3.0, 4.0, 5.0])
+        self.assertEqual(update_station("csv"), [])
+
+
+class FakeArchive:
+    """Replaces the Mt. Locke weather archive with one row per minute, including both ends of requested range."""
+
+    def __init__(self):
+        self.requests = []
+        self.closed = 0
+
+    def request(self, method, url, data=None, **kwargs):
+        return self.post(url, data=data)
+
+    def post(self, url, data=None, **kwargs):
+        self.requests.append((data["starttime"], data["endtime"]))
+        times = range(int(np.ceil(data["starttime"] / 60)) * 60, int(data["endtime"]) + 1, 60)
+        lines = [
+            "%s,%.1f" % (datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"), t / 60) for t in times
+        ]
+        return mock.Mock(status_code=200, headers={}, content="\n".join(["time,Temp-Out"] + lines).encode())
+
+    def close(self):
+        self.closed += 1
+
+
+class McDonaldLockeArchiveTest(TestCase):
+    def setUp(self):
+        kwargs = {"fields": {"Temp+Out": {"code": "temp"}}}
+        station = Station.objects.create(
+            code="mcd",
+            name="mcd",
+            class_name="pyobs_weather.weather.stations.McDonaldLockeArchive",
+            kwargs=json.dumps(kwargs),
+        )
+        self.obj = McDonaldLockeArchive(**kwargs, station=station)
+        self.archive = FakeArchive()
+        patcher = mock.patch.object(http, "get_session", lambda: self.archive)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def update(self, last: datetime) -> list:
+        self.obj._save_state({"time": last.isoformat()})
+        return update_station("mcd", self.obj)
+
+    def test_catch_up(self):
+        # all rows since last written one are fetched
+        last = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(hours=2)
+        written = self.update(last)
+        self.assertGreaterEqual(len(written), 120)
+        self.assertEqual(written, [last.timestamp() / 60 + i for i in range(1, len(written) + 1)])
+        self.assertEqual(
+            self.obj._load_state()["time"], datetime.fromtimestamp(written[-1] * 60, timezone.utc).isoformat()
+        )
+
+    def test_max_window(self):
+        # gaps longer than MAX_WINDOW are not caught up, only the last WINDOW is fetched
+        last = datetime.now(timezone.utc) - timedelta(seconds=MAX_WINDOW + 3600)
+        with self.assertLogs("pyobs_weather.weather.stations.mcdlockearchive", "WARNING"):
+            written = self.update(last)
+        start, end = self.archive.requests[0]
+        self.assertAlmostEqual(end - start, WINDOW)
+        self.assertEqual(len(written), WINDOW // 60)
+
+    def test_backfill(self):
+        # chunks overlap at their boundaries, but every row is written exactly once and in order
+        written, stats = [], http.get_stats().get("mcd")
+        start, end = datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 1, 1, 3, tzinfo=timezone.utc)
+        with (
+            mock.patch("pyobs_weather.weather.stations.station.write_sensor_rows") as write,
+            mock.patch.object(requests, "Session", return_value=self.archive),
+        ):
+            write.side_effect = lambda station, rows: written.extend(t for t, _ in rows)
+            count = self.obj.backfill(start, end, chunk=timedelta(hours=1), workers=3)
+        self.assertEqual(count, 181)
+        self.assertEqual(written, [start + timedelta(minutes=i) for i in range(181)])
+        self.assertEqual(len(self.archive.requests), 3)
+        self.assertGreater(self.archive.closed, 0)
+        self.assertEqual(http.get_stats().get("mcd"), stats)
@@ -1,8 +1,24 @@
 import importlib
 import logging
 
+from django.conf import settings
+
 log = logging.getLogger(__name__)
 
+# cache backends that only live in the memory of a single process
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+# cache backends that increment values atomically, also between processes
+ATOMIC_INCR_BACKENDS = (
+    "django.core.cache.backends.redis.RedisCache",
+    "django.core.cache.backends.memcached.PyMemcacheCache",
+    "django.core.cache.backends.memcached.PyLibMCCache",
+    "django_redis.cache.RedisCache",
+)
+
 
 def get_class(class_name):
     # get module and class name
@@ -11,3 +27,31 @@ def get_class(class_name):
 
     # import
     return getattr(importlib.import_module(module), class_name)
+
+
+def is_shared_cache(alias: str = "default") -> bool:
+    """Whether a cache is shared between processes, e.g. between gunicorn and Celery workers.
+
+    This can be overridden with a SHARED entry in the configuration of the cache, e.g. for a local cache that is only
+    used from a single process.
+
+    Args:
+        alias: Alias of cache in CACHES.
+
+    Returns:
+        False, if each process has its own cache.
+    """
+    config = settings.CACHES[alias]
+    return config.get("SHARED", config["BACKEND"] not in LOCAL_CACHE_BACKENDS)
+
+
+def has_atomic_incr(alias: str = "default") -> bool:
+    """Whether cache.incr() is atomic for a cache, so that concurrent processes never get the same value.
+
+    Args:
+        alias: Alias of cache in CACHES.
+
+    Returns:
+        True, if values are incremented by the cache server itself.
+    """
+    return settings.CACHES[alias]["BACKEND"] in ATOMIC_INCR_BACKENDS
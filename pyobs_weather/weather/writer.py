@@ -0,0 +1,186 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from influxdb_client.client.write_api import WriteApi
+from influxdb_client.rest import ApiException
+
+from pyobs_weather.weather.metrics import INFLUX_SECONDS, WRITER_EVENTS
+
+log = logging.getLogger(__name__)
+
+
+class BatchingWriter:
+    """Writes records to Influx in batches from a background thread.
+
+    Records are put into a bounded queue and written whenever a batch is full or the flush interval has passed.
+    It can be used in place of a synchronous WriteApi, since write() has the same signature.
+    """
+
+    def __init__(
+        self,
+        write_api: WriteApi,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        queue_size: int = 10000,
+        queue_timeout: float = 5.0,
+        max_retries: int = 5,
+        retry_interval: float = 1.0,
+    ):
+        """Creates a new batching writer.
+
+        Args:
+            write_api: Synchronous write API to use for actually writing batches.
+            batch_size: Maximum number of records per write.
+            flush_interval: Maximum time in seconds a record waits in queue before it's written.
+            queue_size: Maximum number of records in queue.
+            queue_timeout: Time in seconds to wait for free space in a full queue before dropping a record.
+            max_retries: Number of retries for a failed write.
+            retry_interval: Delay in seconds before first retry, doubled for every further retry.
+        """
+        self._write_api = write_api
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue_size = queue_size
+        self._queue_timeout = queue_timeout
+        self._max_retries = max_retries
+        self._retry_interval = retry_interval
+
+        # queue and thread get created on first write, so that this works in forked worker processes
+        self._pid: Optional[int] = None
+        self._queue: "queue.Queue[Tuple[str, str, Any]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+        # statistics
+        self._stats: Dict[str, float] = {
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "retries": 0,
+            "flushes": 0,
+            "flush_seconds": 0.0,
+            "last_flush_seconds": 0.0,
+        }
+
+    def _start(self) -> None:
+        """Start background thread, if not running in this process."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue(maxsize=self._queue_size)
+                self._closed.clear()
+                self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+                self._thread.start()
+
+    def write(self, bucket: str, org: str, record: Any) -> None:
+        """Queue record(s) for writing.
+
+        Args:
+            bucket: Bucket to write to.
+            org: Organization of bucket.
+            record: Single record or list of records.
+        """
+        self._start()
+        for r in record if isinstance(record, list) else [record]:
+            try:
+                self._queue.put((bucket, org, r), timeout=self._queue_timeout)
+            except queue.Full:
+                self._count("dropped")
+                log.warning("Influx write queue is full, dropping record.")
+
+    def flush(self) -> None:
+        """Blocks until all queued records have been written."""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self) -> None:
+        """Write all queued records and stop background thread."""
+        if self._pid == os.getpid() and self._thread is not None:
+            # wake up thread, so that it doesn't wait for the flush interval
+            self._closed.set()
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._pid = None
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        """Statistics about queue depth, written records and flush latency."""
+        return dict(self._stats, queue_depth=self._queue.qsize())
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        """Update statistics and metrics."""
+        self._stats[key] += amount
+        WRITER_EVENTS.labels(result=key).inc(amount)
+
+    def _run(self) -> None:
+        """Collect batches from queue and write them, until closed and queue is empty."""
+        while not (self._closed.is_set() and self._queue.empty()):
+            # collect batch until it's full or flush interval has passed
+            batch: List[Tuple[str, str, Any]] = []
+            deadline = time.monotonic() + self._flush_interval
+            while len(batch) < self._batch_size:
+                try:
+                    timeout = max(0.0, deadline - time.monotonic())
+                    item = self._queue.get(timeout=0 if self._closed.is_set() else timeout)
+                except queue.Empty:
+                    break
+
+                # woken up by close()?
+                if item is None:
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+
+            # write it
+            if len(batch) > 0:
+                self._write_batch(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: List[Tuple[str, str, Any]]) -> None:
+        """Write a batch of records, grouped by bucket and organization.
+
+        Args:
+            batch: List of (bucket, org, record) tuples.
+        """
+        start = time.monotonic()
+
+        # group records
+        groups: Dict[Tuple[str, str], List[Any]] = {}
+        for bucket, org, record in batch:
+            groups.setdefault((bucket, org), []).append(record)
+
+        # write them
+        for (bucket, org), records in groups.items():
+            for attempt in range(self._max_retries + 1):
+                try:
+                    self._write_api.write(bucket=bucket, org=org, record=records)
+                    self._count("written", len(records))
+                    break
+                except Exception as e:
+                    # don't retry client errors except for "too many requests"
+                    client_error = isinstance(e, ApiException) and 400 <= (e.status or 0) < 500 and e.status != 429
+                    if client_error or attempt == self._max_retries:
+                        self._count("failed", len(records))
+                        log.error("Could not write %d records to Influx: %s", len(records), e)
+                        break
+
+                    # wait and retry
+                    self._count("retries")
+                    time.sleep(self._retry_interval * 2**attempt)
+
+        # statistics
+        duration = time.monotonic() - start
+        self._stats["flushes"] += 1
+        self._stats["flush_seconds"] += duration
+        self._stats["last_flush_seconds"] = duration
+        INFLUX_SECONDS.labels(operation="write_batch").observe(duration)
+
+
+__all__ = ["BatchingWriter"]